@@ -0,0 +1,155 @@
+import io
+import warnings
+import numpy as np
+
+import downsample
+import run_log
+
+# Loading and analysing the data saved by the program
+# Replaces the csv.reader loops in the notebook with a single vectorized parse per file
+
+class RunData:
+    """
+    The data from one run as column arrays. times is in seconds, temps has one column per channel. dutyCycles,
+    stepTemps, and statuses have the same shape as temps, or are None if the file doesn't have them. Missing values
+    are NaN.
+    """
+    def __init__(self, times : np.ndarray, temps : np.ndarray, dutyCycles : np.ndarray=None,
+                 stepTemps : np.ndarray=None, statuses : np.ndarray=None, fileName : str=None):
+        self.times = times
+        self.temps = temps
+        self.dutyCycles = dutyCycles
+        self.stepTemps = stepTemps
+        self.statuses = statuses
+        self.fileName = fileName
+
+    @property
+    def numChannels(self) -> int:
+        return self.temps.shape[1]
+
+    @property
+    def minutes(self) -> np.ndarray:
+        return self.times / 60
+
+    def _select(self, index) -> 'RunData':
+        return RunData(self.times[index], self.temps[index],
+                       None if self.dutyCycles is None else self.dutyCycles[index],
+                       None if self.stepTemps is None else self.stepTemps[index],
+                       None if self.statuses is None else self.statuses[index], self.fileName)
+
+    def between(self, startTime : float=None, endTime : float=None) -> 'RunData':
+        """Returns the part of the run with startTime <= time < endTime (in seconds), either end can be None."""
+        lo = 0 if startTime is None else np.searchsorted(self.times, startTime, side="left")
+        hi = len(self.times) if endTime is None else np.searchsorted(self.times, endTime, side="left")
+        return self._select(slice(lo, hi))
+
+    def decimate(self, factor : int, how : str="every") -> 'RunData':
+        """
+        Returns the run with factor times fewer rows. how is "every" to keep every factor-th row, or "mean" to
+        average each block of factor rows (ignoring NaNs; statuses keep the worst value in the block).
+        """
+        if factor <= 1:
+            return self
+        if how == "every":
+            return self._select(slice(None, None, factor))
+        numBlocks = len(self.times) // factor
+        def block_mean(a : np.ndarray) -> np.ndarray:
+            if a is None:
+                return None
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)   # blocks that are all NaN stay NaN
+                return np.nanmean(a[:numBlocks * factor].reshape(numBlocks, factor, *a.shape[1:]), axis=1)
+        statuses = None
+        if self.statuses is not None:
+            statuses = self.statuses[:numBlocks * factor].reshape(numBlocks, factor, -1).max(axis=1)
+        return RunData(block_mean(self.times), block_mean(self.temps), block_mean(self.dutyCycles),
+                       block_mean(self.stepTemps), statuses, self.fileName)
+
+    def mask_out_of_range(self, lo : float=-np.inf, hi : float=np.inf) -> 'RunData':
+        """Returns the run with temperatures outside of [lo, hi] (e.g. bad thermocouple readings) set to NaN."""
+        temps = np.where((self.temps >= lo) & (self.temps <= hi), self.temps, np.nan)
+        return RunData(self.times, temps, self.dutyCycles, self.stepTemps, self.statuses, self.fileName)
+
+    def plot_points(self, channel : int, numPoints : int=2000, how : str="minmax",
+                    values : str="temps") -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (minutes, values) for one channel cut down to about numPoints points for plotting a whole run. how is
+        "minmax" to keep the lowest and highest value of each stretch (every spike is kept), or "lttb" to keep exactly
+        numPoints points that follow the shape of the line. values is the column to use ("temps", "dutyCycles", or
+        "stepTemps").
+        """
+        y = getattr(self, values)[:, channel]
+        if how == "lttb":
+            return downsample.lttb(self.minutes, y, numPoints)
+        return downsample.min_max(self.minutes, y, numPoints // 2)
+
+def plot_run(run : RunData, ax=None, numPoints : int=2000, how : str="minmax"):
+    """
+    Plots every channel's temperature against time in minutes, downsampled with RunData.plot_points so runs of tens of
+    thousands of rows plot as fast as short ones. Draws on ax if given, otherwise on a new figure. Needs matplotlib.
+
+    returns: the axes plotted on
+    """
+    if ax is None:
+        import matplotlib.pyplot as plt
+        _, ax = plt.subplots()
+    for channel in range(run.numChannels):
+        ax.plot(*run.plot_points(channel, numPoints, how), label="Heater tape {}".format(channel + 1))
+    ax.set_xlabel("Time (minutes)")
+    ax.set_ylabel("Temperature (C)")
+    ax.legend()
+    return ax
+
+def load_run(fileName : str, dutyColumns : list[int]=None) -> RunData:
+    """
+    Loads a run saved by the program, either a csv file or a binary run log, into a RunData.
+
+    fileName: the file to load
+    dutyColumns: for csv files, the (0 based) columns that hold duty cycles instead of temperatures, like the ones in
+    the variac experiments. Every other column after the time is a channel's temperature.
+    """
+    if fileName.endswith(run_log.FILE_EXTENSION):
+        _, records = run_log.load_run_log(fileName)
+        return RunData(records["time"], records["temp"], records["duty"], records["step"], records["status"],
+                       fileName)
+
+    columns = load_csv_columns(fileName)
+    dutyColumns = [] if dutyColumns is None else list(dutyColumns)
+    tempColumns = [c for c in range(1, columns.shape[1]) if c not in dutyColumns]
+    return RunData(columns[:, 0], columns[:, tempColumns],
+                   columns[:, dutyColumns] if len(dutyColumns) > 0 else None, fileName=fileName)
+
+def load_csv_columns(fileName : str) -> np.ndarray:
+    """
+    Parses a csv file of numbers into a 2d array in one go. "None" and empty values become NaN, and rows with the
+    wrong number of values (e.g. a partly written last line of a run that crashed) are left out.
+    """
+    with open(fileName, "rb") as file:
+        text = file.read().replace(b"None", b"nan")
+    try:
+        return np.loadtxt(io.BytesIO(text), delimiter=",", ndmin=2)
+    except ValueError:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", np.exceptions.ConversionWarning if hasattr(np, "exceptions") 
+                                  else np.ConversionWarning)
+            return np.genfromtxt(io.BytesIO(text), delimiter=",", invalid_raise=False, ndmin=2)
+
+def cooling_curve(t : np.ndarray, tau : float, env : float, start : float) -> np.ndarray:
+    """Newton's law of cooling: the temperature at time t starting at start and cooling to env with time constant tau."""
+    return env + (start - env) * np.exp(-t / tau)
+
+def fit_cooling_time_constant(times : np.ndarray, temps : np.ndarray,
+                              p0 : tuple[float, float, float]=(100, 22, 42)) -> tuple[float, float, float, float]:
+    """
+    Fits cooling_curve to a stretch of free cooling (heater off) like the notebook does. times should be in the units
+    the time constant is wanted in (the notebook uses minutes). NaNs are ignored. Needs scipy.
+
+    p0: the initial guess for (tau, env, start)
+
+    returns: tau, env, start, and the standard error of tau
+    """
+    from scipy.optimize import curve_fit
+
+    valid = ~(np.isnan(times) | np.isnan(temps))
+    params, covariance = curve_fit(cooling_curve, times[valid] - times[valid][0], temps[valid], p0=p0)
+    return params[0], params[1], params[2], np.sqrt(covariance[0][0])
@@ -0,0 +1,370 @@
+import glob
+import json
+import os
+import sys
+import time
+import numpy as np
+
+import analysis
+import constants
+import run_log
+
+# Proposing a ki and ramp rate for each heater tape from the runs it has already done
+# Every run in a folder (the program's binary run logs, and csvs with duty cycle columns like the variac experiments)
+# is averaged onto a AUTOTUNE_SAMPLE_INTERVAL grid, and a first order plus dead time (FOPDT) model
+#   dT/dt = (ambient + gain * duty(t - deadTime) - T) / tau
+# is fit to each tape of each run by linear least squares, for every run and tape at once and every dead time tried.
+# Each tape's models are combined, and bakes with a grid of kis and rates are simulated on it with the ControlEngine
+# (the same stepping, safety, and PID logic as System.run), to find the ki and rate that settle soonest without
+# overshooting by more than AUTOTUNE_MAX_OVERSHOOT. The runs only need the heater to have been switched enough to tell
+# heating from cooling, which any bake or duty cycle experiment does.
+# The csv files the program writes have no duty cycles, so only run logs (constants.LOG_FORMAT "binary") can be used.
+# Run with: python autotune.py [folder] [--target 150] [--duty-columns 5 6 7 8] [--output file]
+
+# The models fit to a set of temperature series, as arrays with one value per series
+class FopdtFit:
+    """
+    tau: the time constant in seconds
+    gain: how many degrees above ambient the tape settles at with its heater always on
+    ambient: the temperature it cools to with the heater off
+    deadTime: how long in seconds after the heater changes the temperature starts to follow
+    r2: the fraction of the variance of the rate of change that the model explains
+    numSamples: how many samples the fit used
+    A series that couldn't be fit (too short, the heater never changed, or the fit isn't a stable heater) is NaN.
+    """
+    def __init__(self, tau : np.ndarray, gain : np.ndarray, ambient : np.ndarray, deadTime : np.ndarray,
+                 r2 : np.ndarray, numSamples : np.ndarray):
+        self.tau = tau
+        self.gain = gain
+        self.ambient = ambient
+        self.deadTime = deadTime
+        self.r2 = r2
+        self.numSamples = numSamples
+
+    def valid(self) -> np.ndarray:
+        return ~np.isnan(self.tau)
+
+def bin_means(bins : np.ndarray, values : np.ndarray, numBins : int) -> np.ndarray:
+    """
+    Returns the mean of the values (rows, columns) falling in each bin (numBins, columns), ignoring NaNs. A bin without
+    values is NaN.
+    """
+    numColumns = values.shape[1]
+    valid = ~np.isnan(values)
+    index = (bins[:, None] * numColumns + np.arange(numColumns)).ravel()
+    sums = np.bincount(index, weights=np.where(valid, values, 0).ravel(), minlength=numBins * numColumns)
+    counts = np.bincount(index, weights=valid.ravel(), minlength=numBins * numColumns)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts).reshape(numBins, numColumns)
+
+def resample(run : analysis.RunData, sampleInterval : float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the temperatures and duty cycles of a run averaged over each sampleInterval (samples, channels). The duty
+    cycle of an inoperable system is 0, since its SSR isn't run, and impossible readings are NaN.
+    """
+    run = run.mask_out_of_range(0.25, 1023.75)  # what the MAX6675 can read, 0 is usually a loose thermocouple
+    duties = run.dutyCycles.astype(np.float64)
+    if run.statuses is not None:
+        duties = np.where(run.statuses == int(constants.OPERATION_STATUSES.INOPERABLE), 0.0, duties)
+    keep = ~np.isnan(run.times)
+    bins = np.floor((run.times[keep] - run.times[keep][0]) / sampleInterval).astype(np.int64)
+    numBins = int(bins[-1]) + 1 if len(bins) > 0 else 0
+    return (bin_means(bins, run.temps[keep].astype(np.float64), numBins),
+            bin_means(bins, duties[keep], numBins))
+
+def fit_fopdt(temps : np.ndarray, duties : np.ndarray, sampleInterval : float=constants.AUTOTUNE_SAMPLE_INTERVAL,
+              maxDeadTime : float=constants.AUTOTUNE_MAX_DEAD_TIME) -> FopdtFit:
+    """
+    Fits a FOPDT model to every series at once. temps and duties are (series, samples), one sampleInterval apart, NaN
+    where there is no sample (e.g. the padding after a shorter series). For every dead time from 0 to maxDeadTime in
+    steps of sampleInterval the rate of change is regressed on the temperature, the delayed duty cycle, and a constant,
+    and each series keeps the dead time with the smallest mean squared residual.
+    """
+    numSeries, numSamples = temps.shape
+    rates = (temps[:, 1:] - temps[:, :-1]) / sampleInterval
+    current = temps[:, :-1]
+    bestError = np.full(numSeries, np.inf)
+    bestCoefficients = np.full((numSeries, 3), np.nan)
+    bestDelay = np.zeros(numSeries, dtype=np.int64)
+    bestCount = np.zeros(numSeries, dtype=np.int64)
+    for delay in range(int(maxDeadTime // sampleInterval) + 1):
+        delayed = np.full_like(current, np.nan)
+        delayed[:, delay:] = duties[:, :numSamples - 1 - delay]
+        valid = ~(np.isnan(rates) | np.isnan(current) | np.isnan(delayed))
+        count = valid.sum(axis=1)
+        X = np.stack([np.where(valid, current, 0), np.where(valid, delayed, 0), valid.astype(np.float64)], axis=-1)
+        y = np.where(valid, rates, 0)
+        A = np.einsum("snk,snj->skj", X, X)
+        b = np.einsum("snk,sn->sk", X, y)
+        # a heater that never changed (or too few samples) can't separate the gain from the ambient temperature
+        with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+            solvable = (count > 10) & (np.linalg.cond(A) < 1e12)
+        A[~solvable] = np.eye(3)
+        b[~solvable] = 0
+        coefficients = np.linalg.solve(A, b[..., None])[..., 0]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            error = ((y * y).sum(axis=1) - (coefficients * b).sum(axis=1)) / count
+        better = solvable & (error < bestError)
+        bestError[better] = error[better]
+        bestCoefficients[better] = coefficients[better]
+        bestDelay[better] = delay
+        bestCount[better] = count[better]
+
+    a, b, c = bestCoefficients[:, 0], bestCoefficients[:, 1], bestCoefficients[:, 2]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        tau = -1 / a
+        gain = -b / a
+        ambient = -c / a
+        variance = np.nanvar(np.where(np.isnan(current), np.nan, rates), axis=1)
+        r2 = 1 - bestError / variance
+    stable = (a < 0) & (gain > 0)
+    tau[~stable] = np.nan
+    return FopdtFit(tau, np.where(stable, gain, np.nan), np.where(stable, ambient, np.nan),
+                    np.where(stable, bestDelay * sampleInterval, np.nan), np.where(stable, r2, np.nan), bestCount)
+
+def channel_names(fileName : str, numChannels : int) -> list[str]:
+    """
+    The names of a run's channels, from the copy of the channel definitions saved next to it, or "Heater tape <n>" if
+    there isn't one, so the same tape can be matched across runs.
+    """
+    copyName = os.path.splitext(fileName)[0] + constants.CHANNELS_COPY_EXTENSION
+    names = ["Heater tape {}".format(i + 1) for i in range(numChannels)]
+    if os.path.exists(copyName):
+        with open(copyName) as file:
+            for i, channel in enumerate(json.load(file)["channels"][:numChannels]):
+                names[i] = channel.get("name", names[i])
+    return names
+
+def load_archive(folder : str, dutyColumns : list[int]=None,
+                 sampleInterval : float=constants.AUTOTUNE_SAMPLE_INTERVAL) -> tuple[np.ndarray, np.ndarray, list]:
+    """
+    Loads every run in the folder that has duty cycles and resamples it (see resample).
+
+    dutyColumns: the duty cycle columns of the csv files (see analysis.load_run), each drives the temperature column
+    in the same position, or all of them if there is only one. csv files without them are skipped.
+
+    returns: the temperatures and duty cycles as (series, samples) arrays padded with NaN, and the (file, tape name)
+    of each series
+    """
+    fileNames = sorted(glob.glob(os.path.join(folder, "*" + run_log.FILE_EXTENSION)))
+    if dutyColumns is not None:
+        fileNames += sorted(glob.glob(os.path.join(folder, "*.csv")))
+    tempSeries, dutySeries, labels = [], [], []
+    for fileName in fileNames:
+        try:
+            run = analysis.load_run(fileName, dutyColumns if fileName.endswith(".csv") else None)
+        except (ValueError, OSError) as e:
+            print("Skipping {}: {}".format(fileName, e))
+            continue
+        if run.dutyCycles is None or len(run.times) < 2:
+            continue
+        if run.dutyCycles.shape[1] == 1:
+            run.dutyCycles = np.repeat(run.dutyCycles, run.numChannels, axis=1)
+        elif run.dutyCycles.shape != run.temps.shape:
+            print("Skipping {}: {} duty cycle columns for {} temperature columns".format(
+                fileName, run.dutyCycles.shape[1], run.numChannels))
+            continue
+        temps, duties = resample(run, sampleInterval)
+        for channel, name in enumerate(channel_names(fileName, run.numChannels)):
+            tempSeries.append(temps[:, channel])
+            dutySeries.append(duties[:, channel])
+            labels.append((fileName, name))
+
+    numSamples = max((len(series) for series in tempSeries), default=0)
+    temps = np.full((len(tempSeries), numSamples), np.nan)
+    duties = np.full((len(tempSeries), numSamples), np.nan)
+    for i, (tempSerie, dutySerie) in enumerate(zip(tempSeries, dutySeries)):
+        temps[i, :len(tempSerie)] = tempSerie
+        duties[i, :len(dutySerie)] = dutySerie
+    return temps, duties, labels
+
+def rate_limit(fit : FopdtFit, targetTemp : float, headroom : float=constants.AUTOTUNE_DUTY_HEADROOM) -> np.ndarray:
+    """
+    The fastest ramp in degrees per minute each model can still follow on its way up to targetTemp while using at most
+    headroom of the duty cycle. It is slowest at the top, so this is the rate there (0 if it can't get there at all).
+    """
+    return np.maximum(0, 60 * (fit.ambient + headroom * fit.gain - targetTemp) / fit.tau)
+
+# Heater tapes following FOPDT models, moved forward a period at a time, for simulating bakes with the models
+class FopdtPlant:
+    """
+    The temperatures of tapes following the models of a FopdtFit (one tape per model). Each step applies the duty
+    cycles from each model's dead time ago for one period, using the exact solution for a constant heater power.
+    """
+    def __init__(self, fit : FopdtFit, startTemps : np.ndarray=None, period : float=constants.SET_PERIOD):
+        """
+        fit: the model of each tape
+        startTemps: the temperature each tape starts at, its ambient temperature if None
+        period: the seconds each step moves the tapes forward by
+        """
+        self.fit = fit
+        self.temps = np.array(fit.ambient if startTemps is None else startTemps, dtype=np.float64)
+        self.delays = np.round(fit.deadTime / period).astype(np.int64)
+        self.decay = np.exp(-period / fit.tau)
+        self.pastDuties = np.zeros((len(self.temps), int(self.delays.max()) + 1))
+        self.stepNum = 0
+
+    def readings(self) -> np.ndarray:
+        """Returns what the tapes' MAX6675s read, their temperatures rounded to 0.25 degrees."""
+        return np.round(self.temps * 4) / 4
+
+    def step(self, duties : np.ndarray) -> np.ndarray:
+        """Runs each tape's heater at the given duty cycle for the next period and returns the new temperatures."""
+        numPast = self.pastDuties.shape[1]
+        self.pastDuties[:, self.stepNum % numPast] = duties
+        duty = np.where(self.stepNum >= self.delays,
+                        self.pastDuties[np.arange(len(self.temps)), (self.stepNum - self.delays) % numPast], 0)
+        settled = self.fit.ambient + self.fit.gain * duty
+        self.temps = settled + (self.temps - settled) * self.decay
+        self.stepNum += 1
+        return self.temps
+
+def simulate_bakes(fit : FopdtFit, targetTemp : float, kis : np.ndarray, rates : np.ndarray,
+                   settleBand : float=constants.AUTOTUNE_SETTLE_BAND,
+                   settleTime : float=constants.AUTOTUNE_SETTLE_TIME) -> dict[str, np.ndarray]:
+    """
+    Simulates a bake from the ambient temperature up to targetTemp for every model with every pair of ki and rate in
+    (kis[i], rates[i]), all at once. The control logic is the ControlEngine's (the same as System.run), run once a
+    SET_PERIOD, with the readings rounded to the MAX6675's 0.25 degrees and the SSRs following the duty cycles after
+    each model's dead time. fit, kis, and rates all have one value per simulated bake.
+
+    returns: for each bake, the seconds from pressing Go until it stayed within settleBand of targetTemp ("settling",
+    infinite if it never did), the most it went over targetTemp ("overshoot"), and whether the safety checks ever put
+    it on hold or made it inoperable ("tripped")
+    """
+    from control_engine import ControlEngine
+
+    numBakes = len(kis)
+    engine = ControlEngine(numBakes)
+    engine.desiredTemp[:] = targetTemp
+    engine.stepToTemp[:] = targetTemp
+    engine.desiredRate[:] = rates
+    engine.ki[:] = kis
+    engine.steppingUp[:] = True
+    engine.maxAcceptableTemp[:] = targetTemp + constants.UNACCEPTABLE_TEMP_OVERSHOOT
+
+    plant = FopdtPlant(fit)
+    rampTime = np.max((targetTemp - fit.ambient) / rates) * 60
+    numIterations = int((rampTime + settleTime) / constants.SET_PERIOD)
+
+    overshoot = np.full(numBakes, -np.inf)
+    lastOutsideBand = np.zeros(numBakes)
+    tripped = np.zeros(numBakes, dtype=bool)
+    operable = int(constants.OPERATION_STATUSES.OPERABLE)
+    inoperable = int(constants.OPERATION_STATUSES.INOPERABLE)
+    for iterationNum in range(numIterations):
+        timeElapsed = constants.TOTAL_STARTUP_TIME + iterationNum * constants.SET_PERIOD
+        engine.step(timeElapsed, constants.SET_PERIOD, plant.readings())
+        tripped |= engine.operation_status != operable
+        temps = plant.step(np.where(engine.operation_status == inoperable, 0, engine.computedDutyCycle))
+        overshoot = np.maximum(overshoot, temps - targetTemp)
+        lastOutsideBand[np.abs(temps - targetTemp) > settleBand] = (iterationNum + 1) * constants.SET_PERIOD
+    settling = np.where(lastOutsideBand < numIterations * constants.SET_PERIOD, lastOutsideBand, np.inf)
+    return {"settling": settling, "overshoot": overshoot, "tripped": tripped}
+
+def propose(fit : FopdtFit, targetTemp : float, numKis : int=10,
+            rateFractions : tuple[float, ...]=(1, 0.75, 0.5, 0.35, 0.25),
+            maxOvershoot : float=constants.AUTOTUNE_MAX_OVERSHOOT) -> dict[str, np.ndarray]:
+    """
+    Proposes a ki and rate for each model (one per tape) by simulating bakes up to targetTemp with numKis kis spread
+    between MIN_SET_KI and MAX_SET_KI and rates of each rateFraction of the model's rate_limit (kept within the set rate
+    limits). Of the ones that never tripped a safety check and overshot by less than maxOvershoot, the one that settled
+    soonest is proposed (NaN if none did).
+
+    returns: "ki", "rate" (degrees per minute), "rateLimit", "settling" (seconds), and "overshoot" for each model
+    """
+    numModels = len(fit.tau)
+    kis = np.round(np.geomspace(constants.MIN_SET_KI, constants.MAX_SET_KI, numKis), 1)
+    limits = rate_limit(fit, targetTemp)
+    rates = np.clip(np.round(limits[:, None] * np.asarray(rateFractions), 1), constants.MIN_SET_RATE,
+                    constants.MAX_SET_RATE)
+    # every model with every ki and rate, as (model, ki, rate)
+    model = np.repeat(np.arange(numModels), numKis * len(rateFractions))
+    kiIndex = np.tile(np.repeat(np.arange(numKis), len(rateFractions)), numModels)
+    rateIndex = np.tile(np.arange(len(rateFractions)), numModels * numKis)
+    expanded = FopdtFit(fit.tau[model], fit.gain[model], fit.ambient[model], fit.deadTime[model], fit.r2[model],
+                        fit.numSamples[model])
+    results = simulate_bakes(expanded, targetTemp, kis[kiIndex], rates[model, rateIndex])
+
+    acceptable = ~results["tripped"] & (results["overshoot"] < maxOvershoot) & np.isfinite(results["settling"])
+    score = np.where(acceptable, results["settling"], np.inf).reshape(numModels, -1)
+    best = np.argmin(score, axis=1)     # the first of any ties, which has the lowest ki
+    found = np.isfinite(score[np.arange(numModels), best])
+    chosen = np.arange(numModels) * numKis * len(rateFractions) + best
+    return {"ki": np.where(found, kis[kiIndex[chosen]], np.nan),
+            "rate": np.where(found, rates[np.arange(numModels), rateIndex[chosen]], np.nan),
+            "rateLimit": limits,
+            "settling": np.where(found, results["settling"][chosen], np.nan),
+            "overshoot": np.where(found, results["overshoot"][chosen], np.nan)}
+
+def combine_by_tape(fit : FopdtFit, labels : list[tuple[str, str]]) -> tuple[list[str], FopdtFit, np.ndarray]:
+    """
+    Combines the fits of each tape's runs into one model per tape, the median of each parameter over its runs that
+    could be fit (numSamples is their total). Returns the tape names, their models, and how many runs each model is
+    from.
+    """
+    names = sorted({name for _, name in labels})
+    tapes = np.array([names.index(name) for _, name in labels])
+    valid = fit.valid()
+    def median(values : np.ndarray) -> np.ndarray:
+        return np.array([np.median(values[(tapes == i) & valid]) if np.any((tapes == i) & valid) else np.nan
+                         for i in range(len(names))])
+    numRuns = np.array([np.sum((tapes == i) & valid) for i in range(len(names))])
+    numSamples = np.array([np.sum(fit.numSamples[(tapes == i) & valid]) for i in range(len(names))])
+    return names, FopdtFit(median(fit.tau), median(fit.gain), median(fit.ambient), median(fit.deadTime),
+                           median(fit.r2), numSamples), numRuns
+
+if __name__ == "__main__":
+    import argparse
+    # the simulated bakes use the ControlEngine, which imports the hardware (through System) without using it
+    constants.HARDWARE_BACKEND = "sim"
+    parser = argparse.ArgumentParser()
+    parser.add_argument("folder", nargs="?", default=constants.SAVE_TO_FOLDER_STR)
+    parser.add_argument("--target", type=float, default=150, help="the set temperature to tune for")
+    parser.add_argument("--duty-columns", type=int, nargs="+",
+                        help="the duty cycle columns of csv files, to use them too (see analysis.load_run)")
+    parser.add_argument("--output", help="also save the models and proposals to this json file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    temps, duties, labels = load_archive(args.folder, args.duty_columns)
+    loaded = time.perf_counter()
+    fit = fit_fopdt(temps, duties)
+    fitted = time.perf_counter()
+    print("{} series from {} runs loaded in {:.2f} s and fit in {:.2f} s, {} could be fit".format(
+        len(labels), len({fileName for fileName, _ in labels}), loaded - start, fitted - loaded,
+        int(np.sum(fit.valid()))))
+    if not np.any(fit.valid()):
+        sys.exit("Nothing to tune, the runs need duty cycles (run logs, or csvs with --duty-columns)")
+
+    names, tapeFits, numRuns = combine_by_tape(fit, labels)
+    known = tapeFits.valid()
+    proposals = {key: np.full(len(names), np.nan) for key in ("ki", "rate", "rateLimit", "settling", "overshoot")}
+    if np.any(known):
+        found = propose(FopdtFit(tapeFits.tau[known], tapeFits.gain[known], tapeFits.ambient[known],
+                                 tapeFits.deadTime[known], tapeFits.r2[known], tapeFits.numSamples[known]),
+                        args.target)
+        for key, values in found.items():
+            proposals[key][known] = values
+    print("Simulated the bakes in {:.2f} s".format(time.perf_counter() - fitted))
+
+    print("{:>16} {:>5} {:>8} {:>7} {:>8} {:>7} {:>6} {:>11} {:>6} {:>9} {:>10} {:>10}".format(
+        "tape", "runs", "tau min", "gain C", "ambient", "dead s", "r2", "limit C/m", "ki", "rate C/m",
+        "settle min", "overshoot"))
+    for i, name in enumerate(names):
+        print("{:>16} {:>5} {:>8.1f} {:>7.1f} {:>8.1f} {:>7.0f} {:>6.3f} {:>11.2f} {:>6.1f} {:>9.1f} {:>10.1f} "
+              "{:>10.2f}".format(name, numRuns[i], tapeFits.tau[i] / 60, tapeFits.gain[i], tapeFits.ambient[i],
+                                  tapeFits.deadTime[i], tapeFits.r2[i], proposals["rateLimit"][i],
+                                  proposals["ki"][i], proposals["rate"][i], proposals["settling"][i] / 60,
+                                  proposals["overshoot"][i]))
+
+    if args.output is not None:
+        def number(value : float) -> float | None:
+            return None if np.isnan(value) else float(value)
+        with open(args.output, "w") as file:
+            json.dump({"target": args.target, "tapes": [
+                {"name": name, "runs": int(numRuns[i]), "tau": number(tapeFits.tau[i]),
+                 "gain": number(tapeFits.gain[i]), "ambient": number(tapeFits.ambient[i]),
+                 "deadTime": number(tapeFits.deadTime[i]), "r2": number(tapeFits.r2[i]),
+                 **{key: number(values[i]) for key, values in proposals.items()}}
+                for i, name in enumerate(names)]}, file, indent=2)
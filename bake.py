@@ -1,144 +1,43 @@
 import tkinter
 from tkinter import ttk
 import time
-import os
 import sys
-from multiprocessing import Process, Queue
-import RPi.GPIO as GPIO
 
-from libs.max6675 import MAX6675
 import constants
-from bake_system import System, SystemInoperableError, SystemUnreliableError
+import instrumentation
+from bake_controller import BakeController, parse_initial_values, log_file_names
 from bake_system_ui import SystemUI
-
-# the main loop of the program
-# does serial stuff first then parallel then back to serial
-# serial stuff includes getting the time of the current iteration
-# and updating the statuses of each system
-# parallel stuff is each system gettings its temperature, calculating and running its duty cycle
-def iterate(iterationNum : int, systemList : list[System], uiList : list[SystemUI], 
-            tempDetectorDict : dict[System: MAX6675], start_time : float, root : tkinter.Tk, 
-            notebook : ttk.Notebook, storedTimes : list[float], saveToFileName : str, 
-            copyQueue : Queue, errorQueue : Queue)-> None:
-    """
-    The main loop that will be repeatedly called to run a bake. It starts out in serial to manage timing, 
-    goes to parallel to run all systems at once, and then goes back to serial to update the UI and save data.
-    At the end it calls itself using a GUI method (root.after)
-
-    systemList: a list of all the systems that should be run
-    uiList: a list of all the UIs corresponding to the systems
-    tempDetectorDict: a dictionary mapping each system to its temperature detector
-    start_time: the time that the program started running
-    root: the tkinter root object
-    notebook: the ttk notebook object
-    storedTimes: an array of the times of each past iteration
-    saveToFileName: the name of the file to save the data to
-    copyQueue: holds all the updated system objects that need to be copied over to the original objects
-    errorQueue: holds all the errors that need to be raised
-    """
-    loc = iterationNum % constants.MAX_POINTS_IN_MEMORY
-    prevTime = (0 if storedTimes[loc] == None else storedTimes[loc]) + start_time
-    currentTime = time.clock_gettime(time.CLOCK_MONOTONIC_RAW)
-    lastIterationTime = currentTime - prevTime
-    print("Time to run this iteration: ", round(lastIterationTime, 2), "seconds")
-    timeElapsed = currentTime - start_time
-    storedTimes[iterationNum % constants.MAX_POINTS_IN_MEMORY] = timeElapsed
-
-    unreliableExceptions : list['SystemUnreliableError'] = []
-    inoperableExceptions : list['SystemInoperableError'] = []
-
-    # the actual parallel processing stage
-    tasks : list[Process] = []
-    for system in systemList:
-        p = Process(target=run_system, args=(iterationNum, system, tempDetectorDict[system],
-                                            timeElapsed, lastIterationTime, copyQueue,
-                                            errorQueue))
-        p.start()
-        tasks.append(p)
-    for p in tasks:
-        p.join()
-    
-    # back in serial
-    while not errorQueue.empty():
-        e = errorQueue.get()
-        if isinstance(e, SystemUnreliableError):
-            unreliableExceptions.append(e)
-        elif isinstance(e, SystemInoperableError):
-            inoperableExceptions.append(e)
-
-    if len(unreliableExceptions) > 0:
-        raise ExceptionGroup("Systems became unreliable at device time {}.".format(
-            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(currentTime))), unreliableExceptions)
-    
-    
-    # copying over the updated system object states to the original objects
-    output = []
-    for i in range(len(systemList)):
-        output.append(copyQueue.get())
-    
-    for o in output:
-        systemList[o[0]].copy(o[1])
-    
-    # turning off SSR capability in the original objects if necessary
-    if len(inoperableExceptions) > 0:
-        print("The following systems became inoperable at device time {}. ".format(
-            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(currentTime))))
-        for e in inoperableExceptions:
-            print("\tSystem {}, cause: {}".format(e.systemID + 1, e.cause))
-        print("Not running any more duty cycles on any SSRs; temperature monitoring will continue.")
-        for system in systemList:
-            system.operation_status = constants.OPERATION_STATUSES.INOPERABLE
-    
-    # updating only the visible system's ui
-    index = notebook.index(notebook.select())
-    uiList[index].update(iterationNum, lastIterationTime, storedTimes)
-
-    # syncing set values across all systems
-
-    # saving the data from each system to a file
-    # times are synced across all systems, each system just adds its temperature
-    if not os.path.exists(constants.SAVE_TO_FOLDER_STR):
-        os.makedirs(constants.SAVE_TO_FOLDER_STR)
-    with open(saveToFileName, "a+") as file:
-        append_str = "{}".format(storedTimes[loc])
-        for system in systemList:
-            append_str += ",{}".format(system.storedTemps[loc])
-        file.write(append_str + "\n")
-        file.close()
-    
-    for system in systemList:
-        if system.operation_status != constants.OPERATION_STATUSES.INOPERABLE:
-            print('TAPE ', str(system.id + 1), '| Duty cycle length', ': ', 
-                round(system.computedDutyCycle * 100, 2), ' percent of period')
-    
-    print("Iteration: {}".format(iterationNum))
-    root.after(constants.TIME_BETWEEN_ITERATIONS, lambda: iterate(iterationNum + 1, systemList, uiList, tempDetectorDict, start_time, 
-                                                                  root, notebook, storedTimes, saveToFileName, copyQueue, errorQueue))
-
-# Let each system run itself (this will be called in parallel and will update its state)
-# Due to the way that objects are passed in python in parallel, the updated system object
-# and the original are not the same
-# so put the updated system object in a queue to be copied over to the original system object
-def run_system(iterationNum : int, system : System, tempDetector : MAX6675, timeElapsed : float, 
-               lastIterationTime : float, copyQueue : Queue, errorQueue : Queue) -> None:
+from channels import load_channels
+from control_scheduler import ControlScheduler
+from ring_buffer import SharedRingBuffer
+
+# Updates the visible system's ui with whatever the control loop has done since the last time
+# runs on the tk thread every UI_REFRESH_INTERVAL, so drawing the plot never holds up the control loop
+def refresh_ui(controlScheduler : ControlScheduler, uiList : list[SystemUI], root : tkinter.Tk,
+               notebook : ttk.Notebook, storedTimes : SharedRingBuffer) -> None:
     """
-    
+    Takes the results of the iterations run since the last refresh from the control scheduler and, if there were any,
+    updates only the visible system's ui. Raises the exception that stopped the control loop (if it was stopped by
+    one) so it is handled in the tk thread. Calls itself again using root.after.
     """
-    # if timeElapsed > TOTAL_STARTUP_TIME and lastIterationTime < SET_PERIOD:
-        # print(locals())
-        # print(globals())
-        # GPIO.cleanup()
-        # _quit()
-    sys, errList = system.run(iterationNum, timeElapsed, tempDetector, lastIterationTime)
-    copyQueue.put((sys.id, sys))
-    for e in errList:
-        errorQueue.put(e)
+    controlScheduler.raise_error()
+    results = controlScheduler.take_results()
+    if len(results) > 0:
+        iterationNum = results[-1][0]
+        timeSinceLastRefresh = sum(lastIterationTime for _, lastIterationTime in results)
+        with instrumentation.span("ui"):
+            index = notebook.index(notebook.select())
+            uiList[index].update(iterationNum, timeSinceLastRefresh, storedTimes)
+    root.after(constants.UI_REFRESH_INTERVAL, lambda: refresh_ui(controlScheduler, uiList, root, notebook,
+                                                                  storedTimes))
 
 if __name__ == "__main__":
-    start_time = time.clock_gettime(time.CLOCK_MONOTONIC_RAW)
-    start_timestr = time.strftime("%Y%m%d-%H%M%S")
-    storedTimes = [None] * constants.MAX_POINTS_IN_MEMORY
-    saveToFileName = constants.SAVE_TO_FOLDER_STR + "/plot_data_{}.csv".format(start_timestr)
+    # the tapes of the box, everything per channel is made from these
+    channels = load_channels(constants.CHANNELS_FILE)
+    initialTemps, initialRates, initialKis = parse_initial_values(sys.argv[1:], len(channels))
+    saveToFileName, eventsFileName, channelsFileName = log_file_names(time.strftime("%Y%m%d-%H%M%S"))
+    # the events go next to the data, e.g. plot_data_20240101-120000.events.jsonl
+    instrumentation.configure(constants.INSTRUMENTATION_LEVEL, eventsFileName)
 
     root = tkinter.Tk()
     root.wm_title("Bake Box Temperature Control System")
@@ -146,7 +45,7 @@ if __name__ == "__main__":
     notebook.pack(expand=1, fill="both")
 
     def _quit() -> None:
-        GPIO.cleanup()
+        controller.stop()
         root.quit()     # stops mainloop
         root.destroy()  # this is necessary on Windows to prevent
                     # Fatal Python Error: PyEval_RestoreThread: NULL tstate
@@ -159,59 +58,14 @@ if __name__ == "__main__":
     
     root.protocol("WM_DELETE_WINDOW", _quit)
 
-    GPIO.setmode(GPIO.BOARD)
-
-    # check for initialization arguments
-    initialTemps = []
-    initialRates = []
-    initialKis = []
-    initializationArgs = sys.argv[1:]
-    if len(initializationArgs) == 0:
-        pass
-    elif len(initializationArgs) == 4:
-        for i in range(4):
-            initialTemps.append(float(initializationArgs[i]))
-    elif len(initializationArgs) == 8:
-        for i in range(4):
-            initialTemps.append(float(initializationArgs[i]))
-        for i in range(4, 8):
-            initialRates.append(float(initializationArgs[i]))
-    elif len(initializationArgs) == 12:
-        for i in range(4):
-            initialTemps.append(float(initializationArgs[i]))
-        for i in range(4, 8):
-            initialRates.append(float(initializationArgs[i]))
-        for i in range(8, 12):
-            initialKis.append(float(initializationArgs[i]))
-    else:
-        raise ValueError("Invalid number of arguments passed to program")
-
-    # create the systems
-    system1 = System(0, constants.RELAY_SELECT.RS1)
-    system2 = System(1, constants.RELAY_SELECT.RS2)
-    system3 = System(2, constants.RELAY_SELECT.RS3)
-    system4 = System(3, constants.RELAY_SELECT.RS4)
-    systemList = [system1, system2, system3, system4]
-    ui1 = SystemUI(system1, root, notebook)
-    ui2 = SystemUI(system2, root, notebook)
-    ui3 = SystemUI(system3, root, notebook)
-    ui4 = SystemUI(system4, root, notebook)
-    uiList = [ui1, ui2, ui3, ui4]
-
-    # create the temperature detector objects
-    tempDetector1 = MAX6675(constants.CHIP_SELECT.CS1, constants.CLOCK_PINS.CLK1, 
-                            constants.DATA_PINS.DATA1, units="c", board=GPIO.BOARD)
-    tempDetector2 = MAX6675(constants.CHIP_SELECT.CS2, constants.CLOCK_PINS.CLK2, 
-                            constants.DATA_PINS.DATA2, units="c", board=GPIO.BOARD)
-    tempDetector3 = MAX6675(constants.CHIP_SELECT.CS3, constants.CLOCK_PINS.CLK3,
-                            constants.DATA_PINS.DATA3, units="c", board=GPIO.BOARD)
-    tempDetector4 = MAX6675(constants.CHIP_SELECT.CS4, constants.CLOCK_PINS.CLK4,
-                            constants.DATA_PINS.DATA4, units="c", board=GPIO.BOARD)
-    tempDetectorDict = {system1: tempDetector1, system2: tempDetector2, 
-                        system3: tempDetector3, system4: tempDetector4}
+    # create the systems, their temperature detectors and workers, and everything else that runs the bake
+    # the control loop runs from its own thread (see bake_daemon.py to run it without this window)
+    controller = BakeController(saveToFileName, channels, initialTemps, initialRates, initialKis, channelsFileName)
 
-    copyQueue = Queue()
-    errorQueue = Queue()
+    # the uis show how old each detector's reading is
+    # and change the set values while holding the control scheduler's lock, so they never happen mid iteration
+    uiList = [SystemUI(system, root, notebook, tempDetector, controller.controlScheduler.lock)
+              for system, tempDetector in zip(controller.systemList, controller.tempDetectorList)]
 
     waiting_window = tkinter.Toplevel(root)
     waiting_window.geometry("300x200")
@@ -232,10 +86,9 @@ if __name__ == "__main__":
 
     # actually starting up the program
     root.after(0, startup_wait)
-    root.after(constants.TOTAL_STARTUP_TIME * 1000, lambda: iterate(0, systemList, uiList, tempDetectorDict, 
-                                                          start_time, root, notebook, 
-                                                          storedTimes, saveToFileName, 
-                                                          copyQueue, errorQueue))
+    controller.start()
+    root.after(constants.UI_REFRESH_INTERVAL, lambda: refresh_ui(controller.controlScheduler, uiList, root, notebook,
+                                                                  controller.storedTimes))
 
     try:
         root.mainloop()
@@ -247,7 +100,7 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("Shutting down the program in response to a keyboard interrupt.")
     finally:
-        GPIO.cleanup()
+        controller.stop()
     
 # TODO: 
 """
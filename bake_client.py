@@ -0,0 +1,201 @@
+import tkinter
+from tkinter import ttk
+import sys
+import traceback
+import numpy as np
+
+import constants
+from bake_system_ui import SystemUI
+from control_server import ControlClient, ControlError
+
+# The gui for a bake run by bake_daemon.py
+# The same SystemUI tabs as bake.py, but every system is a RemoteSystem that gets its readings from the bake over the
+# control socket and sends the set values back, so this window can be opened and closed (or lose its connection)
+# without the bake noticing. Only the visible system's data is fetched each refresh.
+# Run with: python bake_client.py [socket path]
+
+# The connection to the bake, reconnected whenever it is lost
+class RemoteBake:
+    """Sends requests to the bake's ControlServer, connecting (again) first if there is no connection."""
+    def __init__(self, path : str=constants.CONTROL_SOCKET_PATH):
+        """
+        path: the socket the bake is serving on
+        """
+        self.path = path
+        self.client : ControlClient = None
+
+    def request(self, command : str, **arguments) -> dict | list:
+        """
+        Returns the result of the command. Raises OSError if the bake can't be reached (the next request tries to
+        connect again) and ControlError if it couldn't carry out the command.
+        """
+        if self.client is None:
+            self.client = ControlClient(self.path)
+        try:
+            return self.client.request(command, **arguments)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+# What was fetched from one of the bake's ring buffers, with the same methods for reading it
+class FetchedBuffer:
+    """The last values of a ring buffer of the bake, read the same way as a RingBuffer."""
+    def __init__(self, values : list[float]=[]):
+        self.values = np.asarray(values, dtype=float)
+
+    def latest(self) -> float:
+        return self.values[-1] if len(self.values) > 0 else np.nan
+
+    def window(self, n : int) -> np.ndarray:
+        return self.values[max(0, len(self.values) - n):]
+
+# The rolled up history of one of the bake's systems, fetched when it is plotted
+class RemoteHistory:
+    def __init__(self, bake : RemoteBake, systemID : int):
+        self.bake = bake
+        self.systemID = systemID
+
+    def series(self, duration : float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the times, lows, means, and highs of the last duration seconds, like TieredHistory.series."""
+        history = self.bake.request("history", systemID=self.systemID, duration=duration)
+        return (np.asarray(history["times"], dtype=float), np.asarray(history["lows"], dtype=float),
+                np.asarray(history["means"], dtype=float), np.asarray(history["highs"], dtype=float))
+
+# How old one of the bake's temperature readings is, as of the last state fetched
+class RemoteTempDetector:
+    def __init__(self):
+        self.readingAge = np.inf
+        self.stale = True
+
+    def age(self) -> float:
+        return self.readingAge
+
+    def is_stale(self) -> bool:
+        return self.stale
+
+# One of the bake's systems as the SystemUI sees it
+# the readings and set values are copied from each state fetched, and changing the set values sends them to the bake
+# (which answers with the system's new state), so several windows attached to the same bake stay in agreement
+class RemoteSystem:
+    """
+    Stands in for a System in a SystemUI. Has the attributes and methods the ui uses, with the changes to the set
+    values made in the bake rather than here. Only how many points are shown is kept here.
+    """
+    def __init__(self, bake : RemoteBake, state : dict):
+        """
+        bake: the connection to the bake
+        state: the system's entry in the bake's state
+        """
+        self.bake = bake
+        self.id = state["id"]
+        self.name = state["name"]
+        self.storedTemps = FetchedBuffer()
+        self.history = RemoteHistory(bake, self.id)
+        self.tempDetector = RemoteTempDetector()
+        self.current_num_points = constants.STARTING_NUM_POINTS   # how many points to display on the graph
+        self.set_state(state)
+
+    def set_state(self, state : dict) -> None:
+        """Copies the readings and set values from the system's entry in the bake's state."""
+        for field in ("measuredRate", "desiredTemp", "desiredRate", "ki", "stepToTemp", "steppingUp",
+                      "computedDutyCycle", "displayTemp", "displayRate", "displayKi", "goingSet"):
+            setattr(self, field, state[field])
+        self.operation_status = constants.OPERATION_STATUSES(state["operation_status"])
+        self.tempDetector.readingAge = state["readingAge"]
+        self.tempDetector.stale = state["stale"]
+
+    def increment_display_temp(self, amount : float) -> None:
+        self.set_state(self.bake.request("set", systemID=self.id, temp=self.displayTemp + amount))
+
+    def decrement_display_temp(self, amount : float) -> None:
+        self.set_state(self.bake.request("set", systemID=self.id, temp=self.displayTemp - amount))
+
+    def increment_display_rate(self, amount : float) -> None:
+        self.set_state(self.bake.request("set", systemID=self.id, rate=self.displayRate + amount))
+
+    def decrement_display_rate(self, amount : float) -> None:
+        self.set_state(self.bake.request("set", systemID=self.id, rate=self.displayRate - amount))
+
+    def increment_display_ki(self, amount : float) -> None:
+        self.set_state(self.bake.request("set", systemID=self.id, ki=self.displayKi + amount))
+
+    def decrement_display_ki(self, amount : float) -> None:
+        self.set_state(self.bake.request("set", systemID=self.id, ki=self.displayKi - amount))
+
+    def useSetValues(self) -> None:
+        self.set_state(self.bake.request("go", systemID=self.id))
+
+    def changeNumPoints(self, changeAmount : int) -> None:
+        self.current_num_points += changeAmount
+
+# Fetches the bake's state and the visible system's data and updates its ui, then calls itself again
+def refresh(bake : RemoteBake, systems : list[RemoteSystem], uiList : list[SystemUI], root : tkinter.Tk,
+            notebook : ttk.Notebook, lastState : dict) -> None:
+    """
+    Updates the visible system's ui if the bake has run an iteration since the last refresh. If the bake can't be
+    reached, or can't send its state, the window says so and keeps trying every UI_REFRESH_INTERVAL. The next refresh
+    is always scheduled, whatever this one raises.
+    """
+    try:
+        state = bake.request("state")
+        for system, systemState in zip(systems, state["systems"]):
+            system.set_state(systemState)
+        if state["iteration"] != lastState["iteration"]:
+            index = notebook.index(notebook.select())
+            system = systems[index]
+            data = bake.request("data", systemID=index, numPoints=system.current_num_points)
+            system.storedTemps = FetchedBuffer(data["temps"])
+            uiList[index].update(state["iteration"], state["elapsed"] - lastState["elapsed"],
+                                 FetchedBuffer(data["times"]))
+            lastState = state
+        root.wm_title("Bake Box Temperature Control System")
+    except OSError:
+        root.wm_title("Bake Box Temperature Control System (not connected to the bake)")
+    except ControlError as e:
+        root.wm_title("Bake Box Temperature Control System (the bake could not send its state: {})".format(e))
+    finally:
+        root.after(constants.UI_REFRESH_INTERVAL, lambda: refresh(bake, systems, uiList, root, notebook, lastState))
+
+if __name__ == "__main__":
+    bake = RemoteBake(sys.argv[1] if len(sys.argv) > 1 else constants.CONTROL_SOCKET_PATH)
+    try:
+        state = bake.request("state")
+    except OSError as e:
+        sys.exit("Could not connect to the bake at {} ({}), is bake_daemon.py running?".format(bake.path, e))
+
+    root = tkinter.Tk()
+    root.wm_title("Bake Box Temperature Control System")
+    notebook = ttk.Notebook(root)
+    notebook.pack(expand=1, fill="both")
+
+    def _quit() -> None:
+        bake.close()    # only this window closes, the bake keeps running
+        root.quit()     # stops mainloop
+        root.destroy()  # this is necessary on Windows to prevent
+                    # Fatal Python Error: PyEval_RestoreThread: NULL tstate
+
+    # a set value the bake turned down (or a lost connection, or a refresh that couldn't apply the bake's state) is
+    # reported with its traceback without closing the window
+    def report_callback_exception(self, exc, val, tb):
+        if isinstance(val, (ControlError, OSError)):
+            print("The bake could not carry out the change: {}".format(val))
+        traceback.print_exception(exc, val, tb)
+
+    tkinter.Tk.report_callback_exception = report_callback_exception
+    root.protocol("WM_DELETE_WINDOW", _quit)
+
+    systems = [RemoteSystem(bake, systemState) for systemState in state["systems"]]
+    uiList = [SystemUI(system, root, notebook, system.tempDetector) for system in systems]
+    root.after(0, lambda: refresh(bake, systems, uiList, root, notebook, {"iteration": None, "elapsed": 0}))
+
+    try:
+        root.mainloop()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        bake.close()
@@ -0,0 +1,330 @@
+import time
+import math
+from hardware import GPIO, MAX6675Array
+
+import clocks
+import constants
+import instrumentation
+from constants import VERBOSITY
+from bake_system import System, SystemInoperableError, SystemUnreliableError
+from channel_worker import ChannelWorker
+from channels import Channel, channel_groups, save_channels
+from control_engine import BatchWorker
+from control_scheduler import ControlScheduler
+from ring_buffer import SharedRingBuffer
+from relay_scheduler import RelayScheduler
+from temp_detectors import SampledTempDetector, create_temp_detectors
+from data_logger import DataLogger
+from run_log import CsvRowFormat, BinaryRowFormat, FILE_EXTENSION
+
+# The control side of a bake, with nothing to do with the gui
+# bake.py runs it with the tkinter ui in the same process, bake_daemon.py runs it on its own and lets the ui
+# (bake_client.py) attach over a socket. Nothing here imports tkinter or matplotlib.
+
+# the main loop of the program
+# does serial stuff first then parallel then back to serial
+# serial stuff includes getting the time of the current iteration
+# and updating the statuses of each system
+# parallel stuff is each system gettings its temperature, calculating and running its duty cycle
+# it is called once per period by a ControlScheduler, from its thread, and leaves updating any ui to whatever shows it
+def iterate(iterationNum : int, systemList : list[System], workerList : list[ChannelWorker | BatchWorker],
+            sensorArray : MAX6675Array | None, relayScheduler : RelayScheduler, start_time : float,
+            storedTimes : SharedRingBuffer, dataLogger : DataLogger) -> tuple[int, float]:
+    """
+    One iteration of the loop that runs a bake. It starts out in serial to manage timing, goes to parallel to run
+    all systems at once, and then goes back to serial to start the SSRs for the period and save data.
+
+    systemList: a list of all the systems that should be run
+    workerList: what runs the systems (and owns their temperature detectors), a long lived worker process per group
+    of systems or a single BatchWorker (see create_workers)
+    sensorArray: if the temperature detectors are read all at once, the array they belong to (otherwise None)
+    relayScheduler: runs every system's SSR for its duty cycle in the background
+    start_time: the time that the program started running
+    storedTimes: the times of the past iterations
+    dataLogger: saves the data to a file in the background
+
+    returns: the iteration number and how long it has been since the last iteration, for the ui
+    """
+    prevTime = (0 if math.isnan(storedTimes.latest()) else storedTimes.latest()) + start_time
+    currentTime = clocks.now()
+    lastIterationTime = currentTime - prevTime
+    timeElapsed = currentTime - start_time
+    storedTimes.append(timeElapsed)
+
+    unreliableExceptions : list['SystemUnreliableError'] = []
+    inoperableExceptions : list['SystemInoperableError'] = []
+
+    # reading every temperature detector in one pass if they are read together
+    # the workers' detectors get their frames from the array's shared memory
+    if sensorArray is not None:
+        with instrumentation.span("sensor_array"):
+            sensorArray.read()
+
+    # the actual parallel processing stage
+    # the workers are already running, so only the commands and the updated control states are sent back and forth
+    with instrumentation.span("workers"):
+        for worker in workerList:
+            worker.send(iterationNum, timeElapsed, lastIterationTime)
+        results = []
+        for worker in workerList:
+            results.extend(worker.receive())
+    
+    # back in serial
+    for _, _, errList in results:
+        for e in errList:
+            if isinstance(e, SystemUnreliableError):
+                unreliableExceptions.append(e)
+            elif isinstance(e, SystemInoperableError):
+                inoperableExceptions.append(e)
+
+    if len(unreliableExceptions) > 0:
+        instrumentation.count("unreliable", len(unreliableExceptions))
+        for e in unreliableExceptions:
+            instrumentation.event(VERBOSITY.WARNING, "unreliable", system=e.systemID, cause=str(e.cause))
+        raise ExceptionGroup("Systems became unreliable at device time {}.".format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(currentTime))), unreliableExceptions)
+    
+    
+    # copying over the updated control states to the original objects
+    # the temperatures are already in the shared storedTemps buffers
+    for systemID, state, _ in results:
+        systemList[systemID].set_control_state(state)
+
+    # rolling the new temperatures into each system's long term history
+    for system in systemList:
+        system.history.add(timeElapsed, system.storedTemps.latest())
+    
+    # turning off SSR capability in the original objects if necessary
+    if len(inoperableExceptions) > 0:
+        print("The following systems became inoperable at device time {}. ".format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(currentTime))))
+        for e in inoperableExceptions:
+            print("\t{}, cause: {}".format(systemList[e.systemID].name, e.cause))
+            instrumentation.count("inoperable")
+            instrumentation.event(VERBOSITY.WARNING, "inoperable", system=e.systemID, cause=str(e.cause))
+        print("Not running any more duty cycles on any SSRs; temperature monitoring will continue.")
+        for system in systemList:
+            system.operation_status = constants.OPERATION_STATUSES.INOPERABLE
+    
+    # running the SSRs for this period, this returns right away so the file is updated while they run
+    with instrumentation.span("relays"):
+        relayScheduler.schedule(systemList)
+
+    # saving the data from each system to a file
+    # times are synced across all systems, each system just adds its temperature
+    # the logger writes it to the file in the background
+    with instrumentation.span("log"):
+        dataLogger.log((float(storedTimes.latest()),
+                        tuple(float(system.storedTemps.latest()) for system in systemList),
+                        tuple(system.computedDutyCycle for system in systemList),
+                        tuple(system.stepToTemp for system in systemList),
+                        tuple(int(system.operation_status) for system in systemList)))
+    
+    # what used to be printed every iteration, only built if it will be recorded
+    if instrumentation.enabled(VERBOSITY.INFO):
+        instrumentation.event(VERBOSITY.INFO, "iteration", iteration=iterationNum, elapsed=timeElapsed,
+                              period=lastIterationTime,
+                              temps=[float(system.storedTemps.latest()) for system in systemList],
+                              duty=[system.computedDutyCycle for system in systemList],
+                              stepTo=[system.stepToTemp for system in systemList],
+                              status=[int(system.operation_status) for system in systemList])
+    return iterationNum, lastIterationTime
+
+# Creates what runs the systems each iteration, using the engine chosen in constants
+def create_workers(systemList : list[System], tempDetectorList : list[SampledTempDetector],
+                   groups : list[list[int]]) -> list[ChannelWorker | BatchWorker]:
+    """
+    Returns a single BatchWorker for every system if constants.CONTROL_ENGINE is "vectorized", otherwise a
+    ChannelWorker for each group of systems (see channels.channel_groups), so all the groups run in parallel.
+    """
+    if constants.CONTROL_ENGINE == "vectorized":
+        # every system run together in this process, as arrays
+        return [BatchWorker(systemList, tempDetectorList)]
+    # one long lived worker per group, each running its group's systems one after the other
+    return [ChannelWorker([systemList[i] for i in group], [tempDetectorList[i] for i in group]) for group in groups]
+
+# Reads the initial set values from the command line: a temperature for every channel, optionally followed by a rate
+# and then a ki for every channel
+def parse_initial_values(args : list[str], numChannels : int) -> tuple[list[float], list[float], list[float]]:
+    """
+    Returns the initial set temperatures, rates, and kis given as arguments (each list is empty if not given). Raises
+    ValueError if the number of arguments isn't 0 or 1, 2, or 3 times the number of channels.
+    """
+    if len(args) not in (0, numChannels, 2 * numChannels, 3 * numChannels):
+        raise ValueError("Invalid number of arguments passed to program, expected 0, {}, {}, or {}".format(
+            numChannels, 2 * numChannels, 3 * numChannels))
+    values = [float(arg) for arg in args]
+    return values[0:numChannels], values[numChannels:2 * numChannels], values[2 * numChannels:3 * numChannels]
+
+# The file names the data, the instrumentation's events, and the channel definitions of a bake started at the given
+# time are saved to
+def log_file_names(start_timestr : str) -> tuple[str, str, str]:
+    """
+    Returns the data file name (csv or run log, depending on constants.LOG_FORMAT), the events file name, and the name
+    of the copy of the channel definitions.
+    """
+    baseName = constants.SAVE_TO_FOLDER_STR + "/plot_data_{}".format(start_timestr)
+    dataExtension = FILE_EXTENSION if constants.LOG_FORMAT == "binary" else ".csv"
+    return (baseName + dataExtension, baseName + constants.EVENT_LOG_EXTENSION,
+            baseName + constants.CHANNELS_COPY_EXTENSION)
+
+# Everything that runs a bake: the systems, their temperature detectors and workers, the relay scheduler, the data
+# logger, and the control scheduler that runs iterate
+# it also answers what the ui needs (state, data, history) and takes the set values from it, so the same calls work
+# whether the ui is in this process or attached through a ControlServer
+class BakeController:
+    """
+    Creates and owns every part of a running bake. start() starts the control loop after the startup time, stop()
+    stops everything and can be called more than once. The set values are changed with set_values and put into use
+    with go, both while holding the control scheduler's lock so they never happen in the middle of an iteration.
+    """
+    def __init__(self, saveToFileName : str, channels : list[Channel], initialTemps : list[float]=[],
+                 initialRates : list[float]=[], initialKis : list[float]=[], channelsFileName : str=None):
+        """
+        saveToFileName: the file the data is saved to
+        channels: the channels to run (see channels.load_channels), a system is made for each one in the same order
+        initialTemps, initialRates, initialKis: initial set values that replace the channels' own, in system order
+        (the channel's, or else System's default, is used for any that aren't given)
+        channelsFileName: where to save a copy of the channels, so the columns of the data can be told apart later
+        (not saved if None)
+        """
+        GPIO.setmode(GPIO.BOARD)
+        self.startTime = clocks.now()
+        self.storedTimes = SharedRingBuffer(constants.MAX_POINTS_IN_MEMORY)
+        self.channels = channels
+        if channelsFileName is not None:
+            save_channels(channels, channelsFileName)
+        self.systemList : list[System] = []
+        for i, channel in enumerate(channels):
+            setValues = channel.system_arguments()
+            if i < len(initialTemps):
+                setValues["startSetTemp"] = initialTemps[i]
+            if i < len(initialRates):
+                setValues["startSetRate"] = initialRates[i]
+            if i < len(initialKis):
+                setValues["startSetKi"] = initialKis[i]
+            self.systemList.append(System(i, channel.relay, **setValues))
+
+        self.tempDetectorList, self.sensorArray = create_temp_detectors([channel.chipSelect for channel in channels],
+                                                                        [channel.clock for channel in channels],
+                                                                        [channel.data for channel in channels],
+                                                                        [channel.relay for channel in channels])
+        self.workerList = create_workers(self.systemList, self.tempDetectorList, channel_groups(channels))
+        self.relayScheduler = RelayScheduler()
+        if constants.LOG_FORMAT == "binary":
+            rowFormat = BinaryRowFormat(len(self.systemList), time.time())
+        else:
+            rowFormat = CsvRowFormat()
+        self.dataLogger = DataLogger(saveToFileName, rowFormat)
+        # runs the loop from its own thread once the startup time is over, at fixed deadlines one period apart
+        self.controlScheduler = ControlScheduler(self.iterate, self.startTime + constants.TOTAL_STARTUP_TIME)
+        self.lastIteration = (-1, 0.0)   # the last iteration's number and time since the one before it
+        self.stopped = False
+
+    def iterate(self, iterationNum : int) -> tuple[int, float]:
+        self.lastIteration = iterate(iterationNum, self.systemList, self.workerList, self.sensorArray,
+                                     self.relayScheduler, self.startTime, self.storedTimes, self.dataLogger)
+        return self.lastIteration
+
+    def start(self) -> None:
+        for worker in self.workerList:
+            worker.start()
+        self.relayScheduler.start()
+        self.dataLogger.start()
+        self.controlScheduler.start()
+
+    def stop(self) -> None:
+        """Stops the control loop, saves the data and events, turns every relay off, and stops the workers."""
+        if self.stopped:
+            return
+        self.stopped = True
+        self.controlScheduler.stop()
+        jitter = self.controlScheduler.jitter_stats()
+        print("Iterations started {:.1f} ms late on average ({:.1f} ms at most), {} missed deadlines.".format(
+            jitter["mean"] * 1000, jitter["max"] * 1000, jitter["missed"]))
+        self.dataLogger.close()
+        instrumentation.count("dropped_log_rows", self.dataLogger.droppedRows)
+        instrumentation.close()
+        self.relayScheduler.stop()
+        for worker in self.workerList:
+            worker.stop()
+        for system in self.systemList:
+            system.storedTemps.close()
+        self.storedTimes.close()
+        GPIO.cleanup()
+
+    def system(self, systemID : int) -> System:
+        if not 0 <= systemID < len(self.systemList):
+            raise ValueError("There is no system {}".format(systemID))
+        return self.systemList[systemID]
+
+    def state(self) -> dict:
+        """
+        Returns everything the ui shows that isn't plotted: the elapsed time, the last iteration, how late iterations
+        are starting, and the readings and set values of every system.
+        """
+        with self.controlScheduler.lock:
+            iterationNum, lastIterationTime = self.lastIteration
+            return {"elapsed": clocks.now() - self.startTime, "iteration": iterationNum,
+                    "lastIterationTime": lastIterationTime, "jitter": self.controlScheduler.jitter_stats(),
+                    "systems": [self.system_state(system, tempDetector)
+                                for system, tempDetector in zip(self.systemList, self.tempDetectorList)]}
+
+    def system_state(self, system : System, tempDetector) -> dict:
+        return {"id": system.id, "name": system.name, "temp": float(system.storedTemps.latest()),
+                "measuredRate": system.measuredRate, "readingAge": tempDetector.age(), "stale": tempDetector.is_stale(),
+                "desiredTemp": system.desiredTemp, "desiredRate": system.desiredRate, "ki": system.ki,
+                "stepToTemp": system.stepToTemp, "steppingUp": system.steppingUp,
+                "computedDutyCycle": system.computedDutyCycle, "operation_status": int(system.operation_status),
+                "displayTemp": system.displayTemp, "displayRate": system.displayRate,
+                "displayKi": system.displayKi, "goingSet": system.goingSet}
+
+    def data(self, systemID : int, numPoints : int) -> dict:
+        """Returns the times and temperatures of the last numPoints iterations of a system."""
+        system = self.system(systemID)
+        numPoints = max(0, min(int(numPoints), constants.MAX_POINTS_IN_MEMORY))
+        with self.controlScheduler.lock:    # so the times and temperatures line up
+            return {"times": self.storedTimes.window(numPoints).tolist(),
+                    "temps": system.storedTemps.window(numPoints).tolist()}
+
+    def history(self, systemID : int, duration : float) -> dict:
+        """Returns the rolled up history of a system over the last duration seconds (see TieredHistory.series)."""
+        system = self.system(systemID)
+        with self.controlScheduler.lock:
+            times, lows, means, highs = system.history.series(float(duration))
+        return {"times": times.tolist(), "lows": lows.tolist(), "means": means.tolist(), "highs": highs.tolist()}
+
+    def set_values(self, systemID : int, temp : float=None, rate : float=None, ki : float=None) -> dict:
+        """
+        Changes the displayed set values of a system (what the ui's increment and decrement buttons do), which are
+        only used once go is called. Raises ValueError if a value is outside the limits in constants.
+        """
+        system = self.system(systemID)
+        if temp is not None and not constants.MIN_SET_TEMP <= temp <= constants.MAX_SET_TEMP:
+            raise ValueError("The set temperature has to be between {} and {}".format(constants.MIN_SET_TEMP,
+                                                                                      constants.MAX_SET_TEMP))
+        if rate is not None and not constants.MIN_SET_RATE <= abs(rate) <= constants.MAX_SET_RATE:
+            raise ValueError("The set rate has to be between {} and {}".format(constants.MIN_SET_RATE,
+                                                                               constants.MAX_SET_RATE))
+        if ki is not None and not constants.MIN_SET_KI <= ki <= constants.MAX_SET_KI:
+            raise ValueError("The set ki has to be between {} and {}".format(constants.MIN_SET_KI,
+                                                                             constants.MAX_SET_KI))
+        with self.controlScheduler.lock:
+            if temp is not None:
+                system.displayTemp = round(float(temp), 2)
+                system.goingSet = False
+            if rate is not None:
+                system.displayRate = round(float(rate), 2)
+                system.goingSet = False
+            if ki is not None:
+                system.displayKi = round(float(ki), 2)
+                system.goingSet = False
+        return self.system_state(system, self.tempDetectorList[systemID])
+
+    def go(self, systemID : int, temp : float=None, rate : float=None, ki : float=None) -> dict:
+        """Puts a system's displayed set values (after changing any that are given) into use, like the Go button."""
+        self.set_values(systemID, temp, rate, ki)
+        system = self.system(systemID)
+        with self.controlScheduler.lock:
+            system.useSetValues()
+        return self.system_state(system, self.tempDetectorList[systemID])
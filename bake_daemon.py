@@ -0,0 +1,47 @@
+import signal
+import sys
+import threading
+import time
+
+import constants
+from bake_controller import BakeController, parse_initial_values, log_file_names
+from channels import load_channels
+import instrumentation
+from control_server import ControlServer
+
+# Runs a bake without the gui, for unattended runs
+# The control loop, logging, and safety checks are the same as in bake.py, but there is no tkinter window (or
+# matplotlib) taking up the pi's cpu and memory. The ui can be attached whenever it's wanted with bake_client.py,
+# which talks to this over the socket at constants.CONTROL_SOCKET_PATH, and closed again without affecting the bake.
+# Run with the same arguments as bake.py (a temperature for every channel in constants.CHANNELS_FILE, optionally
+# followed by a rate and a ki for every channel): python bake_daemon.py [temps [rates [kis]]]
+# and stopped with ctrl+c or SIGTERM.
+if __name__ == "__main__":
+    channels = load_channels(constants.CHANNELS_FILE)
+    initialTemps, initialRates, initialKis = parse_initial_values(sys.argv[1:], len(channels))
+    saveToFileName, eventsFileName, channelsFileName = log_file_names(time.strftime("%Y%m%d-%H%M%S"))
+    instrumentation.configure(constants.INSTRUMENTATION_LEVEL, eventsFileName)
+
+    controller = BakeController(saveToFileName, channels, initialTemps, initialRates, initialKis, channelsFileName)
+    server = ControlServer(controller)
+    stopEvent = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopEvent.set())
+
+    try:
+        controller.start()
+        server.start()
+        print("Bake running, saving to {}. Attach the ui with: python bake_client.py".format(saveToFileName))
+        # the control loop runs on its own thread, this one only waits for it to stop or be stopped
+        while controller.controlScheduler.running() and not stopEvent.wait(constants.UI_REFRESH_INTERVAL / 1000):
+            pass
+        controller.controlScheduler.raise_error()
+    except ExceptionGroup as e: # should only happen if there are unreliable systems the inoperable
+        # system exceptions should be handled in iterate itself
+        for exc in e.exceptions:
+            print(exc)
+        print("Shutting down the program in response to at least one system becoming unreliable.")
+    except KeyboardInterrupt:
+        print("Shutting down the program in response to a keyboard interrupt.")
+    finally:
+        server.stop()
+        controller.stop()
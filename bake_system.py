@@ -1,10 +1,13 @@
-from RPi import GPIO
+from hardware import GPIO, MAX6675, MAX6675Error
 import math
-import time
 
+import clocks
 import constants
 import funcs
-from libs.max6675 import MAX6675, MAX6675Error
+import instrumentation
+from ring_buffer import SharedRingBuffer
+from rate_estimator import SlopeEstimator
+from history import TieredHistory
 
 # Stores all the data for a single system
 # Including the relay the system controls
@@ -13,14 +16,17 @@ from libs.max6675 import MAX6675, MAX6675Error
 class System:
     """Stores all the data for a single bake system, including the relay the system controls and all state values. 
     Given just this object and a temperature detector, the system can run itself for an iteration."""
-    def __init__(self, id : int, relay : constants.RELAY_SELECT, startSetTemp : int=150,
-                 startSetRate : float=1.0, startSetKi : float=1.5):
+    def __init__(self, id : int, relay : int, startSetTemp : int=150,
+                 startSetRate : float=1.0, startSetKi : float=1.5, name : str=None):
         """Create a system object with a given relay and initial set temperature, rate, and integral constant values. 
-        The id is a numeric identifier that corresponds to the position of the system in a list with all other systems."""
+        The id is a numeric identifier that corresponds to the position of the system in a list with all other systems.
+        The name is what the ui calls it (its channel's name), "Heater tape <id + 1>" if not given."""
         self.id = id
         self.relay = relay
+        self.name = "Heater tape {}".format(id + 1) if name is None else name
 
-        self.storedTemps = [None] * constants.MAX_POINTS_IN_MEMORY
+        self.storedTemps = SharedRingBuffer(constants.MAX_POINTS_IN_MEMORY)   # shared with the worker process
+        self.history = TieredHistory()  # the older temperatures rolled up, added to by the main process
         self.prev_error = 0
         self.error_running_sum = 0
         self.tempForDutyCycle = 0
@@ -37,6 +43,8 @@ class System:
         self.maxAcceptableTemp = self.desiredTemp + 10
         self.timeOutOfAcceptableRange = 0
         self.operation_status = constants.OPERATION_STATUSES.OPERABLE
+        self.rateEstimator = SlopeEstimator(windowSize=constants.RATE_WINDOW_SIZE)
+        self.measuredRate = 0   # degrees Celsius per second, the least squares slope of the recent temperatures
 
         self.displayTemp = self.desiredTemp
         self.displayRate = self.desiredRate
@@ -49,13 +57,14 @@ class System:
         GPIO.setup(self.relay, GPIO.OUT)
     
     # does everything for 1 iteration of the system
-    # but cannot modify the original system variable passed in
-    # instead returns a new system variable that can be copied into the original
+    # this is run in a worker process, so it cannot modify the original system variable in the main process
+    # instead its control state is sent back and set on the original
     def run(self, iterationNum : int, timeElapsed : float, tempDetector : MAX6675, 
             lastIterationTime : float, sharedVals : 'SystemSharedValues'=None) -> tuple['System', list[Exception]]:
         """
         Does everything for 1 iteration of the bake system: reads in temperature data, runs the PID algorithm,
-        controls the SSR, and updates the system's state. 
+        and updates the system's state. The SSR is not run here, the computed duty cycle is handed to a RelayScheduler
+        so that this returns right away.
 
         timeElapsed: the time elapsed since the start of the program
         tempDetector: the temperature detector object that reads in the temperature data
@@ -79,139 +88,151 @@ class System:
 
         collectedExceptions = []
         
-        loc = iterationNum % constants.MAX_POINTS_IN_MEMORY
-        prevTemp = (0 if self.storedTemps[loc - 1] == None else self.storedTemps[loc - 1])
         currentTemp : float
         try:
-            currentTemp = tempDetector.get()
+            with instrumentation.span("sensor_read"):
+                currentTemp = tempDetector.get()
         except MAX6675Error as e:
             collectedExceptions.append(SystemUnreliableError(self.id, timeElapsed, e))
+            self.storedTemps.append(math.nan)
+            instrumentation.count("sensor_errors")
+            instrumentation.event(constants.VERBOSITY.WARNING, "sensor_error", system=self.id, cause=str(e))
         else:
-            # only store the temperature if the time is right (every iteration or every minute)
+            with instrumentation.span("control"):
+                # only store the temperature if the time is right (every iteration or every minute)
+                # something is appended every iteration (NaN if not storing) so the temperatures line up with the times
+                # storedTemps is in shared memory so this is immediately visible to the main process
+                storedTemp = currentTemp
+                if self.updateDataEveryMinute:
+                    if self.timeSinceLastUpdate >= 60:
+                        self.timeSinceLastUpdate = 0
+                    else:
+                        storedTemp = math.nan
+                self.storedTemps.append(storedTemp)
 
-            if self.updateDataEveryMinute:
-                if self.timeSinceLastUpdate >= 60:
-                    self.timeSinceLastUpdate = 0
-                    self.storedTemps[loc] = currentTemp
+                # the measured rate is kept up to date here (where the ramp is run, it holds back the steps below) and
+                # sent to the ui with the state
+                self.rateEstimator.update(timeElapsed, currentTemp)
+                self.measuredRate = float(self.rateEstimator.slope()[0])
 
-            if self.numStepsTaken == 0 and timeElapsed > constants.TOTAL_STARTUP_TIME:
-                if self.steppingUp:
-                    self.stepToTemp = math.ceil(currentTemp)
-                else:
-                    self.stepToTemp = math.floor(currentTemp)
-                self.error_running_sum = 0
-                self.prev_error = 0
-                self.timeSinceLastStep = 0
-                self.numStepsTaken = 1
-                # for the very first step, go to the next degree
-
-            if self.steppingUp:
-                if self.timeSinceLastStep >= (60 / self.desiredRate) and currentTemp >= self.stepToTemp and allSteppedToSame:
-                    if self.stepToTemp < self.desiredTemp:
-                        self.numStepsTaken += 1
-                        self.stepToTemp += 1
-                        self.error_running_sum = 0
-                        self.timeSinceLastStep = 0
-                    elif self.stepToTemp == self.desiredTemp and not self.hasSteppedToDesired:
-                        self.hasSteppedToDesired = True
-                        self.error_running_sum = 0
-                        self.timeSinceLastStep = 0
-                if currentTemp >= self.desiredTemp:
-                    # 0 out the error sum if the temperature is above the desired temperature
-                    # because otherwise the integral term will accumulate a lot of error that will need to be undone
-                    # and cooling is slow
-                    # this situation could happen if the metal is done being heated up or if the set temperature
-                    # is decreased
-                    # but in either case this should help the integral term converge to the set temperature
+                # >= since the first iteration is run exactly at the end of the startup time on a virtual clock
+                if self.numStepsTaken == 0 and timeElapsed >= constants.TOTAL_STARTUP_TIME:
+                    if self.steppingUp:
+                        self.stepToTemp = math.ceil(currentTemp)
+                    else:
+                        self.stepToTemp = math.floor(currentTemp)
                     self.error_running_sum = 0
-            else:
-                if self.timeSinceLastStep >= (60 / self.desiredRate) and currentTemp <= self.stepToTemp and allSteppedToSame:
-                    if self.stepToTemp > self.desiredTemp:
-                        self.numStepsTaken += 1
-                        self.stepToTemp -= 1
+                    self.prev_error = 0
+                    self.timeSinceLastStep = 0
+                    self.numStepsTaken = 1
+                    # for the very first step, go to the next degree
+
+                # the step's time being up only keeps the average rate to the set rate, so the next step also waits
+                # while the temperature is already changing a lot faster than that (measured in degrees per second)
+                rateLimit = self.desiredRate * constants.STEP_HOLD_RATE_FACTOR / 60
+                if self.steppingUp:
+                    if (self.timeSinceLastStep >= (60 / self.desiredRate) and currentTemp >= self.stepToTemp
+                            and self.measuredRate <= rateLimit and allSteppedToSame):
+                        if self.stepToTemp < self.desiredTemp:
+                            self.numStepsTaken += 1
+                            self.stepToTemp += 1
+                            self.error_running_sum = 0
+                            self.timeSinceLastStep = 0
+                        elif self.stepToTemp == self.desiredTemp and not self.hasSteppedToDesired:
+                            self.hasSteppedToDesired = True
+                            self.error_running_sum = 0
+                            self.timeSinceLastStep = 0
+                    if currentTemp >= self.desiredTemp:
+                        # 0 out the error sum if the temperature is above the desired temperature
+                        # because otherwise the integral term will accumulate a lot of error that will need to be undone
+                        # and cooling is slow
+                        # this situation could happen if the metal is done being heated up or if the set temperature
+                        # is decreased
+                        # but in either case this should help the integral term converge to the set temperature
                         self.error_running_sum = 0
-                        self.timeSinceLastStep = 0
-                    elif self.stepToTemp == self.desiredTemp and not self.hasSteppedToDesired:
-                        self.hasSteppedToDesired = True
+                else:
+                    if (self.timeSinceLastStep >= (60 / self.desiredRate) and currentTemp <= self.stepToTemp
+                            and -self.measuredRate <= rateLimit and allSteppedToSame):
+                        if self.stepToTemp > self.desiredTemp:
+                            self.numStepsTaken += 1
+                            self.stepToTemp -= 1
+                            self.error_running_sum = 0
+                            self.timeSinceLastStep = 0
+                        elif self.stepToTemp == self.desiredTemp and not self.hasSteppedToDesired:
+                            self.hasSteppedToDesired = True
+                            self.error_running_sum = 0
+                            self.timeSinceLastStep = 0
+                    if currentTemp > self.stepToTemp:
+                        # 0 out the error sum until the temperature drops to below the step temperature
+                        # because otherwise it will accumulate negative error and will need to drop below
+                        # the step for enough time to accumulate positive error
+                        # just avoid that by zeroing out until it drops below the step 
                         self.error_running_sum = 0
-                        self.timeSinceLastStep = 0
-                if currentTemp > self.stepToTemp:
-                    # 0 out the error sum until the temperature drops to below the step temperature
-                    # because otherwise it will accumulate negative error and will need to drop below
-                    # the step for enough time to accumulate positive error
-                    # just avoid that by zeroing out until it drops below the step 
-                    self.error_running_sum = 0
-            self.timeSinceLastStep += lastIterationTime
+                self.timeSinceLastStep += lastIterationTime
 
-            # this is for safety
-            # if the temperature is too far off for too long, give a signal to turn off all the SSRs
-            # mainly to prevent overheating but in general just if the SSRs seem broken
-            if currentTemp > self.maxAcceptableTemp or currentTemp < constants.MIN_ACCEPTABLE_TEMP:
-                self.timeOutOfAcceptableRange += lastIterationTime
-                if self.timeOutOfAcceptableRange >= constants.MAX_TIME_AT_UNACCEPTABLE_TEMP * 60:
-                    if self.operation_status != constants.OPERATION_STATUSES.INOPERABLE:
-                        tempReason = "high" if currentTemp > self.maxAcceptableTemp else "low"
-                        collectedExceptions.append(SystemInoperableError(self.id, timeElapsed, 
-                                                    " the temperature reading being too " + tempReason + " for too long"))
-                    self.operation_status = constants.OPERATION_STATUSES.INOPERABLE
+                # this is for safety
+                # if the temperature is too far off for too long, give a signal to turn off all the SSRs
+                # mainly to prevent overheating but in general just if the SSRs seem broken
+                if currentTemp > self.maxAcceptableTemp or currentTemp < constants.MIN_ACCEPTABLE_TEMP:
+                    self.timeOutOfAcceptableRange += lastIterationTime
+                    if self.timeOutOfAcceptableRange >= constants.MAX_TIME_AT_UNACCEPTABLE_TEMP * 60:
+                        if self.operation_status != constants.OPERATION_STATUSES.INOPERABLE:
+                            tempReason = "high" if currentTemp > self.maxAcceptableTemp else "low"
+                            collectedExceptions.append(SystemInoperableError(self.id, timeElapsed, 
+                                                        " the temperature reading being too " + tempReason + " for too long"))
+                        self.operation_status = constants.OPERATION_STATUSES.INOPERABLE
+                    else:
+                        self.operation_status = constants.OPERATION_STATUSES.ON_HOLD
                 else:
-                    self.operation_status = constants.OPERATION_STATUSES.ON_HOLD
-            else:
-                if self.operation_status != constants.OPERATION_STATUSES.INOPERABLE:  # if it was inoperable, don't change it
-                    self.timeOutOfAcceptableRange = 0
-                    self.operation_status = constants.OPERATION_STATUSES.OPERABLE
+                    if self.operation_status != constants.OPERATION_STATUSES.INOPERABLE:  # if it was inoperable, don't change it
+                        self.timeOutOfAcceptableRange = 0
+                        self.operation_status = constants.OPERATION_STATUSES.OPERABLE
 
-            # this is for stabilization
-            # if the system gets too far from the step feature then start stepping again
-            # shouldn't keep repeatedly hitting this because then the step temperature will change
-            # to be within a degree of the current temperature
-            # simulate a first step to achieve this
-            if abs(self.stepToTemp - currentTemp) >= constants.LARGE_TEMP_DIFFERENCE:
-                self.numStepsTaken = 0
-                self.steppingUp = (self.desiredTemp > currentTemp)
+                # this is for stabilization
+                # if the system gets too far from the step feature then start stepping again
+                # shouldn't keep repeatedly hitting this because then the step temperature will change
+                # to be within a degree of the current temperature
+                # simulate a first step to achieve this
+                if abs(self.stepToTemp - currentTemp) >= constants.LARGE_TEMP_DIFFERENCE:
+                    self.numStepsTaken = 0
+                    self.steppingUp = (self.desiredTemp > currentTemp)
             
-            print(f"Time: {timeElapsed:.2f}, time since last step: {self.timeSinceLastStep:.2f}, Stepping to {self.stepToTemp}")
+                if instrumentation.enabled(constants.VERBOSITY.DEBUG):
+                    instrumentation.event(constants.VERBOSITY.DEBUG, "step", system=self.id, time=timeElapsed,
+                                          timeSinceLastStep=self.timeSinceLastStep, stepToTemp=self.stepToTemp)
 
-            # heating up the heater tape via duty cycle
-            self.tempForDutyCycle = currentTemp
-            self.compute_duty_cycle_from_temp()
-            self.run_SSR_for_duty_cycle()
+                # computing the duty cycle for heating up the heater tape
+                # the SSR itself is run for it by the relay scheduler
+                self.tempForDutyCycle = currentTemp
+                self.compute_duty_cycle_from_temp()
 
         return self, collectedExceptions
     
-    # copies over the state variables of another system
-    # used to update the original system after the copy is modified in parallel
-    def copy(self, other : 'System') -> None:
+    # the state values that the control logic reads and writes each iteration
+    # these are all small scalars, so they are what gets sent to and from the worker processes
+    # instead of the whole system object
+    CONTROL_STATE_FIELDS = ("prev_error", "error_running_sum", "tempForDutyCycle", "computedDutyCycle",
+                            "desiredTemp", "desiredRate", "stepToTemp", "ki", "numStepsTaken",
+                            "hasSteppedToDesired", "hasReachedDesired", "timeSinceLastStep", "steppingUp",
+                            "maxAcceptableTemp", "timeOutOfAcceptableRange", "operation_status",
+                            "updateDataEveryMinute", "timeSinceLastUpdate", "measuredRate")
+
+    def get_control_state(self) -> dict:
+        """
+        Returns the values of the control state fields as a dictionary. This is small and independent of how much
+        data is stored, so it is cheap to send between processes.
         """
-        Copies over state variables of another system to itself. Because systems are likely to be called in parallel, this
-        is necessary to update the original objects after the copies are modified and returned from parallel processes.
+        return {field: getattr(self, field) for field in System.CONTROL_STATE_FIELDS}
 
-        other: the other system object to copy from
+    def set_control_state(self, state : dict) -> None:
         """
-        self.storedTemps = other.storedTemps
-        self.error_running_sum = other.error_running_sum
-        self.tempForDutyCycle = other.tempForDutyCycle
-        self.computedDutyCycle = other.computedDutyCycle
-        self.desiredTemp = other.desiredTemp
-        self.desiredRate = other.desiredRate
-        self.stepToTemp = other.stepToTemp
-        self.ki = other.ki
-        self.numStepsTaken = other.numStepsTaken
-        self.hasSteppedToDesired = other.hasSteppedToDesired
-        self.hasReachedDesired = other.hasReachedDesired
-        self.timeSinceLastStep = other.timeSinceLastStep
-        self.steppingUp = other.steppingUp
-        self.maxAcceptableTemp = other.maxAcceptableTemp
-        self.timeOutOfAcceptableRange = other.timeOutOfAcceptableRange
-        self.operation_status = other.operation_status
+        Sets the control state fields from a dictionary made by get_control_state. Used to keep the system in the
+        main process and its counterpart in a worker process in sync.
 
-        self.displayTemp = other.displayTemp
-        self.displayRate = other.displayRate
-        self.displayKi = other.displayKi
-        self.goingSet = other.goingSet
-        self.current_num_points = other.current_num_points
-        self.updateDataEveryMinute = other.updateDataEveryMinute
-        self.timeSinceLastUpdate = other.timeSinceLastUpdate
+        state: the control state to copy from
+        """
+        for field in System.CONTROL_STATE_FIELDS:
+            setattr(self, field, state[field])
     
     # Computes the duty cycle duration based on the output of the pid algorithm
     # Temperature is read -> run pid on reading
@@ -238,20 +259,21 @@ class System:
     # Runs the SSR for the duty cycle proportion of the period by turning the SSR
     # on, waiting, then turning the SSR off
     # but only if the system is in a good state
-    # uses time.sleep so the GUI is not updated during this time
+    # uses clocks.sleep so the GUI is not updated during this time
+    # the main loop uses a RelayScheduler instead, this is for running a single system on its own
     def run_SSR_for_duty_cycle(self) -> None:
         """
         Runs the SSR for the duty cycle proportion of the period by turning the SSR on, waiting, then turning the SSR off.
-        This method is blocking and uses time.sleep so the GUI is not updated during this time. It will only run the SSR if
+        This method is blocking and uses clocks.sleep so the GUI is not updated during this time. It will only run the SSR if
         the system is not in an inoperable state.
         """
         if not self.operation_status == constants.OPERATION_STATUSES.INOPERABLE:
             self.SSR_on()
-            time.sleep(constants.SET_PERIOD * self.computedDutyCycle)
+            clocks.sleep(constants.SET_PERIOD * self.computedDutyCycle)
             self.SSR_off()
-            time.sleep(constants.SET_PERIOD - constants.SET_PERIOD * self.computedDutyCycle)
+            clocks.sleep(constants.SET_PERIOD - constants.SET_PERIOD * self.computedDutyCycle)
         else:
-            time.sleep(constants.SET_PERIOD)
+            clocks.sleep(constants.SET_PERIOD)
     
     # Display values may be different than the actual set values because
     # of how the user interface is set up
@@ -319,6 +341,7 @@ class SystemUnreliableError(Exception):
     """Raised when a system cannot be trusted, most likely when its thermocouple isn't connected.
     This is fatal and the program should shut down."""
     def __init__(self, systemID : int, elapsedTime : float, cause : str="unknown"):
+        super().__init__(systemID, elapsedTime, cause)  # keeps the arguments so the exception can be pickled
         self.systemID = systemID
         self.elapsedTime = elapsedTime
         self.cause = cause
@@ -332,6 +355,7 @@ class SystemInoperableError(Exception):
     """Raised when a system is inoperable, most likely when its SSR is broken. The system's data
     can still be trusted but it should not be allowed to act i.e. turn on its SSR."""
     def __init__(self, systemID : int, elapsedTime : float, cause : str="unknown"):
+        super().__init__(systemID, elapsedTime, cause)  # keeps the arguments so the exception can be pickled
         self.systemID = systemID
         self.elapsedTime = elapsedTime
         self.cause = cause
@@ -3,26 +3,39 @@ from tkinter import ttk
 from matplotlib.backends.backend_tkagg import (
 FigureCanvasTkAgg, NavigationToolbar2Tk)
 from matplotlib.figure import Figure
+from collections import deque
 import numpy as np
+import threading
+import time
 
 from bake_system import System
 import constants
-import funcs
+import downsample
+from ring_buffer import SharedRingBuffer
+from temp_detectors import SampledTempDetector
 
 class SystemUI:
     """
     A class to display the UI for a bake system in a tkinter-based GUI.
     """
-    def __init__(self, system : System, root : tkinter.Tk, notebook : ttk.Notebook):
+    def __init__(self, system : System, root : tkinter.Tk, notebook : ttk.Notebook, 
+                 tempDetector : SampledTempDetector=None, controlLock : threading.Lock=None):
+        """
+        tempDetector: the system's temperature detector, used to show how old the current reading is (optional)
+        controlLock: held while the set values are put into use and while the plotted data is copied, so neither
+        happens in the middle of an iteration of the control loop (optional, the ControlScheduler's lock)
+        """
         self.system = system
         self.root = root
         self.notebook = notebook
+        self.tempDetector = tempDetector
+        self.controlLock = threading.Lock() if controlLock is None else controlLock
 
         self.updateEachIteration = True
         self.timeSinceLastUIUpdate = 0
 
         self.tab = tkinter.Frame(self.notebook)
-        self.notebook.add(self.tab, text="Heater tape {}".format(self.system.id + 1))
+        self.notebook.add(self.tab, text=self.system.name)
         self.fig = Figure(figsize=(5, 4), dpi=100)
         self.ax = self.fig.add_subplot(1, 1, 1)
         self.graphFrame = ttk.Frame(self.tab)
@@ -34,8 +47,26 @@ class SystemUI:
         self.canvas.get_tk_widget().pack(side=tkinter.TOP, fill=tkinter.BOTH, expand=1)
         self.graphFrame.grid(row=0, column=0, sticky="nsew")
 
+        # the plot is only set up once, afterwards each update just changes the line's data and redraws the line
+        # on top of a saved copy of the rest of the plot (blitting), the whole figure is only redrawn when the
+        # axis limits have to change
+        self.line, = self.ax.plot([], [], animated=True)
+        # the min and max of each bucket, only shown when looking at the rolled up history
+        self.lowLine, = self.ax.plot([], [], animated=True, color=self.line.get_color(), alpha=0.4, linewidth=0.8)
+        self.highLine, = self.ax.plot([], [], animated=True, color=self.line.get_color(), alpha=0.4, linewidth=0.8)
+        self.viewDuration : float = None    # seconds of history to show, None to show the last data points
+        self.ax.set_xlabel("Time (minutes)")
+        self.ax.set_ylabel("Temperature (C)")
+        self.ax.set_title("Measured temperature vs time {}".format(self.system.name))
+        self.background = None
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        self.redrawTimes : deque[float] = deque(maxlen=100)  # seconds, the most recent plot redraws
+        self.numFullRedraws = 0
+
         self.controlFrame = ttk.Frame(self.tab)
         self.readingTempLabel = ttk.Label(self.controlFrame, text=constants.CURRENT_TEMP_STR.format(0))
+        self.readingAgeLabel = ttk.Label(self.controlFrame, text=constants.READING_AGE_STR.format(0))
+        self.redrawTimeLabel = ttk.Label(self.controlFrame, text=constants.REDRAW_TIME_STR.format(0, 0))
         self.setTempLabel = ttk.Label(self.controlFrame, text=constants.SET_TEMP_STR.format(self.system.displayTemp))
         self.setTempIncrementButton = tkinter.Button(self.controlFrame, text="Increment", 
                                                 command=lambda: self.increment_display_temp(1.0))
@@ -61,6 +92,9 @@ class SystemUI:
         self.updateEveryLabel = ttk.Label(self.controlFrame, text="Update every")
         self.updateEveryIterationButton = tkinter.Button(self.controlFrame, text="Iteration", command=lambda: self.setUpdateEachIteration(True))
         self.updateEveryMinuteButton = tkinter.Button(self.controlFrame, text="Minute", command=lambda: self.setUpdateEachIteration(False))
+        self.viewLabel = ttk.Label(self.controlFrame, text="Show")
+        self.viewButtons = [tkinter.Button(self.controlFrame, text=text, command=lambda d=duration: self.setViewDuration(d))
+                            for text, duration in constants.HISTORY_VIEWS]
         
         self.controlFrame.grid(row=0, column=1, sticky="nsew")
         self.setTempLabel.grid(row=0, column=0, sticky="nsew", columnspan=4)
@@ -83,14 +117,20 @@ class SystemUI:
         self.updateEveryLabel.grid(row=11, column=0, sticky="nsew")
         self.updateEveryIterationButton.grid(row=11, column=1, sticky="nsew")
         self.updateEveryMinuteButton.grid(row=11, column=2, sticky="nsew")
+        if self.tempDetector is not None:
+            self.readingAgeLabel.grid(row=12, column=0, sticky="nsew", columnspan=4)
+        self.redrawTimeLabel.grid(row=13, column=0, sticky="nsew", columnspan=4)
+        self.viewLabel.grid(row=14, column=0, sticky="nsew")
+        for i, button in enumerate(self.viewButtons):
+            button.grid(row=15 + i // 3, column=1 + i % 3, sticky="nsew")
         self.tab.grid_rowconfigure(0, weight=1)
         self.tab.grid_columnconfigure(0, weight=2)
         self.tab.grid_columnconfigure(1, weight=1)
 
-    def update(self, iterationNum : int, timeSinceLastIteration : float, storedTimes : list[float]) -> None:
+    def update(self, iterationNum : int, timeSinceLastIteration : float, storedTimes : SharedRingBuffer) -> None:
         """
         Updates UI values based on the system's updated current state. Time is not managed by the system so it needs to
-        be passed in.
+        be passed in. The stored times and temperatures are read straight from their shared memory ring buffers.
         """
         
         shouldUpdate : bool = True
@@ -101,15 +141,15 @@ class SystemUI:
 
         if shouldUpdate:
             self.timeSinceLastUIUpdate = 0
-            loc = iterationNum % constants.MAX_POINTS_IN_MEMORY
-            readTemp = 0 if self.system.storedTemps[loc] == None else self.system.storedTemps[loc]
-            # if self.system.storedTemps[loc] == None or self.system.storedTemps[loc - 2] == None else 
-            calculatedRate = funcs.average_rate_of_change(
-                funcs.rolling_moving_window(storedTimes, loc, min(iterationNum, self.system.current_num_points)),
-                funcs.rolling_moving_window(self.system.storedTemps, loc, min(iterationNum, self.system.current_num_points))
-            )
+            readTemp = 0 if np.isnan(self.system.storedTemps.latest()) else self.system.storedTemps.latest()
+            calculatedRate = self.system.measuredRate
             self.readingTempLabel.config(text=constants.CURRENT_TEMP_STR.format(round(readTemp, 2)))
             self.readingRateLabel.config(text=constants.CURRENT_RATE_STR.format(round(calculatedRate * 60, 2)))
+            if self.tempDetector is not None:
+                readingAgeText = constants.READING_AGE_STR.format(self.tempDetector.age())
+                if self.tempDetector.is_stale():
+                    readingAgeText += " (stale)"
+                self.readingAgeLabel.config(text=readingAgeText)
 
             # disable buttons if necessary
             if self.system.goingSet:
@@ -134,17 +174,87 @@ class SystemUI:
             else:
                 self.numPoints10MoreButton.config(state=tkinter.NORMAL)
             
-            self.ax.clear()
-            storedTimeWindow = funcs.rolling_moving_window(storedTimes, loc - 1,
-                                                            self.system.current_num_points)
-            storedTempWindow = funcs.rolling_moving_window(self.system.storedTemps, loc - 1,
-                                                            self.system.current_num_points)
-            xInMin = (np.array(storedTimeWindow).astype(float)) / 60
-            self.ax.plot(xInMin, storedTempWindow)
-            self.ax.set_xlabel("Time (minutes)")
-            self.ax.set_ylabel("Temperature (C)")
-            self.ax.set_title("Measured temperature vs time heater tape {}".format(self.system.id + 1))
-            self.fig.canvas.draw_idle()
+            # the data is copied while holding the control lock, an iteration appends the time before the workers
+            # append the temperatures so without it the times could be a point ahead of the temperatures
+            # (the windows are views into the ring buffers, which the next append overwrites once they are full)
+            if self.viewDuration is None:
+                with self.controlLock:
+                    storedTimeWindow = storedTimes.window(self.system.current_num_points).copy()
+                    storedTempWindow = self.system.storedTemps.window(self.system.current_num_points).copy()
+                xInMin = storedTimeWindow / 60
+                self.update_plot(xInMin, storedTempWindow)
+            else:
+                # the rolled up history is already small enough to plot as it is (series returns new arrays)
+                with self.controlLock:
+                    times, lows, means, highs = self.system.history.series(self.viewDuration)
+                self.update_plot(times / 60, means, lows, highs)
+            self.redrawTimeLabel.config(text=constants.REDRAW_TIME_STR.format(
+                self.redrawTimes[-1] * 1000, 1000 * sum(self.redrawTimes) / len(self.redrawTimes)))
+
+    def update_plot(self, x : np.ndarray, y : np.ndarray, lows : np.ndarray=None, highs : np.ndarray=None) -> None:
+        """
+        Shows the given data on the plot. Only the line is redrawn unless the data no longer fits in the axis limits
+        (or has shrunk to a small part of them), in which case the limits are recalculated and the whole figure is
+        redrawn. How long this takes is recorded in redrawTimes.
+        The data is cut down to the lowest and highest point in every two pixel columns of the plot, so no more points
+        are drawn than the plot is wide no matter how many are in the window.
+        lows and highs are the min and max at each x, drawn around the line if given.
+        """
+        start = time.perf_counter()
+        if lows is None:
+            x, y = downsample.min_max(x, y, max(1, int(self.ax.bbox.width) // 2))
+            self.lowLine.set_data([], [])
+            self.highLine.set_data([], [])
+            newLimits = self.limits_for(x, y)
+        else:
+            self.lowLine.set_data(x, lows)
+            self.highLine.set_data(x, highs)
+            newLimits = self.limits_for(np.concatenate((x, x)), np.concatenate((lows, highs)))
+        self.line.set_data(x, y)
+        if newLimits is not None or self.background is None:
+            if newLimits is not None:
+                self.ax.set_xlim(newLimits[0])
+                self.ax.set_ylim(newLimits[1])
+            self.canvas.draw()  # on_draw saves the new background and draws the line
+            self.numFullRedraws += 1
+        else:
+            self.canvas.restore_region(self.background)
+            self.draw_lines()
+            self.canvas.blit(self.ax.bbox)
+        self.redrawTimes.append(time.perf_counter() - start)
+
+    def limits_for(self, x : np.ndarray, y : np.ndarray) -> tuple[tuple[float, float], tuple[float, float]] | None:
+        """
+        Returns new (x, y) axis limits if the data doesn't fit the current ones well, otherwise None. The limits leave
+        some room past the newest time and around the temperatures so that they don't have to change every update.
+        """
+        valid = ~(np.isnan(x) | np.isnan(y))
+        if not valid.any():
+            return None
+        xLo, xHi = np.min(x[valid]), np.max(x[valid])
+        yLo, yHi = np.min(y[valid]), np.max(y[valid])
+        (axXLo, axXHi), (axYLo, axYHi) = self.ax.get_xlim(), self.ax.get_ylim()
+        xSpan = max(xHi - xLo, 1 / 60)
+        ySpan = max(yHi - yLo, 1)
+        fits = xLo >= axXLo and xHi <= axXHi and yLo >= axYLo and yHi <= axYHi
+        # the data only covering a small part of the axes means points have dropped out of the window
+        tooLoose = (axXHi - axXLo) > 2 * xSpan or (axYHi - axYLo) > 3 * ySpan
+        if fits and not tooLoose:
+            return None
+        return (xLo, xHi + 0.5 * xSpan), (yLo - 0.2 * ySpan, yHi + 0.2 * ySpan)
+
+    def on_draw(self, event) -> None:
+        """
+        Called whenever the whole figure is drawn (including by resizing and the toolbar): saves the new background
+        for blitting and draws the line on it, since the line is animated and left out of full draws.
+        """
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.draw_lines()
+        self.canvas.blit(self.ax.bbox)
+
+    def draw_lines(self) -> None:
+        for line in (self.lowLine, self.highLine, self.line):
+            self.ax.draw_artist(line)
     
     def increment_display_temp(self, amount : float) -> None:
         self.system.increment_display_temp(amount)
@@ -203,7 +313,8 @@ class SystemUI:
         self.goingSetButton.config(state=tkinter.NORMAL)
     
     def useSetValues(self) -> None:
-        self.system.useSetValues()
+        with self.controlLock:
+            self.system.useSetValues()
         self.setTempLabel.config(text=constants.SET_TEMP_STR.format(self.system.displayTemp))
         self.setRateLabel.config(text=constants.SET_RATE_STR.format(self.system.displayRate))
         self.setKiLabel.config(text=constants.SET_KI_STR.format(self.system.displayKi))
@@ -212,5 +323,9 @@ class SystemUI:
         self.system.changeNumPoints(changeAmount)
         self.numPointsLabel.config(text="Number of last visible data points: " + str(self.system.current_num_points))
     
+    def setViewDuration(self, duration : float) -> None:
+        """Shows the last duration seconds of the rolled up history on the plot, or the last data points if None."""
+        self.viewDuration = duration
+
     def setUpdateEachIteration(self, shouldDoEachIteration : bool) -> None:
         self.updateEachIteration = shouldDoEachIteration
\ No newline at end of file
@@ -0,0 +1,128 @@
+# Checks that autotune.py finds the models of heater tapes whose models are known, and times it on a whole archive
+# A folder of synthetic runs is made: every run has the same tapes (first order plus dead time, with per run ambient
+# temperatures), driven by duty cycles that change to a random level every 10 to 40 minutes, read with noise and
+# rounded to the MAX6675's 0.25 degrees. Most are run logs, one is a csv laid out like the variac experiments (the
+# temperatures followed by the duty cycles). Then:
+# 1. every run and tape is fit, and the time constants and gains have to come out within 5% (median within 2%) and the
+#    dead times within one sample
+# 2. the ki and rate proposed for each tape are simulated on its true model, and must settle without tripping a safety
+#    check or overshooting by AUTOTUNE_MAX_OVERSHOOT
+# Exits with 1 if either fails.
+# Run from the repository root: python benchmarks/autotune_check.py [--runs 100] [--hours 6] [--target 150]
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sim_bake  # sets the simulated hardware backend before anything imports hardware
+import autotune
+import constants
+import run_log
+from channels import Channel, save_channels
+
+# the tapes every run has: (name, tau in seconds, gain in degrees, dead time in seconds)
+TAPES = (("Chamber top", 100 * 60, 250, 20), ("Chamber bottom", 80 * 60, 220, 40),
+         ("Flange", 45 * 60, 180, 0), ("Bellows", 130 * 60, 300, 60))
+
+def simulate_run(rng : np.random.Generator, numSeconds : int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the times, readings, and duty cycles (seconds, tapes) of one run of every tape in TAPES."""
+    numTapes = len(TAPES)
+    tau = np.array([tape[1] for tape in TAPES], dtype=float)
+    gain = np.array([tape[2] for tape in TAPES], dtype=float)
+    deadTime = np.array([tape[3] for tape in TAPES])
+    ambient = rng.uniform(18, 26)
+    duties = np.zeros((numSeconds, numTapes))
+    for tape in range(numTapes):
+        start = 0
+        while start < numSeconds:
+            length = int(rng.uniform(10, 40) * 60)
+            duties[start:start + length, tape] = rng.choice([0, rng.uniform(0.1, 0.9)], p=[0.3, 0.7])
+            start += length
+    temps = np.zeros((numSeconds, numTapes))
+    temp = np.full(numTapes, ambient)
+    decay = np.exp(-1 / tau)
+    for second in range(numSeconds):
+        delayed = np.where(second >= deadTime, duties[np.maximum(second - deadTime, 0), np.arange(numTapes)], 0)
+        settled = ambient + gain * delayed
+        temp = settled + (temp - settled) * decay
+        temps[second] = temp
+    readings = np.round((temps + rng.normal(0, constants.SIM_NOISE, temps.shape)) * 4) / 4
+    return np.arange(numSeconds, dtype=float) + 1, readings, duties
+
+def write_archive(folder : str, numRuns : int, numSeconds : int, seed : int=0) -> None:
+    rng = np.random.default_rng(seed)
+    channels = [Channel(name, 100 + 2 * i, 101 + 2 * i, 98, 99) for i, (name, _, _, _) in enumerate(TAPES)]
+    for runNum in range(numRuns):
+        times, readings, duties = simulate_run(rng, numSeconds)
+        baseName = os.path.join(folder, "plot_data_{:04d}".format(runNum))
+        save_channels(channels, baseName + constants.CHANNELS_COPY_EXTENSION)
+        if runNum == 0:
+            np.savetxt(baseName + ".csv", np.column_stack((times, readings, duties)), fmt="%.10g", delimiter=",")
+            continue
+        records = np.zeros(numSeconds, dtype=run_log.record_dtype(len(TAPES)))
+        records["time"] = times
+        records["temp"] = readings
+        records["duty"] = duties
+        records["step"] = np.nan
+        with open(baseName + run_log.FILE_EXTENSION, "wb") as file:
+            file.write(run_log.make_header(len(TAPES), 0))
+            file.write(records.tobytes())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--hours", type=float, default=6)
+    parser.add_argument("--target", type=float, default=150)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    write_archive(folder, args.runs, int(args.hours * 60 * 60))
+    start = time.perf_counter()
+    numTapes = len(TAPES)
+    temps, duties, labels = autotune.load_archive(folder, dutyColumns=list(range(numTapes + 1, 2 * numTapes + 1)))
+    loaded = time.perf_counter()
+    fit = autotune.fit_fopdt(temps, duties)
+    fitted = time.perf_counter()
+    print("{} runs of {:.0f} h ({} series): loaded in {:.2f} s, fit in {:.2f} s".format(
+        args.runs, args.hours, len(labels), loaded - start, fitted - loaded))
+
+    names = [name for name, _, _, _ in TAPES]
+    tapes = np.array([names.index(name) for _, name in labels])
+    trueTau = np.array([TAPES[i][1] for i in tapes], dtype=float)
+    trueGain = np.array([TAPES[i][2] for i in tapes], dtype=float)
+    trueDeadTime = np.array([TAPES[i][3] for i in tapes], dtype=float)
+    tauError = np.abs(fit.tau / trueTau - 1)
+    gainError = np.abs(fit.gain / trueGain - 1)
+    deadTimeError = np.abs(fit.deadTime - trueDeadTime)
+    print("time constant error: median {:.2%}, max {:.2%}".format(np.median(tauError), np.max(tauError)))
+    print("gain error: median {:.2%}, max {:.2%}".format(np.median(gainError), np.max(gainError)))
+    print("dead time error: max {:.0f} s".format(np.max(deadTimeError)))
+    fitsOk = (np.all(fit.valid()) and np.max(tauError) < 0.05 and np.median(tauError) < 0.02
+              and np.max(gainError) < 0.05 and np.median(gainError) < 0.02
+              and np.max(deadTimeError) <= constants.AUTOTUNE_SAMPLE_INTERVAL)
+
+    tapeNames, tapeFits, _ = autotune.combine_by_tape(fit, labels)
+    start = time.perf_counter()
+    proposals = autotune.propose(tapeFits, args.target)
+    print("proposals simulated in {:.2f} s".format(time.perf_counter() - start))
+    # the proposals run on the true models, with ambient temperatures from the runs
+    order = [names.index(name) for name in tapeNames]
+    trueFits = autotune.FopdtFit(np.array([TAPES[i][1] for i in order], dtype=float),
+                                 np.array([TAPES[i][2] for i in order], dtype=float), tapeFits.ambient,
+                                 np.array([TAPES[i][3] for i in order], dtype=float), tapeFits.r2,
+                                 tapeFits.numSamples)
+    found = ~np.isnan(proposals["ki"])
+    results = autotune.simulate_bakes(trueFits, args.target, np.where(found, proposals["ki"], constants.MIN_SET_KI),
+                                      np.where(found, proposals["rate"], constants.MAX_SET_RATE))
+    proposalsOk = True
+    for i, name in enumerate(tapeNames):
+        ok = (found[i] and not results["tripped"][i] and results["overshoot"][i] < constants.AUTOTUNE_MAX_OVERSHOOT
+              and np.isfinite(results["settling"][i]))
+        proposalsOk = proposalsOk and ok
+        print("{:>15}: ki {:.1f}, rate {:.1f} C/m (limit {:.2f}), settles in {:.1f} min with {:.2f} C overshoot{}".format(
+            name, proposals["ki"][i], proposals["rate"][i], proposals["rateLimit"][i],
+            results["settling"][i] / 60, results["overshoot"][i], "" if ok else " FAILED"))
+    sys.exit(0 if fitsOk and proposalsOk else 1)
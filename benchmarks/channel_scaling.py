@@ -0,0 +1,75 @@
+# Measures how the cost of one iteration of the control loop grows with the number of channels
+# Simulated bakes (on a VirtualClock) are run with more and more channels (sim_bake.sim_channels), and every call of
+# bake_controller.iterate is timed for each way of running them:
+#   workers           a ChannelWorker per channel (every channel in its own group)
+#   workers/<n>       a ChannelWorker per group of n channels
+#   vectorized        one BatchWorker (ControlEngine) for every channel
+# For each it prints the p50 and p95 in microseconds and the exponent k of the best fit of p50 ~ channels^k, so k < 1
+# means the cost per channel goes down as channels are added. Exits with 1 if the vectorized engine's exponent is not
+# below 1. The workers run every channel's System.run, so their total work grows with the channels, and only stays
+# sub-linear in time while there are cores to spread the groups over.
+# The simulated detectors read instantly, a bit banged MAX6675 takes about 17 ms, so on the pi the sensors have to be
+# read together (TEMP_DETECTOR_BACKEND "array") or over the SPI bus for the vectorized engine to scale like this.
+# Run from the repository root: python benchmarks/channel_scaling.py [--channels 4 8 16 32] [--iterations 200]
+#                                                                    [--group-size 4]
+import argparse
+import contextlib
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sim_bake  # sets the simulated hardware backend before anything imports hardware
+import bake_controller
+import constants
+
+def iteration_times(engine : str, numChannels : int, groupSize : int, numIterations : int) -> np.ndarray:
+    """Returns how long each iterate of a simulated bake took, in seconds."""
+    constants.CONTROL_ENGINE = engine
+    samples = []
+    iterate = bake_controller.iterate
+    def timed_iterate(*args):
+        start = time.perf_counter()
+        result = iterate(*args)
+        samples.append(time.perf_counter() - start)
+        return result
+    bake_controller.iterate = timed_iterate
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            sim_bake.run(constants.TOTAL_STARTUP_TIME + numIterations * constants.SET_PERIOD, True,
+                         sim_bake.sim_channels(numChannels, groupSize))
+    finally:
+        bake_controller.iterate = iterate
+    return np.asarray(samples[1:])  # the first one includes the workers' first wake up
+
+def scaling_exponent(numChannels : list[int], times : list[float]) -> float:
+    """The k of the least squares fit of log(time) = k log(channels) + c."""
+    return float(np.polyfit(np.log(numChannels), np.log(times), 1)[0])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--group-size", type=int, default=4, help="channels per worker for the grouped workers")
+    args = parser.parse_args()
+
+    constants.SIM_SEED = 0
+    runs = (("workers", "workers", 1), ("workers/{}".format(args.group_size), "workers", args.group_size),
+            ("vectorized", "vectorized", None))
+    exponents = {}
+    print("{:>14} {:>9} {:>10} {:>10} {:>14}".format("engine", "channels", "p50 us", "p95 us", "p50 us/channel"))
+    for name, engine, groupSize in runs:
+        p50s = []
+        for numChannels in args.channels:
+            samples = iteration_times(engine, numChannels, groupSize, args.iterations) * 1e6
+            p50s.append(float(np.percentile(samples, 50)))
+            print("{:>14} {:>9} {:>10.1f} {:>10.1f} {:>14.1f}".format(name, numChannels, p50s[-1],
+                                                                      np.percentile(samples, 95),
+                                                                      p50s[-1] / numChannels))
+        exponents[name] = scaling_exponent(args.channels, p50s)
+        print("{:>14} p50 ~ channels^{:.2f}".format(name, exponents[name]))
+
+    print("{} cores, the vectorized engine scales {}".format(
+        os.cpu_count(), "sub-linearly" if exponents["vectorized"] < 1 else "linearly or worse"))
+    sys.exit(0 if exponents["vectorized"] < 1 else 1)
@@ -0,0 +1,234 @@
+# Measures how long each phase of the control loop takes, against the simulated hardware on a VirtualClock
+# For every combination of channel count and history depth it times (p50, p95, p99 in microseconds):
+#   spawn_join      starting and stopping one worker process (what was done every iteration before the workers)
+#   system_pickle   pickling a whole System, as was sent to a new process every iteration before the workers
+#   state_pickle    pickling and unpickling one iteration's command and results, as the workers are sent now
+#   worker_round    sending the command to every worker and getting all the results back
+#   sensor_read     a fresh read of one SampledTempDetector (SimulatedMAX6675)
+#   control         System.run, the PID and stepping logic for one channel (with a cached reading)
+#   ssr_schedule    RelayScheduler.schedule for all channels
+#   ui_update       SystemUI.update_plot for the visible channel (Agg canvas, so no tk labels are included)
+#   csv_append      opening, appending one row to, and closing the csv file (how it was done before the DataLogger)
+#   csv_log         DataLogger.log, what the loop does now
+#   iterate         a whole bake_controller.iterate
+# and saves them as json. Given a baseline file it exits with 1 if any phase got slower than the tolerance allows.
+# Run from the repository root: python benchmarks/control_loop.py [--channels 4 8 16] [--depths 1500 15000]
+#                                                                  [--iterations 300] [--output file]
+#                                                                  [--baseline file] [--tolerance 0.25]
+import argparse
+import contextlib
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sim_bake  # sets the simulated hardware backend before anything imports hardware
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import bake_controller
+import clocks
+import constants
+from bake_system import System
+from bake_system_ui import SystemUI
+from channel_worker import ChannelWorker
+from data_logger import DataLogger
+from relay_scheduler import RelayScheduler
+from ring_buffer import SharedRingBuffer
+from run_log import CsvRowFormat
+from temp_detectors import create_temp_detectors
+
+PHASES = ("spawn_join", "system_pickle", "state_pickle", "worker_round", "sensor_read", "control", "ssr_schedule",
+          "ui_update", "csv_append", "csv_log", "iterate")
+
+class AggSystemUI(SystemUI):
+    """A SystemUI with only its plot, drawn on an Agg canvas so it can be timed without a display."""
+    def __init__(self, system : System):
+        self.system = system
+        self.fig = Figure(figsize=(5, 4), dpi=100)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(1, 1, 1)
+        self.line, = self.ax.plot([], [], animated=True)
+        self.lowLine, = self.ax.plot([], [], animated=True)
+        self.highLine, = self.ax.plot([], [], animated=True)
+        self.background = None
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+        self.redrawTimes = []
+        self.numFullRedraws = 0
+
+def percentiles(samples : list[float]) -> dict[str, float]:
+    samples = np.asarray(samples) * 1e6
+    return {"p50": float(np.percentile(samples, 50)), "p95": float(np.percentile(samples, 95)),
+            "p99": float(np.percentile(samples, 99)), "mean": float(np.mean(samples)), "n": len(samples)}
+
+def timed(samples : list[float], function : callable, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    samples.append(time.perf_counter() - start)
+    return result
+
+def fill_history(storedTimes : SharedRingBuffer, systems : list[System], depth : int) -> None:
+    """Fills the buffers with depth iterations of a slow ramp, as if the bake had been running for a while."""
+    for i in range(depth):
+        storedTimes.append(i * constants.SET_PERIOD)
+        for system in systems:
+            system.storedTemps.append(22 + i * constants.SET_PERIOD / 60)
+
+def bench_phases(numChannels : int, depth : int, numIterations : int) -> dict[str, list[float]]:
+    """Times every phase except iterate for the given number of channels and history depth."""
+    samples = {phase: [] for phase in PHASES}
+    clocks.set_clock(clocks.VirtualClock())
+    clock = clocks.get_clock()
+    defaultDepth = constants.MAX_POINTS_IN_MEMORY
+    constants.MAX_POINTS_IN_MEMORY = depth  # the size of each system's storedTemps
+    relayPins = [channel.relay for channel in sim_bake.sim_channels(numChannels)]
+    storedTimes = SharedRingBuffer(depth)
+    systems = [System(i, relay) for i, relay in enumerate(relayPins)]
+    tempDetectors, _ = create_temp_detectors([], [], [], relayPins)
+    relayScheduler = RelayScheduler()
+    ui = AggSystemUI(systems[0])
+    systems[0].current_num_points = depth
+    folder = tempfile.mkdtemp()
+    csvFileName = os.path.join(folder, "append.csv")
+    dataLogger = DataLogger(os.path.join(folder, "logged.csv"))
+    workers = []
+    try:
+        fill_history(storedTimes, systems, depth)
+        for system in systems:
+            system.history.add(depth * constants.SET_PERIOD, 22)
+        relayScheduler.start()
+        dataLogger.start()
+
+        # starting and stopping processes is slow, so only a few are timed
+        for _ in range(min(5, numIterations)):
+            worker = ChannelWorker([systems[0]], [tempDetectors[0]])
+            timed(samples["spawn_join"], lambda: (worker.start(), worker.stop()))
+
+        workers = [ChannelWorker([system], [tempDetector]) for system, tempDetector in zip(systems, tempDetectors)]
+        for worker in workers:
+            worker.start()
+        row = None
+        for iterationNum in range(numIterations):
+            clock.sleep(constants.SET_PERIOD)
+            timeElapsed = (depth + iterationNum) * constants.SET_PERIOD
+            storedTimes.append(timeElapsed)
+            timed(samples["system_pickle"], pickle.dumps, systems[iterationNum % numChannels])
+            command = (iterationNum, timeElapsed, constants.SET_PERIOD,
+                       {system.id: system.get_control_state() for system in systems})
+            timed(samples["state_pickle"], lambda: pickle.loads(pickle.dumps(command)))
+
+            def round_trip():
+                for worker in workers:
+                    worker.send(iterationNum, timeElapsed, constants.SET_PERIOD)
+                return [result for worker in workers for result in worker.receive()]
+            results = timed(samples["worker_round"], round_trip)
+            for systemID, state, _ in results:
+                systems[systemID].set_control_state(state)
+
+            # the same work the workers did, timed in this process
+            tempDetector = tempDetectors[iterationNum % numChannels]
+            tempDetector.sample[2] = -np.inf   # so it is really read
+            timed(samples["sensor_read"], tempDetector.get)
+            system = systems[iterationNum % numChannels]
+            timed(samples["control"], system.run, iterationNum, timeElapsed, tempDetector, constants.SET_PERIOD)
+
+            timed(samples["ssr_schedule"], relayScheduler.schedule, systems)
+            x = storedTimes.window(depth) / 60
+            timed(samples["ui_update"], ui.update_plot, x, systems[0].storedTemps.window(depth))
+
+            row = (timeElapsed, tuple(float(s.storedTemps.latest()) for s in systems),
+                   tuple(s.computedDutyCycle for s in systems), tuple(s.stepToTemp for s in systems),
+                   tuple(int(s.operation_status) for s in systems))
+            def append_row():
+                with open(csvFileName, "a+") as file:
+                    file.write(CsvRowFormat().format([row]))
+            timed(samples["csv_append"], append_row)
+            timed(samples["csv_log"], dataLogger.log, row)
+    finally:
+        constants.MAX_POINTS_IN_MEMORY = defaultDepth
+        dataLogger.close()
+        relayScheduler.stop()
+        for worker in workers:
+            worker.stop()
+        storedTimes.close()
+        for system in systems:
+            system.storedTemps.close()
+    return samples
+
+def bench_iterate(numChannels : int, numIterations : int) -> list[float]:
+    """Times whole calls of bake_controller.iterate during a simulated bake."""
+    samples = []
+    iterate = bake_controller.iterate
+    def timed_iterate(*args):
+        timed(samples, iterate, *args)
+    bake_controller.iterate = timed_iterate
+    try:
+        sim_bake.run(constants.TOTAL_STARTUP_TIME + numIterations * constants.SET_PERIOD, True,
+                     sim_bake.sim_channels(numChannels))
+    finally:
+        bake_controller.iterate = iterate
+    return samples
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+def find_regressions(results : dict, baseline : dict, tolerance : float) -> list[str]:
+    """Returns a description of every phase whose p95 is more than tolerance slower than in the baseline."""
+    regressions = []
+    for key, phases in results["runs"].items():
+        for phase, stats in phases.items():
+            old = baseline.get("runs", {}).get(key, {}).get(phase)
+            if old is not None and stats["p95"] > old["p95"] * (1 + tolerance):
+                regressions.append("{} {}: p95 {:.1f} us, was {:.1f} us".format(key, phase, stats["p95"], old["p95"]))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--depths", type=int, nargs="+", default=[constants.MAX_POINTS_IN_MEMORY, 15000])
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--output", default=os.path.join("benchmarks", "results", "control_loop.json"))
+    parser.add_argument("--baseline", help="a previous output to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="how much slower a p95 can get (0.25 is 25%%)")
+    args = parser.parse_args()
+
+    results = {"commit": git_commit(), "python": platform.python_version(), "machine": platform.machine(),
+               "iterations": args.iterations, "runs": {}}
+    print("{:>22} {:>14} {:>10} {:>10} {:>10}".format("run", "phase", "p50 us", "p95 us", "p99 us"))
+    for numChannels in args.channels:
+        for depth in args.depths:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                samples = bench_phases(numChannels, depth, args.iterations)
+                samples["iterate"] = bench_iterate(numChannels, args.iterations)
+            key = "{}ch_{}deep".format(numChannels, depth)
+            results["runs"][key] = {phase: percentiles(samples[phase]) for phase in PHASES}
+            for phase in PHASES:
+                stats = results["runs"][key][phase]
+                print("{:>22} {:>14} {:>10.1f} {:>10.1f} {:>10.1f}".format(key, phase, stats["p50"], stats["p95"],
+                                                                        stats["p99"]))
+
+    folder = os.path.dirname(args.output)
+    if folder != "" and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print("Saved to {}".format(args.output))
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            regressions = find_regressions(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("Slower: " + regression)
+        sys.exit(1 if len(regressions) > 0 else 0)
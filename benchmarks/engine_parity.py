@@ -0,0 +1,245 @@
+# Checks that the ControlEngine makes exactly the same decisions as System.run, and times both
+# 1. randomized scenarios: channels with random set values, timers, and statuses are run through System.run one at a
+#    time and through ControlEngine.step all at once, with random temperature walks (with jumps and readings far out
+#    of range to set off the safety checks), uneven iteration times, the Go button being pressed, and sensor errors.
+#    Every control state field, stored temperature, and exception has to be identical after every iteration. A sensor
+#    error makes the real loop shut down, so a scenario ends after the iteration with one.
+# 2. a ramp with failed readings in the middle of it, which keeps going after them, and where the measured rate holds
+#    back steps (it has to at least once). The control state has to be identical after every iteration.
+# 3. the whole simulated bake (benchmarks/sim_bake.py) run with the workers and with the vectorized engine, without
+#    reading noise, has to log identical rows.
+# 4. how long one iteration of the control logic takes for different numbers of channels.
+# Exits with 1 if anything differs.
+# Run from the repository root: python benchmarks/engine_parity.py [--scenarios 200] [--iterations 2000]
+#                                                                  [--bake-seconds 7200]
+import argparse
+import contextlib
+import math
+import os
+import random
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sim_bake  # sets the simulated hardware backend before anything imports hardware
+import constants
+from bake_system import System
+from control_engine import ControlEngine
+from hardware import MAX6675Error
+
+class ScriptedDetector:
+    """A temperature detector that returns whatever it is set to, and raises MAX6675Error for NaN."""
+    def __init__(self):
+        self.temp = math.nan
+
+    def get(self) -> float:
+        if math.isnan(self.temp):
+            raise MAX6675Error("Thermocouple not connected")
+        return self.temp
+
+def random_system(rng : random.Random, systemID : int) -> System:
+    """A system part way through a bake, with random set values and state."""
+    system = System(systemID, 0, startSetTemp=rng.choice([rng.randint(25, 250), round(rng.uniform(25, 250), 2)]),
+                    startSetRate=round(rng.uniform(0.1, 5), 1), startSetKi=round(rng.uniform(1, 100), 1))
+    system.stepToTemp = system.desiredTemp + rng.randint(-20, 20)
+    system.steppingUp = rng.random() < 0.5
+    system.numStepsTaken = rng.choice([0, 0, 1, rng.randint(2, 100)])
+    system.hasSteppedToDesired = rng.random() < 0.2
+    system.timeSinceLastStep = rng.uniform(0, 600)
+    system.error_running_sum = rng.uniform(-50, 50)
+    system.prev_error = rng.uniform(-5, 5)
+    system.timeOutOfAcceptableRange = rng.choice([0, rng.uniform(0, 40)])
+    system.operation_status = rng.choice(list(constants.OPERATION_STATUSES))
+    system.updateDataEveryMinute = rng.random() < 0.2
+    system.timeSinceLastUpdate = rng.uniform(0, 120)
+    return system
+
+def same(a, b) -> bool:
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b
+
+def describe(error : Exception) -> tuple:
+    """What is compared of an exception, the cause of an unreliable system is the detector's own exception."""
+    cause = error.cause if isinstance(error.cause, str) else type(error.cause).__name__
+    return type(error).__name__, int(error.systemID), error.elapsedTime, cause
+
+def run_both(label : str, systems : list[System], detectors : list[ScriptedDetector], engine : ControlEngine,
+             iterationNum : int, timeElapsed : float, lastIterationTime : float) -> list[str]:
+    """Runs one iteration through System.run and ControlEngine.step and returns a description of every difference."""
+    differences = []
+    expectedErrors = []
+    for system, detector in zip(systems, detectors):
+        _, errList = system.run(iterationNum, timeElapsed, detector, lastIterationTime)
+        expectedErrors.extend(describe(e) for e in errList)
+    readings = np.array([detector.temp for detector in detectors])
+    storedTemps, newlyInoperable, tooHigh = engine.step(timeElapsed, lastIterationTime, readings)
+    errors = [("SystemUnreliableError", int(i), timeElapsed, "MAX6675Error")
+              for i in np.flatnonzero(np.isnan(readings))]
+    errors += [("SystemInoperableError", int(i), timeElapsed, " the temperature reading being too "
+                + ("high" if tooHigh[i] else "low") + " for too long") for i in np.flatnonzero(newlyInoperable)]
+    if sorted(errors) != sorted(expectedErrors):
+        differences.append("{}: exceptions {} != {}".format(label, errors, expectedErrors))
+    for i, system in enumerate(systems):
+        if not same(float(storedTemps[i]), float(system.storedTemps.latest())):
+            differences.append("{} channel {}: stored {} != {}".format(label, i, storedTemps[i],
+                                                                       system.storedTemps.latest()))
+        expected = system.get_control_state()
+        actual = engine.get_control_state(i)
+        for field in System.CONTROL_STATE_FIELDS:
+            if not same(actual[field], expected[field]):
+                differences.append("{} channel {}: {} {} != {}".format(label, i, field, actual[field],
+                                                                       expected[field]))
+    return differences
+
+def run_scenario(seed : int, numChannels : int, numIterations : int) -> list[str]:
+    """Runs one random scenario both ways and returns a description of every difference."""
+    rng = random.Random(seed)
+    systems = [random_system(rng, i) for i in range(numChannels)]
+    detectors = [ScriptedDetector() for _ in systems]
+    engine = ControlEngine(numChannels)
+    for i, system in enumerate(systems):
+        engine.load_state(i, system.get_control_state())
+    temps = [system.stepToTemp + rng.uniform(-4, 4) for system in systems]
+    timeElapsed = rng.choice([0.0, constants.TOTAL_STARTUP_TIME - 2.0])
+    differences = []
+    try:
+        for iterationNum in range(numIterations):
+            lastIterationTime = rng.choice([1.0, 1.0, 1.0, rng.uniform(0.9, 1.5), rng.uniform(1, 30)])
+            timeElapsed += lastIterationTime
+            for i in range(numChannels):
+                r = rng.random()
+                if r < 0.002:
+                    temps[i] = rng.choice([constants.MIN_ACCEPTABLE_TEMP - 5, systems[i].maxAcceptableTemp + 5])
+                elif r < 0.01:
+                    temps[i] += rng.uniform(-6, 6)
+                else:
+                    temps[i] += rng.gauss(0.02 if systems[i].steppingUp else -0.02, 0.3)
+                detectors[i].temp = round(temps[i] * 4) / 4    # the MAX6675's resolution
+            errorChannel = rng.randrange(numChannels) if rng.random() < 0.0005 else None
+            if errorChannel is not None:
+                detectors[errorChannel].temp = math.nan
+            # someone pressing Go with new set values
+            if rng.random() < 0.01:
+                i = rng.randrange(numChannels)
+                systems[i].displayTemp = rng.randint(25, 250)
+                systems[i].displayRate = round(rng.uniform(0.1, 5), 1)
+                systems[i].useSetValues()
+                engine.load_state(i, systems[i].get_control_state())
+
+            differences += run_both("seed {} iteration {}".format(seed, iterationNum), systems, detectors, engine,
+                                    iterationNum, timeElapsed, lastIterationTime)
+            if len(differences) > 0 or errorChannel is not None:
+                break
+    finally:
+        for system in systems:
+            system.storedTemps.close()
+    return differences
+
+def run_failing_ramp(numIterations : int) -> tuple[list[str], int]:
+    """
+    Ramps three channels up, in stretches faster than STEP_HOLD_RATE_FACTOR times their set rate (where the measured
+    rate holds back their steps) and stretches slower than it, with failed readings in the middle of the ramp: every
+    7th reading of the first channel and a random 5% of the second's. Unlike the live loop, which stops on a failed
+    reading, this keeps going after them, so the channels' estimators have to skip the failed readings the same way.
+    Returns a description of every difference and how many times a due step was held back by the measured rate.
+    """
+    rng = random.Random(0)
+    systems = [System(i, 0, startSetTemp=240, startSetRate=0.5, startSetKi=10) for i in range(3)]
+    detectors = [ScriptedDetector() for _ in systems]
+    engine = ControlEngine(len(systems))
+    engine.load_states([system.get_control_state() for system in systems])
+    temps = [30.0] * len(systems)
+    timeElapsed = 0.0
+    differences = []
+    numHeld = 0
+    try:
+        for iterationNum in range(numIterations):
+            lastIterationTime = rng.choice([1.0, 1.0, rng.uniform(0.9, 1.5)])
+            timeElapsed += lastIterationTime
+            rate = (1.5 if (iterationNum // 300) % 2 == 0 else 0.3) / 60    # degrees per second
+            for i in range(len(systems)):
+                temps[i] += rate * lastIterationTime + rng.gauss(0, 0.05)
+                failed = (i == 0 and iterationNum % 7 == 3) or (i == 1 and rng.random() < 0.05)
+                detectors[i].temp = math.nan if failed else round(temps[i] * 4) / 4
+            differences += run_both("failing ramp iteration {}".format(iterationNum), systems, detectors, engine,
+                                    iterationNum, timeElapsed, lastIterationTime)
+            for system, detector in zip(systems, detectors):
+                # the step's time was up and the temperature had reached it, but it wasn't taken
+                numHeld += (not math.isnan(detector.temp) and system.numStepsTaken > 0
+                            and system.timeSinceLastStep - lastIterationTime >= 60 / system.desiredRate
+                            and detector.temp >= system.stepToTemp and system.stepToTemp < system.desiredTemp
+                            and system.measuredRate > system.desiredRate * constants.STEP_HOLD_RATE_FACTOR / 60)
+            if len(differences) > 0:
+                break
+    finally:
+        for system in systems:
+            system.storedTemps.close()
+    return differences, numHeld
+
+def bake_rows(engine : str, seconds : float) -> list[tuple]:
+    constants.CONTROL_ENGINE = engine
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        _, rows = sim_bake.run(seconds, True)
+    return rows
+
+def time_per_iteration(numChannels : int, numIterations : int) -> tuple[float, float]:
+    """Returns the seconds per iteration of System.run on every channel and of one ControlEngine.step."""
+    rng = random.Random(0)
+    systems = [random_system(rng, i) for i in range(numChannels)]
+    detectors = [ScriptedDetector() for _ in systems]
+    engine = ControlEngine(numChannels)
+    for i, system in enumerate(systems):
+        engine.load_state(i, system.get_control_state())
+    readings = np.array([system.stepToTemp for system in systems], dtype=float)
+    try:
+        start = time.perf_counter()
+        for iterationNum in range(numIterations):
+            for system, detector, reading in zip(systems, detectors, readings):
+                detector.temp = reading
+                system.run(iterationNum, 10.0 + iterationNum, detector, 1.0)
+        perSystemTime = (time.perf_counter() - start) / numIterations
+        start = time.perf_counter()
+        for iterationNum in range(numIterations):
+            engine.step(10.0 + iterationNum, 1.0, readings)
+        engineTime = (time.perf_counter() - start) / numIterations
+    finally:
+        for system in systems:
+            system.storedTemps.close()
+    return perSystemTime, engineTime
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--bake-seconds", type=float, default=2 * 60 * 60)
+    args = parser.parse_args()
+
+    differences = []
+    for seed in range(args.scenarios):
+        found = run_scenario(seed, 1 + seed % 8, args.iterations)
+        differences.extend(found)
+    print("{} random scenarios: {} differences".format(args.scenarios, len(differences)))
+    for difference in differences[:20]:
+        print("  " + difference)
+
+    rampDifferences, numHeld = run_failing_ramp(args.iterations)
+    print("ramp with failed readings: {} differences, steps held back by the measured rate {} times".format(
+        len(rampDifferences), numHeld))
+    for difference in rampDifferences[:20]:
+        print("  " + difference)
+    differences += rampDifferences
+
+    constants.SIM_NOISE = 0
+    workerRows = bake_rows("workers", args.bake_seconds)
+    engineRows = bake_rows("vectorized", args.bake_seconds)
+    bakeSame = workerRows == engineRows
+    print("simulated bake of {:.0f} s: {} rows, identical: {}".format(args.bake_seconds, len(workerRows), bakeSame))
+
+    print("{:>9} {:>16} {:>16}".format("channels", "System.run us", "engine us"))
+    for numChannels in (1, 4, 16, 64, 256):
+        perSystemTime, engineTime = time_per_iteration(numChannels, 200)
+        print("{:>9} {:>16.1f} {:>16.1f}".format(numChannels, perSystemTime * 1e6, engineTime * 1e6))
+
+    sys.exit(0 if len(differences) == 0 and numHeld > 0 and bakeSame else 1)
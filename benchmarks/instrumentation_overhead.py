@@ -0,0 +1,50 @@
+# Measures what the instrumentation costs at each verbosity level
+# For each level it times (in nanoseconds per call) an event, a span, and the "iteration" event the control loop
+# records, built only when it is enabled the way bake_controller.iterate does it. At OFF all of them should be close to the cost
+# of an empty function call.
+# Run from the repository root: python benchmarks/instrumentation_overhead.py [--calls 200000]
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import instrumentation
+from constants import VERBOSITY
+
+def per_call(function : callable, numCalls : int) -> float:
+    """Returns the average time of a call to function in nanoseconds."""
+    start = time.perf_counter()
+    for _ in range(numCalls):
+        function()
+    return (time.perf_counter() - start) / numCalls * 1e9
+
+def nothing() -> None:
+    pass
+
+def record_event() -> None:
+    instrumentation.event(VERBOSITY.DEBUG, "step", system=0, stepToTemp=50)
+
+def record_span() -> None:
+    with instrumentation.span("control"):
+        pass
+
+temps = [50.0, 50.25, 49.75, 50.0]
+def record_iteration() -> None:
+    if instrumentation.enabled(VERBOSITY.INFO):
+        instrumentation.event(VERBOSITY.INFO, "iteration", iteration=1, elapsed=1.0, period=1.0,
+                              temps=list(temps), duty=list(temps), stepTo=[50] * 4, status=[0] * 4)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200000)
+    args = parser.parse_args()
+
+    print("empty call: {:.0f} ns".format(per_call(nothing, args.calls)))
+    print("{:>8} {:>12} {:>12} {:>12}".format("level", "event ns", "span ns", "iteration ns"))
+    for level in VERBOSITY:
+        instrumentation.reset()
+        instrumentation.configure(level)
+        print("{:>8} {:>12.0f} {:>12.0f} {:>12.0f}".format(level.name, per_call(record_event, args.calls),
+                                                          per_call(record_span, args.calls),
+                                                          per_call(record_iteration, args.calls)))
@@ -0,0 +1,170 @@
+# Checks the MAX6675 drivers against the simulated GPIO pins (fake_gpio) and a stand in for a spidev device
+# 1. MAX6675SPI decodes the frames it reads in one transfer (with the chip selected by a GPIO pin during it), raises
+#    MAX6675Error for a frame with the open thermocouple bit (D2) set, and when the transfer fails raises
+#    MAX6675Error too (so the channel is marked unreliable instead of stopping the bake), unselects the chip, and
+#    releases the bus lock. The detector reads again once the failed read's sample interval is up.
+# 2. the "spidev" detector backend uses the SPI bus when it can be opened and bit bangs the chip when it can't
+#    (or when spidev isn't installed)
+# 3. MAX6675Array reads several simulated chips (two sharing a clock line, one on its own) with a single pass of 16
+#    clock cycles, and decodes each chip's frame, flagging the one with an open thermocouple. Its channels give the
+#    same temperatures through a SampledTempDetector, and the open one raises MAX6675Error.
+# Exits with 1 if any of them fail.
+# Run from the repository root: python benchmarks/max6675_check.py
+import contextlib
+import io
+import os
+import sys
+from multiprocessing import Lock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sim_bake  # sets the simulated hardware backend before anything imports hardware
+import clocks
+import constants
+import max6675
+import temp_detectors
+from hardware import GPIO, MAX6675, MAX6675Array, MAX6675Error, MAX6675SPI
+
+CS_PIN = 24
+
+def frame(celsius : float, noConnection : bool=False) -> int:
+    """The 16 bit frame a MAX6675 sends for a temperature: 12 bits of quarter degrees, then D2 for an open input."""
+    return (int(round(celsius * 4)) << 3) | (0x4 if noConnection else 0)
+
+class FakeSpiDev:
+    """Stands in for spidev.SpiDev: each transfer returns the next frame (or raises it if it is an exception)."""
+    def __init__(self, frames : list=None):
+        self.frames = list(frames or [])
+        self.max_speed_hz = 0
+        self.mode = None
+        self.no_cs = False
+        self.closed = False
+        self.selected = []  # whether the GPIO chip select was low during each transfer
+
+    def open(self, bus : int, device : int) -> None:
+        pass
+
+    def xfer2(self, data : list[int]) -> list[int]:
+        self.selected.append(GPIO.input(CS_PIN) == GPIO.LOW)
+        value = self.frames.pop(0)
+        if isinstance(value, Exception):
+            raise value
+        return [value >> 8, value & 0xFF]
+
+    def close(self) -> None:
+        self.closed = True
+
+class MissingBus(FakeSpiDev):
+    """A spidev.SpiDev whose device file doesn't exist, like on a pi without SPI enabled."""
+    def open(self, bus : int, device : int) -> None:
+        raise FileNotFoundError(2, "No such file or directory", "/dev/spidev{}.{}".format(bus, device))
+
+class FakeSpidevModule:
+    def __init__(self, spiDev : type):
+        self.SpiDev = spiDev
+
+class ClockedChips:
+    """
+    Stands in for the GPIO module with MAX6675s wired to it: while a chip is selected, every falling edge of its clock
+    pin puts the next bit of its frame (most significant first) on its data pin. Everything else is fake_gpio.
+    """
+    def __init__(self, csPins : list[int], clockPins : list[int], dataPins : list[int], frames : list[int]):
+        self.chips = list(zip(csPins, clockPins, dataPins))
+        self.frames = frames
+        self.bitsSent = [0] * len(frames)
+        self.fallingEdges = 0   # output calls that lowered any clock line
+
+    def __getattr__(self, name : str):
+        return getattr(GPIO, name)
+
+    def output(self, channel : int | list[int], value : int | list[int]) -> None:
+        channels = channel if isinstance(channel, (list, tuple)) else [channel]
+        values = value if isinstance(value, (list, tuple)) else [value] * len(channels)
+        GPIO.output(channel, value)
+        lowered = {pin for pin, level in zip(channels, values) if not level}
+        self.fallingEdges += any(clk in lowered for _, clk, _ in self.chips)
+        for c, (cs, clk, data) in enumerate(self.chips):
+            if cs in lowered:
+                self.bitsSent[c] = 0
+            elif clk in lowered and GPIO.input(cs) == GPIO.LOW and self.bitsSent[c] < 16:
+                GPIO.output(data, (self.frames[c] >> (15 - self.bitsSent[c])) & 1)
+                self.bitsSent[c] += 1
+
+def check(name : str, ok : bool) -> bool:
+    print("{}: {}".format(name, "ok" if ok else "FAILED"))
+    return ok
+
+def detector_for(module : FakeSpidevModule | None) -> MAX6675:
+    """Creates a detector with the "spidev" backend while spidev is the given module."""
+    constants.TEMP_DETECTOR_BACKEND = "spidev"
+    max6675.spidev = module
+    with contextlib.redirect_stdout(io.StringIO()):
+        return temp_detectors.create_temp_detector(CS_PIN, 23, 21)
+
+if __name__ == "__main__":
+    results = []
+
+    temps = [0, 22.25, 100, 487.5, 1023.75]
+    spi = FakeSpiDev([frame(t) for t in temps])
+    lock = Lock()
+    sensor = MAX6675SPI(0, 0, cs_pin=CS_PIN, board=GPIO.BOARD, lock=lock, spi=spi)
+    read = [sensor.get() for _ in temps]
+    results.append(check("SPI frames decoded ({})".format(", ".join(str(t) for t in read)),
+                         read == temps and all(spi.selected) and spi.no_cs and spi.mode == 0
+                         and GPIO.input(CS_PIN) == GPIO.HIGH))
+    spi.frames = [frame(30, noConnection=True)]
+    try:
+        sensor.get()
+        openRaised = False
+    except MAX6675Error:
+        openRaised = True
+    results.append(check("open thermocouple (D2) raises MAX6675Error", openRaised))
+
+    spi.frames = [OSError(5, "Input/output error"), frame(40)]
+    detector = temp_detectors.SampledTempDetector(sensor)
+    try:
+        detector.get()
+        failRaised = False
+    except MAX6675Error:
+        failRaised = True
+    released = lock.acquire(block=False)
+    if released:
+        lock.release()
+    results.append(check("failed transfer raises MAX6675Error, unselects the chip, and releases the bus lock",
+                         failRaised and GPIO.input(CS_PIN) == GPIO.HIGH and released))
+    clocks.sleep(detector.sampleInterval)
+    results.append(check("the next read after a failed one works", detector.get() == 40))
+    sensor.cleanup()
+    results.append(check("cleanup closes the device", spi.closed))
+
+    opened = detector_for(FakeSpidevModule(FakeSpiDev))
+    missing = detector_for(FakeSpidevModule(MissingBus))
+    notInstalled = detector_for(None)
+    results.append(check("spidev backend uses the bus when it opens, bit bangs when it doesn't or isn't installed",
+                         isinstance(opened, MAX6675SPI) and type(missing) is MAX6675
+                         and type(notInstalled) is MAX6675))
+
+    csPins, clockPins, dataPins = [31, 32, 33], [35, 35, 36], [37, 38, 40]
+    temps = [21.5, 250.25, 0]
+    frames = [frame(21.5), frame(250.25), frame(180, noConnection=True)]
+    bus = ClockedChips(csPins, clockPins, dataPins, frames)
+    max6675.GPIO = bus
+    try:
+        sensorArray = MAX6675Array(csPins, clockPins, dataPins, board=GPIO.BOARD)
+        read, noConnections = sensorArray.get()
+        detectors = [temp_detectors.SampledTempDetector(sensorArray.channel(i)) for i in range(len(csPins))]
+        channelTemps = []
+        for detector in detectors:
+            try:
+                channelTemps.append(detector.get())
+            except MAX6675Error:
+                channelTemps.append(None)
+    finally:
+        max6675.GPIO = GPIO
+    results.append(check("array of {} chips read in {} clock cycles ({}), open thermocouple flagged {}".format(
+                             len(csPins), bus.fallingEdges, ", ".join(str(t) for t in read), noConnections),
+                         bus.fallingEdges == 16 and read[:2] == temps[:2] and noConnections == [False, False, True]
+                         and all(GPIO.input(cs) == GPIO.HIGH for cs in csPins)))
+    results.append(check("array channels give the same temperatures, the open one raises MAX6675Error",
+                         channelTemps == temps[:2] + [None]))
+
+    sys.exit(0 if all(results) else 1)
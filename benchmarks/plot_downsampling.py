@@ -0,0 +1,59 @@
+# Measures how long drawing the temperature line takes as the plotted window grows, with and without downsampling
+# it to the plot's width, and checks that the downsampled line keeps its highest and lowest points
+# Run from the repository root: python benchmarks/plot_downsampling.py
+import os
+import sys
+import time
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import downsample
+
+def make_trace(numSamples : int, rng : np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """A ramp with an overshoot, noise, 0.25 degree steps, a bad reading spike, and a gap of missed readings."""
+    times = np.arange(numSamples) * 1.4
+    temps = 25 + 100 * (1 - np.exp(-times / (numSamples * 0.3))) + 8 * np.exp(-((times - numSamples * 0.5) / 300) ** 2)
+    temps = np.round((temps + rng.normal(0, 0.2, numSamples)) * 4) / 4
+    temps[numSamples // 3] += 60
+    temps[numSamples // 5 : numSamples // 5 + 10] = np.nan
+    return times / 60, temps
+
+def draw_time(canvas : FigureCanvasAgg, ax, line, x : np.ndarray, y : np.ndarray, repeats : int=20) -> float:
+    line.set_data(x, y)
+    ax.set_xlim(x[0], x[-1])
+    ax.set_ylim(np.nanmin(y) - 1, np.nanmax(y) + 1)
+    canvas.draw()
+    background = canvas.copy_from_bbox(ax.bbox)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        canvas.restore_region(background)
+        ax.draw_artist(line)
+    return (time.perf_counter() - start) / repeats
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    fig = Figure(figsize=(5, 4), dpi=100)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    line, = ax.plot([], [], animated=True)
+    canvas.draw()
+    numBuckets = int(ax.bbox.width) // 2
+    print("plot width {} px".format(int(ax.bbox.width)))
+    print("{:>8} {:>12} {:>16} {:>16} {:>14}".format("points", "full (ms)", "min/max (ms)", "reduce (ms)", "lttb (ms)"))
+    for numSamples in (100, 500, 1500, 5000, 20000, 100000):
+        x, y = make_trace(numSamples, rng)
+        full = draw_time(canvas, ax, line, x, y)
+        start = time.perf_counter()
+        dx, dy = downsample.min_max(x, y, numBuckets)
+        reduce = time.perf_counter() - start
+        reduced = draw_time(canvas, ax, line, dx, dy)
+        start = time.perf_counter()
+        downsample.lttb(x, y, 2 * numBuckets)
+        lttbTime = time.perf_counter() - start
+        assert np.nanmax(dy) == np.nanmax(y) and np.nanmin(dy) == np.nanmin(y)
+        print("{:>8} {:>12.2f} {:>16.2f} {:>16.2f} {:>14.2f}".format(numSamples, full * 1000, reduced * 1000,
+                                                                     reduce * 1000, lttbTime * 1000))
@@ -0,0 +1,65 @@
+# Compares the streaming SlopeEstimator with the old way of getting the current rate
+# (re-slicing the window every update and using funcs.average_rate_of_change on its first and last points)
+# Run from the repository root: python benchmarks/rate_of_change.py
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import constants
+import funcs
+from rate_estimator import SlopeEstimator
+from ring_buffer import RingBuffer
+
+def make_trace(numSamples : int, rate : float, rng : np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """A ramp at rate degrees per minute sampled every 1.4 s, with noise and the MAX6675's 0.25 degree resolution."""
+    times = np.arange(numSamples) * 1.4
+    temps = 25 + rate * times / 60 + rng.normal(0, 0.15, numSamples)
+    return times, np.round(temps * 4) / 4
+
+def time_old(times : np.ndarray, temps : np.ndarray, windowSize : int) -> tuple[float, np.ndarray]:
+    storedTimes = RingBuffer(constants.MAX_POINTS_IN_MEMORY)
+    storedTemps = RingBuffer(constants.MAX_POINTS_IN_MEMORY)
+    rates = np.empty(len(times))
+    start = time.perf_counter()
+    for i in range(len(times)):
+        storedTimes.append(times[i])
+        storedTemps.append(temps[i])
+        rates[i] = funcs.average_rate_of_change(list(storedTimes.window(windowSize)), 
+                                                list(storedTemps.window(windowSize)))
+    return (time.perf_counter() - start) / len(times), rates
+
+def time_new(times : np.ndarray, temps : np.ndarray, windowSize : int, decay : float=None) -> tuple[float, np.ndarray]:
+    estimator = SlopeEstimator(windowSize=windowSize, decay=decay)
+    rates = np.empty(len(times))
+    start = time.perf_counter()
+    for i in range(len(times)):
+        estimator.update(times[i], temps[i])
+        rates[i] = estimator.slope()[0]
+    return (time.perf_counter() - start) / len(times), rates
+
+def time_vectorized(times : np.ndarray, numChannels : int, windowSize : int) -> float:
+    estimator = SlopeEstimator(numChannels, windowSize)
+    temps = np.full(numChannels, 30.0)
+    start = time.perf_counter()
+    for t in times:
+        estimator.update(t, temps)
+        estimator.slope()
+    return (time.perf_counter() - start) / len(times)
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    rate = 1.0  # degrees per minute
+    times, temps = make_trace(20000, rate, rng)
+    print("{:>8} {:>22} {:>12} {:>16}".format("window", "method", "us/update", "rate error (C/m)"))
+    for windowSize in (20, 200, 1400):
+        results = [("first/last (old)",) + time_old(times, temps, windowSize),
+                   ("least squares",) + time_new(times, temps, windowSize),
+                   ("exp. weighted",) + time_new(times, temps, windowSize, decay=1 - 2 / (windowSize + 1))]
+        for name, perUpdate, rates in results:
+            error = np.std(rates[windowSize:] * 60 - rate)
+            print("{:>8} {:>22} {:>12.1f} {:>16.3f}".format(windowSize, name, perUpdate * 1e6, error))
+    for numChannels in (4, 16):
+        print("{} channels in one estimator: {:.1f} us/update".format(
+            numChannels, time_vectorized(times[:5000], numChannels, 20) * 1e6))
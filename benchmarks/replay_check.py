@@ -0,0 +1,92 @@
+# Checks that replay.py reproduces the control loop exactly, diffs controller versions, and times it
+# 1. a simulated bake (benchmarks/sim_bake.py on a VirtualClock, with the channels' workers) is replayed as a trace,
+#    and every duty cycle, step temperature, and status has to be identical to what the loop logged
+# 2. the plant is fit to that bake, and the time constants have to be within 10% of the simulated tapes' and the gains
+#    within 15% (a single bake holds the duty cycle near one level once it is at the set temperature, which doesn't
+#    tell the gain and the ambient temperature apart as well as the switching autotune_check.py uses)
+# 3. bakes are replayed through the fitted plant with an unchanged copy of bake_system.py, which has to be identical to
+#    this tree's, and with a copy that doesn't zero the integral above the set temperature, which has to differ
+# 4. the plant replays have to run at least --min-speedup times faster than real time
+# Exits with 1 if any of them fail.
+# Run from the repository root: python benchmarks/replay_check.py [--hours 4] [--plant-hours 24] [--min-speedup 1000]
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sim_bake  # sets the simulated hardware backend before anything imports hardware
+import analysis
+import constants
+import instrumentation
+import replay
+
+# the integral reset that the changed copy leaves out
+INTEGRAL_RESET = """                    if currentTemp >= self.desiredTemp:"""
+
+def controller_copy(folder : str, change : bool) -> str:
+    """Writes a copy of bake_system.py, with the integral reset above the set temperature removed if change."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bake_system.py")) as file:
+        source = file.read()
+    if change:
+        if INTEGRAL_RESET not in source:
+            sys.exit("bake_system.py doesn't have the integral reset this check changes")
+        source = source.replace(INTEGRAL_RESET, "                    if False:")
+    fileName = os.path.join(folder, "bake_system_{}.py".format("changed" if change else "copy"))
+    with open(fileName, "w") as file:
+        file.write(source)
+    return fileName
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=4, help="how long the simulated bake to replay is")
+    parser.add_argument("--plant-hours", type=float, default=24, help="how long the bakes replayed on the plant are")
+    parser.add_argument("--min-speedup", type=float, default=1000)
+    args = parser.parse_args()
+    instrumentation.configure(constants.VERBOSITY.OFF)
+    constants.SIM_SEED = 0
+
+    channels = sim_bake.sim_channels()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        systems, rows = sim_bake.run(args.hours * 60 * 60, True, channels)
+    names = [system.name for system in systems]
+    run = analysis.RunData(np.array([row[0] for row in rows]), np.array([row[1] for row in rows]),
+                           np.array([row[2] for row in rows]), np.array([row[3] for row in rows]),
+                           np.array([row[4] for row in rows]))
+    setValues = replay.set_values_for(channels, [], [], [])
+
+    trace = replay.replay_trace(run, setValues, replay.load_controller())
+    traceSame = (np.array_equal(trace.dutyCycles, run.dutyCycles) and np.array_equal(trace.stepTemps, run.stepTemps)
+                 and np.array_equal(trace.statuses, run.statuses))
+    print("trace of a {:.0f} h simulated bake: {} iterations in {:.2f} s ({:.0f} times real time), identical to the "
+          "loop: {}".format(args.hours, len(trace.times), trace.wallTime, trace.speedup, traceSame))
+
+    fit = replay.calibrate(run)
+    tauError = np.abs(fit.tau / constants.SIM_TIME_CONSTANT - 1)
+    gainError = np.abs(fit.gain / constants.SIM_HEATER_GAIN - 1)
+    fitOk = np.max(tauError) < 0.1 and np.max(gainError) < 0.15
+    print("plant fit to it: time constant error at most {:.1%}, gain error at most {:.1%}".format(
+        np.max(tauError), np.max(gainError)))
+
+    startTemps = run.temps[0]
+    seconds = args.plant_hours * 60 * 60
+    with tempfile.TemporaryDirectory() as folder:
+        current = replay.replay_plant(fit, startTemps, seconds, setValues, replay.load_controller(), "this tree")
+        copy = replay.replay_plant(fit, startTemps, seconds, setValues,
+                                   replay.load_controller(controller_copy(folder, False)), "copy")
+        changed = replay.replay_plant(fit, startTemps, seconds, setValues,
+                                      replay.load_controller(controller_copy(folder, True)), "no integral reset")
+    for result in (current, copy, changed):
+        replay.print_summary(result, names)
+    copyDifferences = replay.diff_replays(current, copy)
+    changedDifferences = replay.diff_replays(current, changed)
+    replay.print_diff(changedDifferences, names, current.label, changed.label)
+    copySame = all(d["firstDifference"] is None and len(d["onlyA"]) + len(d["onlyB"]) == 0 for d in copyDifferences)
+    changedDiffers = any(d["firstDifference"] is not None for d in changedDifferences)
+    print("unchanged copy identical: {}, changed copy differs: {}".format(copySame, changedDiffers))
+    speedup = min(result.speedup for result in (current, copy, changed))
+    print("slowest plant replay: {:.0f} times real time".format(speedup))
+
+    sys.exit(0 if traceSame and fitOk and copySame and changedDiffers and speedup >= args.min_speedup else 1)
@@ -0,0 +1,128 @@
+# Checks that SampledTempDetector reads its detector on schedule and keeps each frame with the time it was read
+# 1. consumers ask for the temperature every 50 ms of a VirtualClock for a minute, and the detector has to be read
+#    once per sample interval: never sooner after the last read (nor sooner than a conversion when a shorter interval
+#    is asked for), and no later than the first request after the read is due
+# 2. once the cached frame is older than MAX_SAMPLE_AGE it is stale, and the next get reads a new frame
+# 3. a stale sample that can't be read again yet (another consumer's read of it hasn't finished) is rejected by the
+#    control loop: System.run and the vectorized engine's BatchWorker both mark the system unreliable and store NaN
+#    instead of running the PID on it
+# 4. a process reading the detector as fast as it can (each frame holds the time it was read) while another takes
+#    snapshots of the cache: every snapshot's frame has to match its time
+# Exits with 1 if any of them fail.
+# Run from the repository root: python benchmarks/sensor_sampling_check.py [--seconds 3]
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from multiprocessing import Process, RawValue
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sim_bake  # sets the simulated hardware backend before anything imports hardware
+import clocks
+import constants
+from bake_system import System, SystemUnreliableError
+from control_engine import BatchWorker
+from hardware import MAX6675
+from temp_detectors import SampledTempDetector
+
+class ClockDetector(MAX6675):
+    """A MAX6675 whose frames are the time they were read (in whole degrees, wrapped below the 1024 degree limit)."""
+    def __init__(self):
+        self.units = "c"
+        self.data = None
+        self.readTimes = []
+
+    def read(self) -> None:
+        self.readTimes.append(clocks.now())
+        self.data = (int(clocks.now()) % 1000) << 5    # whole degrees are 4 quarter degree steps above bit D3
+
+def polled_reads(sampleInterval : float | None, seconds : float=60, pollPeriod : float=0.05) -> tuple[list, float]:
+    """Polls a detector's get every pollPeriod on a VirtualClock, returns the times it was read and its interval."""
+    clocks.set_clock(clocks.VirtualClock())
+    detector = SampledTempDetector(ClockDetector(), sampleInterval=sampleInterval)
+    for _ in range(int(seconds / pollPeriod)):
+        detector.get()
+        clocks.sleep(pollPeriod)
+    return detector.tempDetector.readTimes, detector.sampleInterval
+
+def stale_detector() -> SampledTempDetector:
+    """A detector read once, then left with its next read claimed by a consumer that is still reading it."""
+    detector = SampledTempDetector(ClockDetector())
+    detector.get()
+    detector.sample[2] = clocks.now() + 60
+    clocks.sleep(constants.MAX_SAMPLE_AGE + 1)
+    return detector
+
+def read_fast(detector : SampledTempDetector, stop) -> None:
+    """Reads the detector once a virtual second until stop is set, so every frame is the time it was read."""
+    clocks.set_clock(clocks.VirtualClock())
+    while not stop.value:
+        clocks.sleep(1)
+        detector.read()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=3, help="how long to take snapshots while it is read")
+    args = parser.parse_args()
+    results = []
+    pollPeriod = 0.05
+
+    for sampleInterval in (None, 0.5, 0.1):
+        readTimes, interval = polled_reads(sampleInterval, pollPeriod=pollPeriod)
+        gaps = np.diff(readTimes)
+        ok = (interval >= constants.MAX6675_CONVERSION_TIME and np.min(gaps) >= interval - 1e-9
+              and np.max(gaps) < interval + pollPeriod + 1e-9)
+        print("sample interval {} s (asked for {}): {} reads in a minute, {:.3f} to {:.3f} s apart: {}".format(
+            interval, sampleInterval, len(readTimes), np.min(gaps), np.max(gaps), "ok" if ok else "FAILED"))
+        results.append(ok)
+
+    clocks.set_clock(clocks.VirtualClock())
+    detector = SampledTempDetector(ClockDetector())
+    clocks.sleep(10)
+    before = detector.get()
+    clocks.sleep(constants.MAX_SAMPLE_AGE + 1)
+    stale, cached = detector.is_stale(), detector.last()
+    after = detector.get()
+    ok = stale and cached == before and after == before + constants.MAX_SAMPLE_AGE + 1 and not detector.is_stale()
+    print("stale after {} s: {}, next get reads a new frame ({} -> {}): {}".format(
+        constants.MAX_SAMPLE_AGE, stale, before, after, "ok" if ok else "FAILED"))
+    results.append(ok)
+
+    clocks.set_clock(clocks.VirtualClock(100))
+    system = System(0, 0, startSetTemp=150, startSetRate=1, startSetKi=5)
+    _, errors = system.run(0, clocks.now(), stale_detector(), constants.SET_PERIOD)
+    runRejected = (len(errors) == 1 and isinstance(errors[0], SystemUnreliableError)
+                   and np.isnan(system.storedTemps.latest()) and system.computedDutyCycle == 0)
+    batchSystem = System(1, 0, startSetTemp=150, startSetRate=1, startSetKi=5)
+    worker = BatchWorker([batchSystem], [stale_detector()])
+    worker.send(0, clocks.now(), constants.SET_PERIOD)
+    [(_, _, batchErrors)] = worker.receive()
+    batchRejected = (len(batchErrors) == 1 and isinstance(batchErrors[0], SystemUnreliableError)
+                     and np.isnan(batchSystem.storedTemps.latest()))
+    for s in (system, batchSystem):
+        s.storedTemps.close()
+    ok = runRejected and batchRejected
+    print("stale sample rejected as unreliable by System.run: {}, by the BatchWorker: {} ({}): {}".format(
+        runRejected, batchRejected, errors[0].cause if errors else None, "ok" if ok else "FAILED"))
+    results.append(ok)
+
+    detector = SampledTempDetector(ClockDetector(), conversionTime=0)
+    stop = RawValue('b', False)
+    reader = Process(target=read_fast, args=(detector, stop))
+    reader.start()
+    numSnapshots = numTorn = 0
+    end = time.perf_counter() + args.seconds
+    while time.perf_counter() < end:
+        frame, readTime = detector.snapshot()
+        if not np.isnan(frame):
+            numSnapshots += 1
+            numTorn += detector.tempDetector.data_to_tc_temperature(int(frame)) != readTime % 1000
+    stop.value = True
+    reader.join()
+    ok = numSnapshots > 0 and numTorn == 0
+    print("{} snapshots while another process read it, {} with a frame from a different read: {}".format(
+        numSnapshots, numTorn, "ok" if ok else "FAILED"))
+    results.append(ok)
+
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,128 @@
+# Runs the real control loop (bake_controller.iterate on a ControlScheduler, the channel workers, and the relay scheduler) against
+# the simulated hardware without a display. With --virtual the run uses a VirtualClock, so hours of bake take seconds.
+# Run from the repository root: python benchmarks/sim_bake.py [seconds] [--virtual] [--seed N] [--quiet]
+#                                                              [--events file] [--engine workers|vectorized]
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import constants
+constants.HARDWARE_BACKEND = "sim"  # has to be set before anything imports hardware
+
+import bake_controller
+import clocks
+import instrumentation
+from bake_system import System
+from channels import Channel, channel_groups, load_channels
+from control_scheduler import ControlScheduler
+from relay_scheduler import RelayScheduler
+from ring_buffer import SharedRingBuffer
+from temp_detectors import create_temp_detectors
+
+class DecisionLogger:
+    """Keeps the logged rows in memory instead of writing them, so runs can be compared."""
+    def __init__(self):
+        self.rows = []
+
+    def start(self) -> None:
+        pass
+
+    def log(self, row : tuple) -> None:
+        self.rows.append(row)
+
+    def close(self) -> None:
+        pass
+
+def sim_channels(numChannels : int=None, groupSize : int=None) -> list[Channel]:
+    """
+    The channels of constants.CHANNELS_FILE, cut down or followed by made up (fake_gpio) ones to make numChannels (all
+    of the file's if None). If groupSize is given, every groupSize channels in a row are put in a group instead.
+    """
+    channels = load_channels(constants.CHANNELS_FILE)
+    numChannels = len(channels) if numChannels is None else numChannels
+    channels = channels[:numChannels] + [Channel(None, 100 + 2 * i, 101 + 2 * i, 98, 99)
+                                         for i in range(len(channels), numChannels)]
+    if groupSize is not None:
+        for i, channel in enumerate(channels):
+            channel.group = "group {}".format(i // groupSize + 1)
+    return channels
+
+def run(seconds : float, virtual : bool=False, channels : list[Channel]=None,
+        scheduler : list[ControlScheduler]=None) -> tuple[list[System], list[tuple]]:
+    """
+    Runs a simulated bake for the given number of seconds (simulated time if virtual) and returns the systems and the
+    rows that would have been logged (time, temperatures, duty cycles, step temperatures, statuses).
+    channels: the channels to run, the ones in constants.CHANNELS_FILE if None
+    If scheduler is given, the ControlScheduler that ran the loop is added to it (for its jitter_stats).
+    """
+    channels = sim_channels() if channels is None else channels
+    clocks.set_clock(clocks.VirtualClock() if virtual else clocks.RealClock())
+    clock = clocks.get_clock()
+    start_time = clock.now()
+    storedTimes = SharedRingBuffer(constants.MAX_POINTS_IN_MEMORY)
+    systemList = [System(i, channel.relay, **channel.system_arguments()) for i, channel in enumerate(channels)]
+    tempDetectorList, sensorArray = create_temp_detectors([], [], [], [channel.relay for channel in channels])
+    workerList = bake_controller.create_workers(systemList, tempDetectorList, channel_groups(channels))
+    relayScheduler = RelayScheduler()
+    dataLogger = DecisionLogger()
+    # bake_controller.iterate is looked up each iteration so benchmarks can wrap it
+    controlScheduler = ControlScheduler(lambda iterationNum: bake_controller.iterate(iterationNum, systemList, workerList,
+                                                                          sensorArray, relayScheduler, start_time,
+                                                                          storedTimes, dataLogger),
+                                        start_time + constants.TOTAL_STARTUP_TIME)
+    if scheduler is not None:
+        scheduler.append(controlScheduler)
+    try:
+        for worker in workerList:
+            worker.start()
+        relayScheduler.start()
+        controlScheduler.start()
+        if virtual:
+            clock.run_until(start_time + seconds)
+        else:
+            clock.sleep(start_time + seconds - clock.now())
+        controlScheduler.raise_error()
+    finally:
+        controlScheduler.stop()
+        relayScheduler.stop()
+        for worker in workerList:
+            worker.stop()
+        storedTimes.close()
+        for system in systemList:
+            system.storedTemps.close()
+    return systemList, dataLogger.rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("seconds", type=float, nargs="?", default=30)
+    parser.add_argument("--virtual", action="store_true", help="run on a VirtualClock")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the simulated reading noise")
+    parser.add_argument("--quiet", action="store_true", help="hide what the control loop prints")
+    parser.add_argument("--events", help="write the instrumentation's events to this json lines file")
+    parser.add_argument("--engine", choices=["workers", "vectorized"], default=constants.CONTROL_ENGINE,
+                        help="how the systems are run (constants.CONTROL_ENGINE)")
+    args = parser.parse_args()
+    constants.SIM_SEED = args.seed
+    constants.CONTROL_ENGINE = args.engine
+    instrumentation.configure(constants.INSTRUMENTATION_LEVEL, args.events)
+
+    wallStart = time.perf_counter()
+    scheduler = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull if args.quiet else sys.stdout):
+        systems, rows = run(args.seconds, args.virtual, scheduler=scheduler)
+    print("{:.0f} s {} in {:.1f} s, {} iterations".format(args.seconds, "simulated" if args.virtual else "run",
+                                                       time.perf_counter() - wallStart, len(rows)))
+    for system in systems:
+        print("{}: {:.2f} C, duty cycle {:.2f}, stepping to {}".format(
+            system.name, system.tempForDutyCycle, system.computedDutyCycle, system.stepToTemp))
+    for name, stats in instrumentation.span_stats().items():
+        print("{:>14}: p50 {:.3f} ms, p95 {:.3f} ms, max {:.3f} ms".format(name, stats["p50_ms"], stats["p95_ms"],
+                                                                           stats["max_ms"]))
+    jitter = scheduler[0].jitter_stats()
+    print("Iteration start delay: mean {:.3f} ms, p95 {:.3f} ms, max {:.3f} ms, {} missed deadlines".format(
+        jitter["mean"] * 1000, jitter["p95"] * 1000, jitter["max"] * 1000, jitter["missed"]))
+    print("Counters: {}".format(instrumentation.counters()))
+    instrumentation.close()
@@ -0,0 +1,89 @@
+# Checks that the measured rate holds back the next step while a tape's temperature changes faster than
+# STEP_HOLD_RATE_FACTOR times its set rate, on the way up and on the way down
+# Each case starts with the step's time up and a temperature (in 0.25 degree readings, every second) that reaches
+# the step after about 30 s (once the rate's window is full) while changing at 3 times the set rate, then levels off
+# after 45 s. The step has to wait until the temperature has levelled off, and with the hold turned off (an infinite
+# STEP_HOLD_RATE_FACTOR) it has to be taken as soon as the step is reached. A ramp changing at half the set rate has
+# to step as soon as it reaches the step either way.
+# Every case is run through System.run and ControlEngine.step, which have to step at the same time.
+# Exits with 1 if any of them fail.
+# Run from the repository root: python benchmarks/step_hold_check.py
+import math
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sim_bake  # sets the simulated hardware backend before anything imports hardware
+import constants
+from bake_system import System
+from control_engine import ControlEngine
+
+SET_RATE = 1.0  # degrees per minute
+START_STEP = 100
+
+class ScriptedDetector:
+    """A temperature detector that returns whatever it is set to."""
+    def __init__(self):
+        self.temp = math.nan
+
+    def get(self) -> float:
+        return self.temp
+
+def readings(up : bool, rate : float, seconds : int=120, rampSeconds : int=45) -> list[float]:
+    """
+    The readings of a temperature that reaches the step after about 30 s, changing at rate (degrees per minute) for
+    rampSeconds, and then stays where it got to.
+    """
+    direction = 1 if up else -1
+    temps = [START_STEP + direction * rate / 60 * (min(t, rampSeconds) - 30) for t in range(seconds)]
+    return [round(temp * 4) / 4 for temp in temps]
+
+def first_step(up : bool, temps : list[float], holdFactor : float) -> tuple[float | None, float | None]:
+    """Returns when System.run and ControlEngine.step first moved the step, None if they didn't."""
+    constants.STEP_HOLD_RATE_FACTOR = holdFactor
+    system = System(0, 0, startSetTemp=150 if up else 50, startSetRate=SET_RATE, startSetKi=5)
+    system.steppingUp = up
+    system.numStepsTaken = 1
+    system.stepToTemp = START_STEP
+    system.timeSinceLastStep = 10 * 60 / SET_RATE  # the step's time is long up
+    engine = ControlEngine(1)
+    engine.load_state(0, system.get_control_state())
+    detector = ScriptedDetector()
+    stepTimes = [None, None]
+    try:
+        for t, temp in enumerate(temps):
+            timeElapsed = constants.TOTAL_STARTUP_TIME + 1.0 + t
+            detector.temp = temp
+            system.run(t, timeElapsed, detector, 1.0)
+            engine.step(timeElapsed, 1.0, np.array([temp]))
+            for i, stepToTemp in enumerate((system.stepToTemp, engine.stepToTemp[0])):
+                if stepTimes[i] is None and stepToTemp != START_STEP:
+                    stepTimes[i] = float(t)
+    finally:
+        system.storedTemps.close()
+    return tuple(stepTimes)
+
+def check(name : str, up : bool, rate : float, expectHeld : bool) -> bool:
+    temps = readings(up, rate)
+    reached = next(t for t, temp in enumerate(temps) if (temp >= START_STEP if up else temp <= START_STEP))
+    levelled = 45   # the readings' rampSeconds
+    held = first_step(up, temps, 2)
+    unheld = first_step(up, temps, math.inf)
+    same = held[0] == held[1] and unheld[0] == unheld[1]
+    if expectHeld:
+        ok = same and held[0] is not None and held[0] > levelled and unheld[0] == reached
+    else:
+        ok = same and held[0] == unheld[0] == reached
+    print("{}: reaches the step at {} s, steps at {} s (System.run) and {} s (engine), {} s without the hold: {}"
+          .format(name, reached, held[0], held[1], unheld[0], "ok" if ok else "FAILED"))
+    return ok
+
+if __name__ == "__main__":
+    factor = constants.STEP_HOLD_RATE_FACTOR
+    results = [check("heating at 3x the set rate", True, 3 * SET_RATE, True),
+               check("cooling at 3x the set rate", False, 3 * SET_RATE, True),
+               check("heating at 0.5x the set rate", True, 0.5 * SET_RATE, False),
+               check("cooling at 0.5x the set rate", False, 0.5 * SET_RATE, False)]
+    constants.STEP_HOLD_RATE_FACTOR = factor
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,101 @@
+# Checks that sweep.py resumes where it was stopped and that the constants it sweeps reach the workers, and times it
+# 1. a random sweep of --configs configurations is run into one results file, and into another that is stopped part
+#    way (its file cut back to a few configurations and half a row), then resumed. The resumed file has to have exactly
+#    the same rows as the uninterrupted one, and only the missing configurations may be run again.
+# 2. the same bake with two KI_SCALING_FACTORs has to give different metrics, the constants are set in the workers
+# 3. bake_metrics of a few hand made tapes: settling is the time of the first sample of the last stretch inside the
+#    band (NaN if it ends outside it), and timeToSetpoint the first sample inside it
+# 4. prints the configurations per minute per core, and how long 1000 configurations would take on this computer's
+#    cores. Exits with 1 if 1, 2 or 3 fail, or if a core runs fewer than --min-rate configurations per minute.
+# Run from the repository root: python benchmarks/sweep_check.py [--configs 12] [--workers N] [--min-rate 20]
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sim_bake  # sets the simulated hardware backend before anything imports hardware
+import autotune
+import constants
+import replay
+import sweep
+
+def rows_by_key(rows : list[dict]) -> dict:
+    return {(sweep.key(row), row["tape"]): tuple(row[metric] for metric in sweep.METRICS) for row in rows}
+
+def same_metrics(a : tuple, b : tuple) -> bool:
+    return all(x == y or (np.isnan(x) and np.isnan(y)) for x, y in zip(a, b))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--configs", type=int, default=12)
+    parser.add_argument("--workers", type=int, help="processes to run, one per core if not given")
+    parser.add_argument("--min-rate", type=float, default=20, help="configurations per minute per core")
+    args = parser.parse_args()
+
+    # the simulated tape with a dead time, so the constants have something to work against
+    fit = autotune.FopdtFit(np.array([float(constants.SIM_TIME_CONSTANT)]),
+                            np.array([float(constants.SIM_HEATER_GAIN)]), np.array([float(constants.SIM_AMBIENT_TEMP)]),
+                            np.array([20.0]), np.array([1.0]), np.array([0]))
+    startTemps = fit.ambient.copy()
+    names = ["Simulated tape"]
+    values = {"ki": [1, 20], "desiredRate": [0.5, 2], "KP": [0, 0.05], "KD": [0, 0.5],
+              "KI_SCALING_FACTOR": [0.005, 0.02], "LARGE_TEMP_DIFFERENCE": [2, 6]}
+    configurations = sweep.random_configurations(values, args.configs, seed=1)
+    numWorkers = args.workers or os.cpu_count()
+
+    with tempfile.TemporaryDirectory() as folder:
+        fullName = os.path.join(folder, "full.csv")
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            full = sweep.run_sweep(configurations, fit, startTemps, names, 150, fullName, numWorkers)
+        elapsed = time.perf_counter() - start
+
+        # a sweep stopped after a few configurations, part way through writing a row
+        resumedName = os.path.join(folder, "resumed.csv")
+        with open(fullName) as file:
+            lines = file.readlines()
+        numKept = len(configurations) // 3
+        with open(resumedName, "w") as file:
+            file.writelines(lines[:1 + numKept])
+            file.write(lines[1 + numKept][:len(lines[1 + numKept]) // 2])
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            resumed = sweep.run_sweep(configurations, fit, startTemps, names, 150, resumedName, numWorkers)
+    fullRows, resumedRows = rows_by_key(full), rows_by_key(resumed)
+    resumeOk = (len(resumed) == len(full) == len(configurations) and fullRows.keys() == resumedRows.keys()
+                and all(same_metrics(fullRows[k], resumedRows[k]) for k in fullRows)
+                and "running {} on".format(len(configurations) - numKept) in output.getvalue())
+    print("{} configurations, resumed after {}: same rows as without stopping: {}".format(
+        len(configurations), numKept, resumeOk))
+
+    base = {"ki": 6.0, "desiredRate": 1.0, "KP": 0.0, "KD": 0.0, "KI_SCALING_FACTOR": 0.01,
+            "LARGE_TEMP_DIFFERENCE": 3.0}
+    with tempfile.TemporaryDirectory() as folder, contextlib.redirect_stdout(io.StringIO()):
+        scaled = sweep.run_sweep([base, {**base, "KI_SCALING_FACTOR": 0.002}], fit, startTemps, names, 150,
+                                 os.path.join(folder, "scaled.csv"), numWorkers)
+    constantsOk = len(scaled) == 2 and not same_metrics(*(tuple(row[m] for m in sweep.METRICS) for row in scaled))
+    print("a different KI_SCALING_FACTOR changes the bake: {}".format(constantsOk))
+
+    # tapes read once a period (elapsed 1, 2, ... s): one settling after dipping out of the band, one always inside
+    # it, one ending outside it
+    temps = np.array([[140, 150, 150], [149.5, 150, 150], [152, 150, 150], [150.5, 150, 150], [150, 150, 160]])
+    numSamples = len(temps)
+    period = constants.SET_PERIOD
+    result = replay.ReplayResult(np.arange(numSamples) * period, temps, np.zeros(temps.shape), temps,
+                                 np.zeros(temps.shape, dtype=np.uint8), [], "hand made", 1.0)
+    metrics = sweep.bake_metrics(result, np.full(3, 140.0), 150, 1.0, settleBand=1)
+    metricsOk = (np.array_equal(metrics["settling"], [4 * period, period, np.nan], equal_nan=True)
+                 and np.array_equal(metrics["timeToSetpoint"], [2 * period, period, period]))
+    print("bake metrics of hand made tapes, settling {} and time to setpoint {}: {}".format(
+        metrics["settling"], metrics["timeToSetpoint"], metricsOk))
+
+    numCores = min(numWorkers, len(configurations), os.cpu_count())
+    perCore = len(configurations) / elapsed * 60 / numCores
+    print("{:.1f} configurations per minute per core, 1000 would take {:.1f} min on {} cores".format(
+        perCore, 1000 / (perCore * min(numWorkers, os.cpu_count())), min(numWorkers, os.cpu_count())))
+    sys.exit(0 if resumeOk and constantsOk and metricsOk and perCore >= args.min_rate else 1)
@@ -0,0 +1,41 @@
+# Checks that the control loop makes the same decisions on a VirtualClock as in real time
+# Runs the simulated bake twice on a VirtualClock (the rows must be identical) and then, without reading noise, once
+# in real time and once virtually, comparing the step temperatures, duty cycles, and statuses iteration by iteration.
+# Real iterations run a few ms long, so over a long enough run a step can land an iteration earlier in real time.
+# Run from the repository root: python benchmarks/virtual_clock_check.py [virtual seconds] [real seconds]
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sim_bake
+import constants
+
+def quiet_run(seconds : float, virtual : bool, noise : float=constants.SIM_NOISE) -> tuple[list[tuple], float]:
+    constants.SIM_SEED = 0
+    constants.SIM_NOISE = noise
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        _, rows = sim_bake.run(seconds, virtual)
+    return rows, time.perf_counter() - start
+
+def decisions(rows : list[tuple]) -> list[tuple]:
+    """The duty cycles, step temperatures, and statuses of each iteration (everything but the time and readings)."""
+    return [row[2:] for row in rows]
+
+if __name__ == "__main__":
+    virtualSeconds = float(sys.argv[1]) if len(sys.argv) > 1 else 8 * 60 * 60
+    realSeconds = float(sys.argv[2]) if len(sys.argv) > 2 else 120
+
+    first, wallTime = quiet_run(virtualSeconds, True)
+    second, _ = quiet_run(virtualSeconds, True)
+    print("{:.0f} s simulated in {:.1f} s ({:.0f}x real time), {} iterations".format(
+        virtualSeconds, wallTime, virtualSeconds / wallTime, len(first)))
+    print("virtual runs identical: {}".format(first == second))
+
+    real, _ = quiet_run(realSeconds, False, noise=0)
+    virtual, _ = quiet_run(realSeconds, True, noise=0)
+    n = min(len(real), len(virtual))
+    same = sum(a == b for a, b in zip(decisions(real[:n]), decisions(virtual[:n])))
+    print("real time vs virtual over {:.0f} s: {} of {} iterations made identical decisions".format(realSeconds, same, n))
@@ -0,0 +1,83 @@
+from multiprocessing import Process, Queue
+
+import constants
+import instrumentation
+from bake_system import System
+from hardware import MAX6675
+
+# A long lived process that runs its systems once per iteration
+# Instead of forking a new process (and pickling the whole system, history included) every iteration,
+# the worker is started once and afterwards only small commands and state deltas cross the process boundary
+class ChannelWorker:
+    """
+    A long lived process that owns one or more systems and their temperature detectors. Every iteration it is sent
+    a small command (the iteration number, times, and the control state of each system) and it sends back only the
+    updated control state of each system, so the per iteration cost does not depend on how much history is stored.
+    The temperatures themselves are written straight into each system's shared memory storedTemps.
+    """
+    def __init__(self, systems : list[System], tempDetectors : list[MAX6675]):
+        """
+        systems: the systems this worker runs, in the order they should be run
+        tempDetectors: the temperature detector for each system, in the same order as systems
+        """
+        self.systems = systems
+        self.commandQueue = Queue()
+        self.resultQueue = Queue()
+        self.process = Process(target=run_channel_worker, args=(systems, tempDetectors, self.commandQueue,
+                                                               self.resultQueue), daemon=True)
+
+    def start(self) -> None:
+        self.process.start()
+
+    def send(self, iterationNum : int, timeElapsed : float, lastIterationTime : float) -> None:
+        """
+        Sends the command for one iteration to the worker. The control state of each system is sent along with it so
+        that any set values changed by the user (or by the main process, e.g. marking a system inoperable) are used.
+        """
+        states = {system.id: system.get_control_state() for system in self.systems}
+        self.commandQueue.put((iterationNum, timeElapsed, lastIterationTime, states))
+
+    def receive(self) -> list[tuple[int, dict, list[Exception]]]:
+        """
+        Waits for the worker to finish its iteration and returns a list with one (system id, control state,
+        exceptions) tuple per system. Raises whatever unexpected exception stopped the worker.
+        The events, counters, and span times the worker recorded are merged into this process's instrumentation.
+        """
+        results = self.resultQueue.get()
+        if isinstance(results, Exception):
+            raise results
+        results, drained = results
+        instrumentation.merge(drained)
+        return results
+
+    def stop(self) -> None:
+        """Tells the worker to exit after its current iteration and waits for it to do so."""
+        if self.process.is_alive():
+            self.commandQueue.put(None)
+            self.process.join(timeout=2 * constants.SET_PERIOD)
+        if self.process.is_alive():
+            self.process.terminate()
+
+# The target of the worker process, loops until it is sent None
+def run_channel_worker(systems : list[System], tempDetectors : list[MAX6675],
+                       commandQueue : Queue, resultQueue : Queue) -> None:
+    """
+    Runs each system for an iteration every time a command is received and puts the updated control states into
+    the result queue, along with what was recorded by the instrumentation. A command of None stops the loop.
+    """
+    # the instrumentation was copied from the main process when this one was forked, so it starts over
+    instrumentation.reset(keepNewSpanTimes=True)
+    try:
+        while True:
+            command = commandQueue.get()
+            if command is None:
+                break
+            iterationNum, timeElapsed, lastIterationTime, states = command
+            results = []
+            for system, tempDetector in zip(systems, tempDetectors):
+                system.set_control_state(states[system.id])
+                _, errList = system.run(iterationNum, timeElapsed, tempDetector, lastIterationTime)
+                results.append((system.id, system.get_control_state(), errList))
+            resultQueue.put((results, instrumentation.drain()))
+    except Exception as e:
+        resultQueue.put(e)
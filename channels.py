@@ -0,0 +1,154 @@
+import json
+import os
+
+import constants
+
+# The heater tapes (channels) of a bake box, read at startup from the channel definition file (constants.CHANNELS_FILE)
+# Everything kept per channel (the systems, temperature detectors, ui tabs, log columns, and workers) is made from this
+# list in its order, so a box has however many tapes its file lists. The file is json:
+#   {"channels": [
+#       {"name": "Tape 1", "relay": 11, "chipSelect": 3, "clock": 21, "data": 19,
+#        "temp": 150, "rate": 1.0, "ki": 1.5, "group": "chamber"},
+#       ...
+#   ]}
+# relay, chipSelect, clock, and data are required, the rest can be left out. temp, rate, and ki are the initial set
+# values (System's defaults are used for any left out, and the command line overrides them). Channels with the same
+# group heat the same object and are run by the same worker process when constants.CONTROL_ENGINE is "workers", a
+# channel without a group gets a worker of its own.
+# The pins use the pi's BOARD numbering, and are handed to GPIO as they are. From wiring the first box:
+#   - avoid gpio 0, 1, 14, and 15 since they are reserved for i2c and uart
+#   - relays should be on gpio >= 9 because the ones < 9 are on by default (and so is gpio 15 apparently, found by
+#     testing), which would turn the SSRs on whenever the pi boots or crashes
+#   - chip selects should be on gpio < 9 since those are on by default and chip select is active low
+#   - clock and data can be any gpio, the clock only changes while the pi is toggling it
+# Every relay and chip select pin has to be different, and no relay can share a pin with a temperature detector.
+
+# One heater tape: what it is called, the pins of its SSR and MAX6675, its initial set values, and its group
+class Channel:
+    """
+    The definition of one channel, as read from the channel definition file. name, temp, rate, ki, and group are None
+    if they weren't given.
+    """
+    REQUIRED_FIELDS = ("relay", "chipSelect", "clock", "data")
+    OPTIONAL_FIELDS = ("name", "temp", "rate", "ki", "group")
+
+    def __init__(self, name : str, relay : int, chipSelect : int, clock : int, data : int, temp : float=None,
+                 rate : float=None, ki : float=None, group : str=None):
+        """
+        name: what the channel is called in the ui (System's default if None)
+        relay: the pin that turns the channel's SSR on and off
+        chipSelect, clock, data: the pins of the channel's MAX6675
+        temp, rate, ki: the initial set values
+        group: the name of the channels heating the same object
+        """
+        self.name = name
+        self.relay = relay
+        self.chipSelect = chipSelect
+        self.clock = clock
+        self.data = data
+        self.temp = temp
+        self.rate = rate
+        self.ki = ki
+        self.group = group
+
+    def system_arguments(self) -> dict:
+        """Returns the name and initial set values that were given, as the keyword arguments of System."""
+        setValues = {}
+        if self.name is not None:
+            setValues["name"] = self.name
+        if self.temp is not None:
+            setValues["startSetTemp"] = self.temp
+        if self.rate is not None:
+            setValues["startSetRate"] = self.rate
+        if self.ki is not None:
+            setValues["startSetKi"] = self.ki
+        return setValues
+
+    def to_dict(self) -> dict:
+        """Returns the channel as it is written in a channel definition file, leaving out what wasn't given."""
+        return {field: getattr(self, field)
+                for field in ("name", "relay", "chipSelect", "clock", "data", "temp", "rate", "ki", "group")
+                if getattr(self, field) is not None}
+
+# Reads and checks a channel definition file
+def load_channels(fileName : str=constants.CHANNELS_FILE) -> list[Channel]:
+    """
+    Returns the channels defined in the file, in order. Raises ValueError (naming the file and the channel) if the file
+    isn't a valid channel definition, and OSError if it can't be read.
+    """
+    with open(fileName) as file:
+        try:
+            definition = json.load(file)
+        except json.JSONDecodeError as e:
+            raise ValueError("{} is not valid json: {}".format(fileName, e))
+    return parse_channels(definition, fileName)
+
+def parse_channels(definition : dict, source : str="the channel definition") -> list[Channel]:
+    """
+    Returns the channels of an already loaded channel definition (the json object of the file). Raises ValueError if
+    anything is missing, of the wrong type, outside the set value limits in constants, or if a pin is used twice.
+    source is what the error messages call the definition.
+    """
+    if not isinstance(definition, dict) or not isinstance(definition.get("channels"), list):
+        raise ValueError("{} has to be an object with a list of channels".format(source))
+    if len(definition["channels"]) == 0:
+        raise ValueError("{} doesn't define any channels".format(source))
+
+    channels = []
+    for i, entry in enumerate(definition["channels"]):
+        where = "{}, channel {}".format(source, i + 1)
+        if not isinstance(entry, dict):
+            raise ValueError("{}: has to be an object".format(where))
+        unknown = set(entry) - set(Channel.REQUIRED_FIELDS) - set(Channel.OPTIONAL_FIELDS)
+        if len(unknown) > 0:
+            raise ValueError("{}: unknown fields {}".format(where, ", ".join(sorted(unknown))))
+        for field in Channel.REQUIRED_FIELDS:
+            if not isinstance(entry.get(field), int) or isinstance(entry[field], bool) or entry[field] < 0:
+                raise ValueError("{}: {} has to be a pin number".format(where, field))
+        for field, low, high in (("temp", constants.MIN_SET_TEMP, constants.MAX_SET_TEMP),
+                                 ("rate", constants.MIN_SET_RATE, constants.MAX_SET_RATE),
+                                 ("ki", constants.MIN_SET_KI, constants.MAX_SET_KI)):
+            value = entry.get(field)
+            if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool)
+                                      or not low <= value <= high):
+                raise ValueError("{}: {} has to be between {} and {}".format(where, field, low, high))
+        for field in ("name", "group"):
+            if entry.get(field) is not None and not isinstance(entry[field], str):
+                raise ValueError("{}: {} has to be a string".format(where, field))
+        channels.append(Channel(entry.get("name"), entry["relay"],
+                                entry["chipSelect"], entry["clock"], entry["data"], entry.get("temp"),
+                                entry.get("rate"), entry.get("ki"), entry.get("group")))
+
+    # a pin driving two SSRs (or an SSR and a MAX6675) would heat a tape nothing is watching
+    relays = [channel.relay for channel in channels]
+    chipSelects = [channel.chipSelect for channel in channels]
+    sensorPins = set(chipSelects + [channel.clock for channel in channels] + [channel.data for channel in channels])
+    for name, pins in (("relay", relays), ("chip select", chipSelects)):
+        repeated = sorted({pin for pin in pins if pins.count(pin) > 1})
+        if len(repeated) > 0:
+            raise ValueError("{}: {} pins {} are used by more than one channel".format(
+                source, name, ", ".join(str(pin) for pin in repeated)))
+    shared = sorted(set(relays) & sensorPins)
+    if len(shared) > 0:
+        raise ValueError("{}: pins {} are used both for relays and temperature detectors".format(
+            source, ", ".join(str(pin) for pin in shared)))
+    return channels
+
+# Writes channels in the channel definition format, e.g. next to a bake's data so its columns can be told apart
+def save_channels(channels : list[Channel], fileName : str) -> None:
+    folder = os.path.dirname(fileName)
+    if folder != "" and not os.path.exists(folder):
+        os.makedirs(folder)
+    with open(fileName, "w") as file:
+        json.dump({"channels": [channel.to_dict() for channel in channels]}, file, indent=4)
+
+# Which channels are run together, by index
+def channel_groups(channels : list[Channel]) -> list[list[int]]:
+    """
+    Returns the indices of the channels in each group, in the order each group first appears. A channel without a group
+    is in a group on its own.
+    """
+    groups : dict[str | int, list[int]] = {}
+    for i, channel in enumerate(channels):
+        groups.setdefault(i if channel.group is None else channel.group, []).append(i)
+    return list(groups.values())
@@ -0,0 +1,108 @@
+from multiprocessing import RawArray
+import heapq
+import itertools
+import time
+
+# Where the control loop gets the time from
+# Everything that reads the time or waits for it (the iteration timing, the relay scheduler, the temperature
+# detectors, and the simulated hardware) goes through the current clock, so the same code can run in real time or,
+# with a VirtualClock, as fast as the computer can go with the time only moving when something waits for it
+
+class Clock:
+    """
+    The time in seconds, and a queue of callbacks to run at given times (what root.after does for tkinter). The
+    callbacks only run while run_until is being called.
+    """
+    isVirtual = False
+
+    def __init__(self):
+        self.callbacks : list[tuple[float, int, callable]] = []    # a heap of (time, order added, callback)
+        self.counter = itertools.count()
+
+    def now(self) -> float:
+        raise NotImplementedError
+
+    def sleep(self, seconds : float) -> None:
+        raise NotImplementedError
+
+    def call_at(self, when : float, callback : callable) -> None:
+        """Runs callback (with no arguments) at the time when, callbacks at the same time run in the order added."""
+        heapq.heappush(self.callbacks, (when, next(self.counter), callback))
+
+    def call_later(self, delay : float, callback : callable) -> None:
+        """Runs callback (with no arguments) delay seconds from now."""
+        self.call_at(self.now() + delay, callback)
+
+    def run_until(self, endTime : float) -> None:
+        """Runs the queued callbacks in time order, including ones they add, until endTime or none are left."""
+        while len(self.callbacks) > 0 and self.callbacks[0][0] <= endTime:
+            when, _, callback = heapq.heappop(self.callbacks)
+            self.sleep(when - self.now())
+            callback()
+
+# The real time, for running the hardware
+class RealClock(Clock):
+    """The CLOCK_MONOTONIC_RAW clock. sleep and run_until really wait."""
+    def now(self) -> float:
+        return time.clock_gettime(time.CLOCK_MONOTONIC_RAW)
+
+    def sleep(self, seconds : float) -> None:
+        if seconds > 0:
+            time.sleep(seconds)
+
+# A simulated time, for running the control loop against the simulated hardware faster than real time
+# the time is in shared memory so the worker processes (started after the clock is set) read the same time
+class VirtualClock(Clock):
+    """
+    A discrete event clock. The time only moves when sleep or run_until is called, and then jumps straight to the
+    next callback (or the end of the sleep) instead of waiting. Only the process driving the simulation should move
+    the time, other processes can read it.
+    """
+    isVirtual = True
+
+    def __init__(self, startTime : float=0.0):
+        """
+        startTime: the time the clock starts at, in seconds
+        """
+        super().__init__()
+        self.time = RawArray('d', [startTime])
+
+    def now(self) -> float:
+        return self.time[0]
+
+    def sleep(self, seconds : float) -> None:
+        """Moves the time forward by seconds, running any callbacks that are due on the way."""
+        endTime = self.time[0] + max(0, seconds)
+        while len(self.callbacks) > 0 and self.callbacks[0][0] <= endTime:
+            when, _, callback = heapq.heappop(self.callbacks)
+            self.time[0] = max(self.time[0], when)
+            callback()
+        self.time[0] = endTime
+
+    def run_until(self, endTime : float) -> None:
+        """Runs the queued callbacks in time order until endTime, then moves the time to endTime if it is finite."""
+        while len(self.callbacks) > 0 and self.callbacks[0][0] <= endTime:
+            when, _, callback = heapq.heappop(self.callbacks)
+            self.time[0] = max(self.time[0], when)
+            callback()
+        if endTime != float("inf"):
+            self.time[0] = max(self.time[0], endTime)
+
+_clock : Clock = RealClock()
+
+def get_clock() -> Clock:
+    """Returns the clock in use."""
+    return _clock
+
+def set_clock(clock : Clock) -> None:
+    """Changes the clock everything uses. Has to be done before the worker processes are started."""
+    global _clock
+    _clock = clock
+
+def now() -> float:
+    """Returns the current time in seconds from the clock in use."""
+    return _clock.now()
+
+def sleep(seconds : float) -> None:
+    """Waits for the given number of seconds on the clock in use."""
+    _clock.sleep(seconds)
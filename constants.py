@@ -1,11 +1,20 @@
 from enum import IntEnum
 
 SAVE_TO_FOLDER_STR = "./plots_data"
+# the heater tapes of the box: their pins, initial set values, and groups (see channels.py)
+# a copy is saved next to each bake's data, since the data's columns are the channels in this file's order
+CHANNELS_FILE = "./channels.json"
+CHANNELS_COPY_EXTENSION = ".channels.json"
+LOG_FORMAT = "csv"  # "csv" or "binary" (a run log that can be memory mapped, see run_log.py)
+LOG_FLUSH_INTERVAL = 10 # in seconds; the longest a row of data waits before being written to the file
+LOG_FLUSH_ROWS = 60 # write the waiting rows to the file early once there are this many
+LOG_FSYNC_INTERVAL = 60 # in seconds; how often the file is synced to the SD card, None to leave it to the OS
+LOG_MAX_QUEUED_ROWS = 10000 # rows are dropped (and counted) instead of blocking the control loop past this
 
 KP = 0
 KD = 0
 KI_SCALING_FACTOR = 10**-2
-SET_PERIOD = 1.0 # in seconds; the effective period will be this + how long it takes to update the gui (usually 0.4s)
+SET_PERIOD = 1.0 # in seconds; the SSRs are run in the background so the gui is updated during the period
 DELAY = 0.05 # in seconds; time for the pi to write to and read from the max6675 registers
 TIME_TO_UPDATE_THE_UI_IF_NOT_EVERY_ITERATION = 60 # in seconds
 
@@ -23,54 +32,79 @@ MIN_SET_RATE = 0.1 # degrees Celsius per minute
 MAX_SET_KI = 100
 MIN_SET_KI = 1
 STARTING_NUM_POINTS = 20
+RATE_WINDOW_SIZE = 20   # how many of the most recent temperatures the current rate is fit to
+STEP_HOLD_RATE_FACTOR = 2  # the next step waits while the measured rate is more than this times the set rate
 MAX_POINTS_IN_MEMORY = 1500
-TIME_BETWEEN_ITERATIONS = 10    # milliseconds
+# older temperatures are kept as the min, mean, and max of each bucket of time: (seconds per bucket, number of buckets)
+# every minute for a day, then every 10 minutes for a week
+HISTORY_TIERS = ((60, 24 * 60), (600, 7 * 24 * 6))
+# the lengths of history that can be shown in the plot as (button text, seconds), None shows the last data points
+HISTORY_VIEWS = (("Points", None), ("1 h", 60 * 60), ("12 h", 12 * 60 * 60), ("7 d", 7 * 24 * 60 * 60))
+UI_REFRESH_INTERVAL = 200    # milliseconds; how often the ui shows what the control loop has done
+# how the systems are run each iteration: "workers" runs each group of channels (see channels.py) in its own process
+# (ChannelWorker), "vectorized" runs them all at once with one ControlEngine in the main process (BatchWorker), which
+# makes the same decisions. For more than a few tapes use "vectorized" with the "array" or "spidev" detector backend,
+# its cost per iteration grows much slower than the number of channels (benchmarks/channel_scaling.py)
+CONTROL_ENGINE = "workers"
+# the offline tuner (autotune.py): the runs are averaged over AUTOTUNE_SAMPLE_INTERVAL before a first order plus dead
+# time model is fit to each tape, and the ki and rate it proposes are the ones that settle (stay within
+# AUTOTUNE_SETTLE_BAND of the set temperature) soonest in simulated bakes without going more than AUTOTUNE_MAX_OVERSHOOT
+# above it or putting the system on hold
+AUTOTUNE_SAMPLE_INTERVAL = 10   # in seconds
+AUTOTUNE_MAX_DEAD_TIME = 120    # in seconds; the longest delay between the heater and the thermocouple that is tried
+AUTOTUNE_SETTLE_BAND = 2    # degrees Celsius, the stepping holds the temperature within about 1.5 degrees
+AUTOTUNE_MAX_OVERSHOOT = UNACCEPTABLE_TEMP_OVERSHOOT / 2    # degrees Celsius, a margin below the safety check
+AUTOTUNE_SETTLE_TIME = 2 * 60 * 60  # in seconds; how long past the end of the ramp the simulated bakes are run
+AUTOTUNE_DUTY_HEADROOM = 0.8    # the rate limit leaves the rest of the duty cycle for holding the ramp against losses
+# where a bake run by bake_daemon.py listens for the ui (bake_client.py), and how long the ui waits for an answer
+CONTROL_SOCKET_PATH = "/tmp/heater_tape_bake.sock"
+CONTROL_TIMEOUT = 5 # in seconds
+
+# how much the program records about each iteration (see instrumentation), the events are written next to the data file
+class VERBOSITY(IntEnum):
+    """OFF records nothing but the counters, WARNING only problems, INFO an event per iteration and the time each phase
+    of it takes, DEBUG every phase and every channel's stepping as separate events."""
+    OFF = 0
+    WARNING = 1
+    INFO = 2
+    DEBUG = 3
+
+INSTRUMENTATION_LEVEL = VERBOSITY.INFO
+EVENT_BUFFER_SIZE = 10000   # events waiting to be written, the oldest are dropped past this
+EVENT_FLUSH_INTERVAL = 5    # seconds between writes of the events
+SPAN_SAMPLES = 1000 # how many of the most recent durations of each phase are kept for the statistics
+EVENT_LOG_EXTENSION = ".events.jsonl"
+
+# what hardware the program runs on, "pi" uses the GPIO pins and MAX6675s of the raspberry pi,
+# "sim" uses fake_gpio and simulated heater tapes (thermal_plant) so it can be run on any computer
+HARDWARE_BACKEND = "pi"
+# the simulated heater tapes, see thermal_plant.ThermalPlant
+SIM_AMBIENT_TEMP = 22   # degrees Celsius
+SIM_TIME_CONSTANT = 100 * 60    # seconds, about what fitting the cooling curves in the notebook gives
+SIM_HEATER_GAIN = 250   # degrees above ambient a tape settles at with its SSR always on
+SIM_NOISE = 0.1 # degrees Celsius, the standard deviation of the reading noise
+SIM_SEED = None # the seed of the reading noise, set it to make simulated runs repeatable
+
+# how the MAX6675s are read, "bitbang" toggles each channel's clock pin and reads its data pin from python,
+# "array" does the same but for all of them at once in a single pass (the main process reads them every iteration),
+# "spidev" reads each one in a single transfer on the hardware SPI bus (falls back to "bitbang" if the bus can't be opened)
+# for "spidev" every MAX6675 has to be wired to the bus's SCLK and MISO pins, they are still selected by chip select
+TEMP_DETECTOR_BACKEND = "bitbang"
+SPI_BUS = 0
+SPI_DEVICE = 0
+SPI_MAX_SPEED_HZ = 1000000  # the MAX6675 supports up to 4.3 MHz
+MAX6675_CONVERSION_TIME = 0.22  # in seconds; reading the MAX6675 sooner than this restarts its conversion
+MAX_SAMPLE_AGE = 3 * SET_PERIOD # in seconds; a temperature reading older than this is stale
 
 CURRENT_TEMP_STR = "Current temp: {:.2f} C"
 CURRENT_RATE_STR = "Current rate: {:.2f} C/m"
+READING_AGE_STR = "Reading age: {:.1f} s"
+REDRAW_TIME_STR = "Plot redraw: {:.1f} ms (average {:.1f} ms)"
 
 SET_TEMP_STR = "Set temp: {:.2f} C"
 SET_RATE_STR = "Set rate: {:.2f} C/m"
 SET_KI_STR = "Set Ki: {:.2f}"
 
-# GPIOs to avoid: 0, 1, 14, 15 since reserved for i2c and uart
-class CLOCK_PINS(IntEnum):
-    """These pins (BOARD) on the pi will control the clock signal for SPI communication with the MAX6675. Any GPIO
-    pins can be used for this regardless of pull up/down resistors since the clock signal is created by the pi raising and 
-    lowering the pin voltage repeatedly."""
-    CLK1 = 21 # gpio 9
-    CLK2 = 24 # gpio 8
-    CLK3 = 26 # gpio 7
-    CLK4 = 31 # gpio 6
-
-class DATA_PINS(IntEnum):
-    """These pins (BOARD) on the pi will control the data signal for SPI communication with the MAX6675. Any GPIO
-    pins can be used for this regardless of pull up/down resistors since this only matters if there is a clock signal
-    which will not happen in the event of the pi crashing."""
-    DATA1 = 19 # gpio 10
-    DATA2 = 23 # gpio 11
-    DATA3 = 32 # gpio 12
-    DATA4 = 33 # gpio 13
-
-# TODO: change the relay pins to be >= 9 and the chip selects ones to be < 9
-# These pins on the pi will control which rtd to read data in from serially
-class CHIP_SELECT(IntEnum):
-    """These pins (BOARD) on the pi will control which temperature detector to read data in from serially.
-    These pins should be GPIO < 9 since those are on by default and chip select is active low for SPI.."""
-    CS1 = 3 # gpio 2
-    CS2 = 5 # gpio 3
-    CS3 = 7 # gpio 4
-    CS4 = 29 # gpio 5
-
-# These pins on the pi will turn on each ssr in parallel for their respective duty cycles
-class RELAY_SELECT(IntEnum):
-    """These pins (BOARD) on the pi will control if each SSR is on or off. It's important that these
-    are GPIO >= 9 because the ones < 9 are on by default (and so is gpio 15 apparently, found by testing)."""
-    RS1 = 11 # gpio 17
-    RS2 = 12 # gpio 18
-    RS3 = 36 # gpio 16
-    RS4 = 35 # gpio 19
-
 # To be used with the duty cycle assignments
 # Check statuses before turning on an SSR
 class OPERATION_STATUSES(IntEnum):
@@ -0,0 +1,210 @@
+import math
+import numpy as np
+
+import constants
+import instrumentation
+from bake_system import System, SystemInoperableError, SystemUnreliableError
+from hardware import MAX6675Error
+from rate_estimator import SlopeEstimator
+from temp_detectors import SampledTempDetector
+
+# The stepping, safety, and PID logic of System.run for every channel at once
+# Each control state field is a numpy array with one element per channel (a struct of arrays), and every branch of
+# System.run becomes a mask, so one iteration of any number of channels is a fixed number of numpy operations
+# instead of a python function call per channel in a process per channel. It makes exactly the same decisions
+# as System.run (benchmarks/engine_parity.py checks this).
+class ControlEngine:
+    """
+    The control state of numChannels channels as arrays, named as in System.CONTROL_STATE_FIELDS. step() runs one
+    iteration of System.run on all of them from an array of temperatures. The state is copied from and to System
+    objects (or their control state dictionaries) with load_state and get_control_state.
+    """
+    # the dtype each control state field is kept as, the rest are float64
+    INT_FIELDS = ("numStepsTaken", "operation_status")
+    BOOL_FIELDS = ("hasSteppedToDesired", "hasReachedDesired", "steppingUp", "updateDataEveryMinute")
+
+    def __init__(self, numChannels : int):
+        """
+        numChannels: how many channels are run together
+        """
+        self.numChannels = numChannels
+        for field in System.CONTROL_STATE_FIELDS:
+            if field in ControlEngine.INT_FIELDS:
+                setattr(self, field, np.zeros(numChannels, dtype=np.int64))
+            elif field in ControlEngine.BOOL_FIELDS:
+                setattr(self, field, np.zeros(numChannels, dtype=bool))
+            else:
+                setattr(self, field, np.zeros(numChannels))
+        # the same window as each System's own estimator, NaN samples (failed readings) are skipped
+        self.rateEstimator = SlopeEstimator(numChannels, windowSize=constants.RATE_WINDOW_SIZE)
+
+    def load_state(self, channel : int, state : dict) -> None:
+        """Sets a channel's control state from a dictionary made by System.get_control_state."""
+        for field in System.CONTROL_STATE_FIELDS:
+            getattr(self, field)[channel] = state[field]
+
+    def load_states(self, states : list[dict]) -> None:
+        """Sets every channel's control state from a dictionary made by System.get_control_state, in channel order."""
+        for field in System.CONTROL_STATE_FIELDS:
+            getattr(self, field)[:] = [state[field] for state in states]
+
+    def get_control_state(self, channel : int) -> dict:
+        """Returns a channel's control state as a dictionary that System.set_control_state takes."""
+        state = {field: getattr(self, field)[channel].item() for field in System.CONTROL_STATE_FIELDS}
+        state["operation_status"] = constants.OPERATION_STATUSES(state["operation_status"])
+        return state
+
+    def get_control_states(self) -> list[dict]:
+        """Returns the control state of every channel, like get_control_state but converting each field only once."""
+        columns = [getattr(self, field).tolist() for field in System.CONTROL_STATE_FIELDS]
+        states = [dict(zip(System.CONTROL_STATE_FIELDS, values)) for values in zip(*columns)]
+        for state in states:
+            state["operation_status"] = constants.OPERATION_STATUSES(state["operation_status"])
+        return states
+
+    def step(self, timeElapsed : float, lastIterationTime : float, temps : np.ndarray,
+             allSteppedToSame : bool | np.ndarray=True) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Runs one iteration of System.run on every channel whose reading worked. Channels whose reading failed (NaN
+        temperatures) are left as they are, the caller reports them as unreliable like System.run does.
+
+        timeElapsed: the time elapsed since the start of the program
+        lastIterationTime: the time it took to complete the last iteration of the program
+        temps: the temperature read for each channel, NaN where the reading failed
+        allSteppedToSame: whether the channels heating the same object have all stepped to the same temperature
+        (see SystemSharedValues), for each channel or for all of them
+
+        returns: the temperature to store for each channel (NaN if none should be stored this iteration), which
+        channels became inoperable this iteration, and whether each one's temperature was too high (rather than low)
+        """
+        temps = np.asarray(temps, dtype=np.float64)
+        valid = ~np.isnan(temps)
+        inoperable = int(constants.OPERATION_STATUSES.INOPERABLE)
+
+        # only store the temperature if the time is right (every iteration or every minute)
+        storedTemps = temps.copy()
+        waiting = valid & self.updateDataEveryMinute
+        due = waiting & (self.timeSinceLastUpdate >= 60)
+        self.timeSinceLastUpdate[due] = 0
+        storedTemps[waiting & ~due] = np.nan
+
+        # failed readings (NaN) don't take a place in their channel's window, System.run doesn't add them either
+        self.rateEstimator.update(timeElapsed, temps)
+        self.measuredRate[valid] = self.rateEstimator.slope()[valid]
+
+        # the first step goes to the next whole degree in the direction of the ramp
+        if timeElapsed >= constants.TOTAL_STARTUP_TIME:
+            first = valid & (self.numStepsTaken == 0)
+            self.stepToTemp[first] = np.where(self.steppingUp, np.ceil(temps), np.floor(temps))[first]
+            self.error_running_sum[first] = 0
+            self.prev_error[first] = 0
+            self.timeSinceLastStep[first] = 0
+            self.numStepsTaken[first] = 1
+
+        # a step is due once its time is up and the temperature has reached the current step
+        # the masks are all worked out before anything changes, the same as the if/elif in System.run
+        up = valid & self.steppingUp
+        down = valid & ~self.steppingUp
+        # and it isn't held back by the temperature already changing a lot faster than the set rate
+        with np.errstate(divide="ignore"):
+            stepTimeUp = self.timeSinceLastStep >= (60 / self.desiredRate)
+        rateLimit = self.desiredRate * constants.STEP_HOLD_RATE_FACTOR / 60
+        due = stepTimeUp & allSteppedToSame & np.where(self.steppingUp,
+                                                       (temps >= self.stepToTemp) & (self.measuredRate <= rateLimit),
+                                                       (temps <= self.stepToTemp) & (-self.measuredRate <= rateLimit))
+        stepping = due & ((up & (self.stepToTemp < self.desiredTemp)) | (down & (self.stepToTemp > self.desiredTemp)))
+        arriving = (due & (up | down) & ~stepping & (self.stepToTemp == self.desiredTemp)
+                    & ~self.hasSteppedToDesired)
+        self.numStepsTaken[stepping] += 1
+        self.stepToTemp[stepping] += np.where(self.steppingUp, 1, -1)[stepping]
+        self.hasSteppedToDesired[arriving] = True
+        self.error_running_sum[stepping | arriving] = 0
+        self.timeSinceLastStep[stepping | arriving] = 0
+        # stop the integral winding up past the desired temperature on the way up or above the step on the way down
+        self.error_running_sum[(up & (temps >= self.desiredTemp)) | (down & (temps > self.stepToTemp))] = 0
+        self.timeSinceLastStep[valid] += lastIterationTime
+
+        # safety: a temperature too far off for too long turns the channel off
+        outOfRange = valid & ((temps > self.maxAcceptableTemp) | (temps < constants.MIN_ACCEPTABLE_TEMP))
+        self.timeOutOfAcceptableRange[outOfRange] += lastIterationTime
+        tooLong = outOfRange & (self.timeOutOfAcceptableRange >= constants.MAX_TIME_AT_UNACCEPTABLE_TEMP * 60)
+        newlyInoperable = tooLong & (self.operation_status != inoperable)
+        tooHigh = temps > self.maxAcceptableTemp
+        self.operation_status[tooLong] = inoperable
+        self.operation_status[outOfRange & ~tooLong] = int(constants.OPERATION_STATUSES.ON_HOLD)
+        recovered = valid & ~outOfRange & (self.operation_status != inoperable)
+        self.timeOutOfAcceptableRange[recovered] = 0
+        self.operation_status[recovered] = int(constants.OPERATION_STATUSES.OPERABLE)
+
+        # stabilization: start stepping again from the current temperature if it got too far from the step
+        restart = valid & (np.abs(self.stepToTemp - temps) >= constants.LARGE_TEMP_DIFFERENCE)
+        self.numStepsTaken[restart] = 0
+        self.steppingUp[restart] = (self.desiredTemp > temps)[restart]
+
+        if instrumentation.enabled(constants.VERBOSITY.DEBUG):
+            for channel in np.flatnonzero(valid):
+                instrumentation.event(constants.VERBOSITY.DEBUG, "step", system=int(channel), time=timeElapsed,
+                                      timeSinceLastStep=float(self.timeSinceLastStep[channel]),
+                                      stepToTemp=float(self.stepToTemp[channel]))
+
+        # the PID output, in the same order of operations as funcs.pid, clamped like funcs.clamp
+        self.tempForDutyCycle[valid] = temps[valid]
+        error = self.stepToTemp - temps
+        output = (constants.KP * error + self.ki * constants.KI_SCALING_FACTOR * (self.error_running_sum + error)
+                  + constants.KD * (error - self.prev_error))
+        self.computedDutyCycle[valid] = np.maximum(0.0, np.minimum(output, 1.0))[valid]
+        self.prev_error[valid] = error[valid]
+        self.error_running_sum[valid] += error[valid]
+        return storedTemps, newlyInoperable, tooHigh
+
+# Runs all of its systems with one ControlEngine in the main process, in place of a ChannelWorker per system
+# it has the same send and receive as a ChannelWorker, so iterate doesn't know the difference
+class BatchWorker:
+    """
+    Reads every system's temperature detector and runs one ControlEngine step for all of them when sent an
+    iteration, then gives back the same (system id, control state, exceptions) results a ChannelWorker would.
+    Nothing runs in another process, so adding systems only adds to the length of the arrays.
+    """
+    def __init__(self, systems : list[System], tempDetectors : list[SampledTempDetector]):
+        """
+        systems: the systems this worker runs
+        tempDetectors: the temperature detector for each system, in the same order as systems
+        """
+        self.systems = systems
+        self.tempDetectors = tempDetectors
+        self.engine = ControlEngine(len(systems))
+        self.results : list[tuple[int, dict, list[Exception]]] = []
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def send(self, iterationNum : int, timeElapsed : float, lastIterationTime : float) -> None:
+        """Runs the iteration right away, the results are kept for receive."""
+        temps = np.full(len(self.systems), np.nan)
+        errors : list[list[Exception]] = [[] for _ in self.systems]
+        # the set values may have been changed by the user (or the main process) since the last iteration
+        self.engine.load_states([system.get_control_state() for system in self.systems])
+        for i, (system, tempDetector) in enumerate(zip(self.systems, self.tempDetectors)):
+            try:
+                with instrumentation.span("sensor_read"):
+                    temps[i] = tempDetector.get()
+            except MAX6675Error as e:
+                errors[i].append(SystemUnreliableError(system.id, timeElapsed, e))
+                instrumentation.count("sensor_errors")
+                instrumentation.event(constants.VERBOSITY.WARNING, "sensor_error", system=system.id, cause=str(e))
+
+        with instrumentation.span("control"):
+            storedTemps, newlyInoperable, tooHigh = self.engine.step(timeElapsed, lastIterationTime, temps)
+        for i in np.flatnonzero(newlyInoperable):
+            errors[i].append(SystemInoperableError(self.systems[i].id, timeElapsed, " the temperature reading being"
+                                                   " too " + ("high" if tooHigh[i] else "low") + " for too long"))
+        for system, storedTemp in zip(self.systems, storedTemps.tolist()):
+            system.storedTemps.append(storedTemp)
+        self.results = [(system.id, state, errorList)
+                        for system, state, errorList in zip(self.systems, self.engine.get_control_states(), errors)]
+
+    def receive(self) -> list[tuple[int, dict, list[Exception]]]:
+        return self.results
@@ -0,0 +1,133 @@
+from collections import deque
+import threading
+
+import clocks
+import constants
+import instrumentation
+from constants import VERBOSITY
+
+# Runs the control loop at a fixed rate from its own thread
+# Each iteration is started at an absolute deadline (the start time plus a whole number of periods) instead of a fixed
+# wait after the last one finished, so how long an iteration, the ui, or the file takes never stretches the period
+# and the times the PID and stepping logic see don't drift. The ui is not updated from here, it takes the results
+# whenever it gets to them (take_results).
+class ControlScheduler:
+    """
+    Calls step(iterationNum) at startTime, startTime + period, startTime + 2 * period, ... from a background thread.
+    If an iteration starts a whole period or more late the deadlines it missed are counted and skipped, the next
+    iteration waits for the next deadline still ahead. They aren't run back to back to catch up: the PID adds a whole
+    error to its integral every iteration whatever the period, and the relays would only get a fraction of a period
+    each, so the iteration after a late one just sees the longer time since the last. How late each iteration starts
+    and how far apart they are is recorded for jitter_stats. step is run while holding lock, which anything changing the systems' control state
+    from another thread (the ui's Go button) has to hold as well.
+    Whatever step returns is kept for take_results. An exception from step stops the loop and is kept in error.
+    With a virtual clock there is no thread, each iteration is queued as a callback on the clock instead.
+    """
+    def __init__(self, step : callable, startTime : float, period : float=constants.SET_PERIOD,
+                 numJitterSamples : int=1000, clock : clocks.Clock=None):
+        """
+        step: called with the iteration number at each deadline, what it returns is kept for take_results
+        startTime: the first deadline, on the scheduler's clock
+        period: the time in seconds between deadlines
+        numJitterSamples: how many of the most recent start delays and periods to keep for jitter_stats
+        clock: the clock the deadlines are on, the one in use (clocks.get_clock) if None
+        """
+        self.step = step
+        self.period = period
+        self.clock = clocks.get_clock() if clock is None else clock
+        self.lock = threading.Lock()
+        self.nextDeadline = startTime
+        self.iterationNum = 0
+        self.lastStart : float = None
+        self.missedDeadlines = 0
+        self.startDelays : deque[float] = deque(maxlen=numJitterSamples)   # how late each iteration started
+        self.periods : deque[float] = deque(maxlen=numJitterSamples)   # the time between consecutive starts
+        self.results : deque = deque()
+        self.error : Exception = None
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        if self.clock.isVirtual:
+            self.clock.call_at(self.nextDeadline, self._run_virtual)
+        else:
+            self.thread.start()
+
+    def stop(self) -> None:
+        """Stops the loop after the current iteration and waits for it."""
+        self.stopEvent.set()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def running(self) -> bool:
+        return not self.stopEvent.is_set()
+
+    def take_results(self) -> list:
+        """Returns and clears what step returned for each iteration run since the last call, oldest first."""
+        results = []
+        while len(self.results) > 0:
+            results.append(self.results.popleft())
+        return results
+
+    def raise_error(self) -> None:
+        """Raises the exception that stopped the loop, if there was one, in the calling thread."""
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def jitter_stats(self) -> dict[str, float]:
+        """
+        Returns statistics in seconds about when the iterations started: the number of samples, the mean, 95th
+        percentile, and maximum delay past the deadline, the mean and largest difference of the time between
+        iterations from the period, and the total number of missed deadlines.
+        """
+        delays = sorted(self.startDelays)
+        periodErrors = [abs(p - self.period) for p in self.periods]
+        if len(delays) == 0:
+            return {"samples": 0, "mean": 0.0, "p95": 0.0, "max": 0.0, "period_error_mean": 0.0,
+                    "period_error_max": 0.0, "missed": self.missedDeadlines}
+        return {"samples": len(delays), "mean": sum(delays) / len(delays),
+                "p95": delays[min(len(delays) - 1, int(0.95 * len(delays)))], "max": delays[-1],
+                "period_error_mean": sum(periodErrors) / len(periodErrors) if len(periodErrors) > 0 else 0.0,
+                "period_error_max": max(periodErrors, default=0.0), "missed": self.missedDeadlines}
+
+    # runs the iteration that is due now and moves nextDeadline on, returns whether the loop should continue
+    def _run_iteration(self) -> bool:
+        start = self.clock.now()
+        missed = int((start - self.nextDeadline) // self.period)
+        if missed > 0:
+            self.missedDeadlines += missed
+            instrumentation.count("missed_deadlines", missed)
+            instrumentation.event(VERBOSITY.WARNING, "missed_deadline", iteration=self.iterationNum, missed=missed,
+                                  late=start - self.nextDeadline)
+            self.nextDeadline += missed * self.period
+        self.startDelays.append(start - self.nextDeadline)
+        if self.lastStart is not None:
+            self.periods.append(start - self.lastStart)
+        self.lastStart = start
+        try:
+            with self.lock:
+                result = self.step(self.iterationNum)
+        except Exception as e:
+            self.error = e
+            self.stopEvent.set()
+            return False
+        self.results.append(result)
+        self.iterationNum += 1
+        self.nextDeadline += self.period
+        return self.running()
+
+    # the loop thread, waits for each deadline (or the stop) and runs the iteration
+    def _run(self) -> None:
+        while self.running():
+            timeLeft = self.nextDeadline - self.clock.now()
+            if timeLeft > 0:
+                self.stopEvent.wait(timeLeft)
+                continue    # checks the time again, waits can end early
+            if not self._run_iteration():
+                break
+
+    # an iteration queued on a virtual clock, queues the next one once it is done
+    def _run_virtual(self) -> None:
+        if self.running() and self._run_iteration():
+            self.clock.call_at(self.nextDeadline, self._run_virtual)
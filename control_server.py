@@ -0,0 +1,100 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+
+import constants
+
+# Lets a ui in another process watch and change a running bake over a local (unix domain) socket
+# Each request and response is one line of json. A request is {"command": name, ...arguments}, and the response is
+# {"ok": true, "result": ...} or {"ok": false, "error": message}. The commands are:
+#   state                                     the readings and set values of every system
+#   data     systemID, numPoints              the last numPoints times and temperatures of a system
+#   history  systemID, duration               the rolled up history of a system over the last duration seconds
+#   set      systemID, [temp], [rate], [ki]   changes the displayed set values of a system
+#   go       systemID, [temp], [rate], [ki]   puts a system's set values into use, like the Go button
+# (see the BakeController methods they call). Clients can connect and disconnect whenever they like, the bake
+# doesn't depend on them. Nothing here imports the hardware or the gui, so either side can use it.
+
+class ControlError(Exception):
+    """Raised by a ControlClient when the server couldn't carry out a request."""
+    pass
+
+# Answers the requests of every connected client, each connection on its own thread
+class ControlServer:
+    """
+    Serves the state, data, history, set, and go commands of a BakeController on a unix domain socket from
+    background threads. Any file left at the socket's path (by a bake that didn't shut down cleanly) is replaced.
+    """
+    def __init__(self, controller : 'BakeController', path : str=constants.CONTROL_SOCKET_PATH):
+        """
+        controller: the BakeController to serve
+        path: where to create the socket
+        """
+        self.controller = controller
+        self.path = path
+        self.commands = {"state": controller.state, "data": controller.data, "history": controller.history,
+                         "set": controller.set_values, "go": controller.go}
+        if os.path.exists(path):
+            os.remove(path)
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                for line in self.rfile:
+                    self.wfile.write((json.dumps(server.handle(line)) + "\n").encode())
+
+        self.server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        if self.thread.is_alive():
+            self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def handle(self, line : bytes) -> dict:
+        """Carries out one request and returns its response."""
+        try:
+            request = json.loads(line)
+            command = self.commands.get(request.pop("command", None))
+            if command is None:
+                raise ValueError("Unknown command, expected one of {}".format(", ".join(self.commands)))
+            return {"ok": True, "result": command(**request)}
+        except (ValueError, TypeError) as e:
+            return {"ok": False, "error": str(e)}
+
+# Connects to a ControlServer and sends it requests, one at a time
+class ControlClient:
+    """A connection to a running bake's ControlServer. Raises OSError if the bake isn't running."""
+    def __init__(self, path : str=constants.CONTROL_SOCKET_PATH, timeout : float=constants.CONTROL_TIMEOUT):
+        """
+        path: the socket the bake is serving on
+        timeout: how long in seconds to wait for a response before giving up
+        """
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(path)
+        self.file = self.socket.makefile("rwb")
+
+    def request(self, command : str, **arguments) -> dict | list:
+        """Sends a command and returns its result. Raises ControlError if the server couldn't carry it out."""
+        self.file.write((json.dumps({"command": command, **arguments}) + "\n").encode())
+        self.file.flush()
+        line = self.file.readline()
+        if line == b"":
+            raise ConnectionError("The bake closed the connection")
+        response = json.loads(line)
+        if not response["ok"]:
+            raise ControlError(response["error"])
+        return response["result"]
+
+    def close(self) -> None:
+        self.file.close()
+        self.socket.close()
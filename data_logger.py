@@ -0,0 +1,89 @@
+import os
+import queue
+import threading
+import time
+
+import constants
+from run_log import CsvRowFormat, BinaryRowFormat
+
+# Saves the data from each iteration to a file from a background thread
+# The control loop only puts a row in a queue, and the rows are written (and synced to the SD card) in batches
+# instead of opening, appending to, and closing the file every iteration
+class DataLogger:
+    """
+    Writes rows of data to a file from a background thread. Rows are queued by log(), which never blocks, and are
+    written in batches whenever enough of them are waiting or enough time has passed. The file can also be fsynced
+    on a timer. close() writes everything that is still queued. How the rows are written (csv or the binary run log)
+    is decided by the row format.
+    """
+    def __init__(self, fileName : str, rowFormat : CsvRowFormat | BinaryRowFormat=None, flushInterval : float=constants.LOG_FLUSH_INTERVAL,
+                 flushRows : int=constants.LOG_FLUSH_ROWS, fsyncInterval : float=constants.LOG_FSYNC_INTERVAL,
+                 maxQueuedRows : int=constants.LOG_MAX_QUEUED_ROWS):
+        """
+        fileName: the file to append the rows to, its folder is created if it doesn't exist
+        rowFormat: turns the rows into what is written to the file, csv if None
+        flushInterval: the longest time in seconds a row can wait before it is written
+        flushRows: how many waiting rows cause a write before flushInterval is up
+        fsyncInterval: how often in seconds the file is synced to the disk, None to leave it to the OS
+        maxQueuedRows: how many rows can be waiting before new ones are dropped (so the control loop never blocks)
+        """
+        self.fileName = fileName
+        self.rowFormat = CsvRowFormat() if rowFormat is None else rowFormat
+        self.flushInterval = flushInterval
+        self.flushRows = flushRows
+        self.fsyncInterval = fsyncInterval
+        self.rowQueue : queue.Queue = queue.Queue(maxsize=maxQueuedRows)
+        self.droppedRows = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def log(self, row : tuple) -> None:
+        """
+        Queues a row to be written. If the queue is full the row is dropped and counted in droppedRows. A row is
+        (time elapsed, temperatures, duty cycles, step temperatures, operation statuses) with one value per channel.
+        """
+        try:
+            self.rowQueue.put_nowait(row)
+        except queue.Full:
+            self.droppedRows += 1
+
+    def close(self) -> None:
+        """Writes every queued row, syncs the file, and stops the thread. Safe to call more than once."""
+        if self.thread.is_alive():
+            self.rowQueue.put(None)
+            self.thread.join()
+
+    # the writer thread, collects rows until it is time to write them
+    def _run(self) -> None:
+        folder = os.path.dirname(self.fileName)
+        if folder != "" and not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(self.fileName, self.rowFormat.mode) as file:
+            if file.tell() == 0:
+                file.write(self.rowFormat.header())
+            rows = []
+            closing = False
+            lastWrite = time.monotonic()
+            lastSync = lastWrite
+            while not closing:
+                try:
+                    row = self.rowQueue.get(timeout=max(0, lastWrite + self.flushInterval - time.monotonic()))
+                    if row is None:
+                        closing = True
+                    else:
+                        rows.append(row)
+                except queue.Empty:
+                    pass    # nothing new, but the waiting rows may be due to be written
+
+                now = time.monotonic()
+                if closing or len(rows) >= self.flushRows or now - lastWrite >= self.flushInterval:
+                    if len(rows) > 0:
+                        file.write(self.rowFormat.format(rows))
+                        file.flush()
+                        rows = []
+                    lastWrite = now
+                    if closing or (self.fsyncInterval is not None and now - lastSync >= self.fsyncInterval):
+                        os.fsync(file.fileno())
+                        lastSync = now
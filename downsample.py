@@ -0,0 +1,74 @@
+import numpy as np
+
+# Reducing how many points are plotted without changing what the plot looks like
+# A plot can't show more detail than it has pixels, so drawing thousands of points on a few hundred pixels wide
+# canvas only costs time. Both methods keep the first and last points and are done in a few numpy passes.
+
+def min_max(x : np.ndarray, y : np.ndarray, numBuckets : int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Splits the x range into numBuckets equal width buckets (e.g. one per pixel column) and keeps only the lowest and
+    highest point in each, in time order, so every spike and overshoot is still drawn exactly. Returns at most
+    2 * numBuckets + 2 points. Buckets with only NaN temperatures keep a NaN so gaps in the data stay gaps.
+
+    x: the sorted x values, must not contain NaN
+    y: the values at each x, can contain NaN
+    numBuckets: how many buckets to split the x range into
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(x)
+    if n <= 2 * numBuckets + 2 or numBuckets < 1 or x[-1] <= x[0]:
+        return x, y
+    bucketEdges = np.linspace(x[0], x[-1], numBuckets + 1)
+    starts = np.unique(np.searchsorted(x, bucketEdges[:-1], side="left"))
+    bucket = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, n)))
+    lows = np.fmin.reduceat(y, starts)     # fmin and fmax ignore NaN unless the whole bucket is NaN
+    highs = np.fmax.reduceat(y, starts)
+    lowest = _first_in_bucket(y == lows[bucket], bucket)
+    highest = _first_in_bucket(y == highs[bucket], bucket)
+    gaps = starts[np.isnan(lows)]
+    keep = np.unique(np.concatenate(([0, n - 1], lowest, highest, gaps)))
+    return x[keep], y[keep]
+
+def _first_in_bucket(matches : np.ndarray, bucket : np.ndarray) -> np.ndarray:
+    """Returns the index of the first True in matches for each bucket that has one."""
+    found = np.flatnonzero(matches)
+    foundBucket = bucket[found]
+    return found[np.concatenate(([True], foundBucket[1:] != foundBucket[:-1]))] if len(found) > 0 else found
+
+def lttb(x : np.ndarray, y : np.ndarray, numPoints : int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Largest-Triangle-Three-Buckets: splits the points into numPoints - 2 buckets of the same size and keeps the point
+    in each that makes the largest triangle with its neighbouring buckets, which keeps the shape of the line (peaks
+    included) with exactly numPoints points. The triangles are made with the average of the previous bucket instead of
+    the point chosen from it, so every bucket can be done at once. Points with a NaN are left out, so gaps in the data
+    are bridged.
+
+    x: the sorted x values
+    y: the values at each x
+    numPoints: how many points to keep
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    if not valid.all():
+        x, y = x[valid], y[valid]
+    n = len(x)
+    if n <= numPoints or numPoints < 3:
+        return x, y
+    # buckets cover the points between the first and last, each has at least one point since numPoints < n
+    starts = np.linspace(1, n - 1, numPoints - 1).astype(np.int64)[:-1]
+    counts = np.diff(np.append(starts, n - 1))
+    bucket = np.repeat(np.arange(len(starts)), counts)
+    meanX = np.add.reduceat(x[1:n - 1], starts - 1) / counts
+    meanY = np.add.reduceat(y[1:n - 1], starts - 1) / counts
+    # the points before and after each bucket that the triangles are made with
+    aX = np.concatenate(([x[0]], meanX[:-1]))[bucket]
+    aY = np.concatenate(([y[0]], meanY[:-1]))[bucket]
+    cX = np.append(meanX[1:], x[n - 1])[bucket]
+    cY = np.append(meanY[1:], y[n - 1])[bucket]
+    px, py = x[1:n - 1], y[1:n - 1]
+    area = np.abs((aX - cX) * (py - aY) - (aX - px) * (cY - aY))
+    largest = np.lexsort((-area, bucket))[starts - 1] + 1
+    keep = np.concatenate(([0], largest, [n - 1]))
+    return x[keep], y[keep]
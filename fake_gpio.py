@@ -0,0 +1,67 @@
+from multiprocessing import Lock, RawArray
+
+import clocks
+
+# A stand in for RPi.GPIO used by the simulated hardware
+# It has the same functions and constants as the parts of RPi.GPIO the program uses. Output pins just remember
+# their level, along with how long they have been high in total so the thermal plant can tell how much each
+# heater tape has been on. This is in shared memory so the worker processes see the relays switched by the main
+# process (it is created when this is first imported, so it has to be imported before the workers are started).
+
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+
+NUM_PINS = 1024  # far more than the pi has, so simulated boxes can give extra channels made up pins
+_lock = Lock()
+# for each pin: its level, when it last changed (from clocks), and how many seconds it had been high before that
+_pins = RawArray('d', 3 * NUM_PINS)
+_mode = RawArray('i', 1)
+
+def setmode(mode : int) -> None:
+    _mode[0] = mode
+
+def getmode() -> int | None:
+    return _mode[0] if _mode[0] != 0 else None
+
+def setwarnings(flag : bool) -> None:
+    pass
+
+def setup(channel : int | list[int], direction : int, pull_up_down : int=PUD_OFF, initial : int=None) -> None:
+    if initial is not None and direction == OUT:
+        output(channel, initial)
+
+def output(channel : int | list[int], value : int | list[int]) -> None:
+    """Sets the level of one or more pins, like RPi.GPIO.output."""
+    channels = channel if isinstance(channel, (list, tuple)) else [channel]
+    values = value if isinstance(value, (list, tuple)) else [value] * len(channels)
+    now = clocks.now()
+    with _lock:
+        for pin, level in zip(channels, values):
+            level = HIGH if level else LOW
+            if _pins[3 * pin] == HIGH:
+                _pins[3 * pin + 2] += now - _pins[3 * pin + 1]
+            _pins[3 * pin] = level
+            _pins[3 * pin + 1] = now
+
+def input(channel : int) -> int:
+    """Returns the level of an output pin, inputs always read low."""
+    return int(_pins[3 * channel])
+
+def cleanup(channel : int | list[int]=None) -> None:
+    """Sets the pins (all of them if None) low."""
+    output(list(range(NUM_PINS)) if channel is None else channel, LOW)
+
+def time_high(channel : int, now : float) -> float:
+    """Returns the total number of seconds the pin has been high up to now (from clocks)."""
+    with _lock:
+        total = _pins[3 * channel + 2]
+        if _pins[3 * channel] == HIGH:
+            total += now - _pins[3 * channel + 1]
+    return total
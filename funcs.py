@@ -43,17 +43,6 @@ def clamp(value, hi, lo):
     """
     return max(lo, min(value, hi))
 
-# helper function
-def rolling_moving_window(l : list, loc : int, window_size : int) -> list:
-    """
-    Returns a slice of the list l, ending at loc (included), with the length of window_size.
-    """
-    if loc >= window_size:
-        return l[loc - window_size : loc]
-    else:
-        s = len(l)
-        return l[s - (window_size - loc) : s] + l[0 : loc]
-
 # helper function
 def average_rate_of_change(time_list : list, value_list : list) -> float:
     """
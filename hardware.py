@@ -0,0 +1,18 @@
+import constants
+
+# Picks the hardware the program talks to
+# Everything that uses the GPIO pins or the MAX6675 driver imports them from here instead of from RPi.GPIO and
+# libs.max6675 directly, so the whole program can be run against the simulated hardware (constants.HARDWARE_BACKEND)
+# on a computer that isn't a pi
+
+if constants.HARDWARE_BACKEND == "sim":
+    import fake_gpio as GPIO
+else:
+    import RPi.GPIO as GPIO
+
+# the driver is kept in libs on the pi, otherwise the copy next to this file is used
+# (it imports GPIO from here, so GPIO has to be set above before it is imported)
+try:
+    from libs.max6675 import MAX6675, MAX6675Array, MAX6675ArrayChannel, MAX6675SPI, MAX6675Error
+except ModuleNotFoundError:
+    from max6675 import MAX6675, MAX6675Array, MAX6675ArrayChannel, MAX6675SPI, MAX6675Error
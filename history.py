@@ -0,0 +1,105 @@
+import math
+import numpy as np
+
+import constants
+from ring_buffer import RingBuffer
+
+# Keeping a system's whole temperature history in a fixed amount of memory
+# The most recent temperatures are kept at full resolution in the system's storedTemps, and older ones are only
+# needed to see the shape of a long bake, so they are rolled up into the min, mean, and max of each minute
+# and of each 10 minutes, with a fixed number of these buckets kept for each
+
+class HistoryTier:
+    """
+    The min, mean, and max of the values in each bucketSeconds long stretch of time, for the last numBuckets
+    stretches. Values are added as they come and each bucket is stored once its time is up. NaN values are skipped,
+    and a bucket with no values is stored as NaN.
+    """
+    def __init__(self, bucketSeconds : float, numBuckets : int):
+        """
+        bucketSeconds: how long a stretch of time each bucket covers
+        numBuckets: how many of the most recent buckets are kept
+        """
+        self.bucketSeconds = bucketSeconds
+        self.numBuckets = numBuckets
+        self.times = RingBuffer(numBuckets)    # the middle of each bucket, in seconds
+        self.mins = RingBuffer(numBuckets)
+        self.means = RingBuffer(numBuckets)
+        self.maxes = RingBuffer(numBuckets)
+        self.bucketStart = math.nan     # the start of the bucket values are currently being added to
+        self.reset_bucket()
+
+    def reset_bucket(self) -> None:
+        self.bucketSum = 0.0
+        self.bucketCount = 0
+        self.bucketMin = math.inf
+        self.bucketMax = -math.inf
+
+    def current(self) -> tuple[float, float, float, float]:
+        """Returns the (time, min, mean, max) of the bucket still being added to."""
+        if self.bucketCount == 0:
+            return self.bucketStart + self.bucketSeconds / 2, math.nan, math.nan, math.nan
+        return (self.bucketStart + self.bucketSeconds / 2, self.bucketMin, self.bucketSum / self.bucketCount,
+                self.bucketMax)
+
+    def add(self, t : float, value : float) -> None:
+        """Adds the value at time t (seconds), t should never go backwards."""
+        start = math.floor(t / self.bucketSeconds) * self.bucketSeconds
+        if start != self.bucketStart:
+            if not math.isnan(self.bucketStart):
+                bucketTime, bucketMin, bucketMean, bucketMax = self.current()
+                self.times.append(bucketTime)
+                self.mins.append(bucketMin)
+                self.means.append(bucketMean)
+                self.maxes.append(bucketMax)
+            self.bucketStart = start
+            self.reset_bucket()
+        if not math.isnan(value):
+            self.bucketSum += value
+            self.bucketCount += 1
+            self.bucketMin = min(self.bucketMin, value)
+            self.bucketMax = max(self.bucketMax, value)
+
+    def span(self) -> float:
+        """Returns how many seconds of history the tier can hold."""
+        return self.bucketSeconds * self.numBuckets
+
+    def series(self, duration : float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns (times, mins, means, maxes) for the buckets in the last duration seconds, oldest first, including the
+        bucket still being added to. At most numBuckets + 1 values each.
+        """
+        if math.isnan(self.bucketStart):
+            return np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0)
+        n = min(len(self.times), int(math.ceil(duration / self.bucketSeconds)))
+        current = self.current()
+        return tuple(np.append(buffer.window(n), value)
+                     for buffer, value in zip((self.times, self.mins, self.means, self.maxes), current))
+
+class TieredHistory:
+    """
+    The rolled up history of one system's temperatures, one HistoryTier for each (bucket seconds, number of buckets)
+    in tiers, from the finest to the coarsest. Every tier gets every value, so each one covers as far back as it can
+    hold and a view of any length is always ready.
+    """
+    def __init__(self, tiers : tuple[tuple[float, int], ...]=constants.HISTORY_TIERS):
+        """
+        tiers: the (bucket seconds, number of buckets) of each tier, finest first
+        """
+        self.tiers = [HistoryTier(bucketSeconds, numBuckets) for bucketSeconds, numBuckets in tiers]
+
+    def add(self, t : float, value : float) -> None:
+        """Adds a temperature (NaN if there wasn't one) at time t in seconds."""
+        for tier in self.tiers:
+            tier.add(t, value)
+
+    def series(self, duration : float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns (times, mins, means, maxes) covering the last duration seconds from the finest tier that holds that
+        much history (the coarsest if none do). The arrays are never longer than the tier, so this is quick for any
+        duration.
+        """
+        for tier in self.tiers:
+            if tier.span() >= duration:
+                return tier.series(duration)
+        return self.tiers[-1].series(duration)
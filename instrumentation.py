@@ -0,0 +1,200 @@
+from collections import Counter, deque
+import json
+import os
+import threading
+import time
+
+import clocks
+import constants
+from constants import VERBOSITY
+
+# Timing and event recording for the control loop, in place of printing every iteration
+# Events go into a ring buffer that a background thread writes to a json lines file, phases of the loop are timed
+# with span(), and things going wrong are counted with count(). Everything below the verbosity level returns right
+# away, so with the level at OFF the cost is a comparison per call.
+# Each process has its own buffers, the workers send theirs back to the main process with their results
+# (drain() and merge()) so everything ends up in the main process's file.
+
+_level : int = int(constants.INSTRUMENTATION_LEVEL)   # a plain int, comparing it is cheaper than the enum
+_spanLevel : int = int(VERBOSITY.INFO)   # the lowest level spans are timed at, also a plain int
+_events : deque[dict] = deque(maxlen=constants.EVENT_BUFFER_SIZE)    # the oldest events are dropped when it is full
+_counters : Counter = Counter()
+_spanTimes : dict[str, deque[float]] = {}   # the most recent durations of each span, in seconds
+_newSpanTimes : dict[str, list[float]] = {} # the durations not yet drained, only kept in worker processes
+_keepNewSpanTimes = False
+_writer : 'EventLogWriter' = None
+
+def configure(level : VERBOSITY, fileName : str=None) -> None:
+    """
+    Sets the verbosity level and, if fileName is given, starts writing the events to it (json lines) from a background
+    thread. close() has to be called to write the last of them.
+    """
+    global _level, _writer
+    _level = int(level)
+    if fileName is not None and level > VERBOSITY.OFF:
+        close()
+        _writer = EventLogWriter(fileName)
+        _writer.start()
+
+def reset(keepNewSpanTimes : bool=False) -> None:
+    """
+    Clears everything recorded in this process (e.g. what a worker process copied from the main process when it was
+    started). keepNewSpanTimes makes span durations also be kept for drain().
+    """
+    global _writer, _keepNewSpanTimes
+    _events.clear()
+    _counters.clear()
+    _spanTimes.clear()
+    _newSpanTimes.clear()
+    _keepNewSpanTimes = keepNewSpanTimes
+    _writer = None
+
+def enabled(level : VERBOSITY) -> bool:
+    """Returns whether events of the given level are recorded, for skipping work that only builds an event."""
+    return level <= _level
+
+def event(level : VERBOSITY, name : str, **fields) -> None:
+    """Records an event with the given fields (which must be json serializable) if the level is enabled."""
+    if level > _level:
+        return
+    fields["event"] = name
+    fields["level"] = level.name
+    fields["t"] = clocks.now()
+    _events.append(fields)
+
+def count(name : str, amount : int=1) -> None:
+    """Adds to a counter, these are always kept (and written in the summary when the log is closed)."""
+    _counters[name] += amount
+
+# Times a phase of the loop, used as "with instrumentation.span(name):"
+class Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name : str):
+        self.name = name
+
+    def __enter__(self) -> 'Span':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, exc, tb) -> None:
+        record_span(self.name, time.perf_counter() - self.start)
+
+# what span() returns when spans aren't recorded, so nothing is timed or allocated
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, excType, exc, tb) -> None:
+        pass
+
+_nullSpan = _NullSpan()
+
+def span(name : str) -> Span | _NullSpan:
+    """Returns a context manager that times what runs inside it, when the level is at least INFO."""
+    if _level < _spanLevel:
+        return _nullSpan
+    return Span(name)
+
+def record_span(name : str, duration : float) -> None:
+    """Records how long (in seconds) a phase took, as an event too when the level is DEBUG."""
+    _add_span_time(name, duration)
+    if _keepNewSpanTimes:
+        _newSpanTimes.setdefault(name, []).append(duration)
+    if _level >= VERBOSITY.DEBUG:
+        event(VERBOSITY.DEBUG, "span", span=name, ms=duration * 1000)
+
+def _add_span_time(name : str, duration : float) -> None:
+    times = _spanTimes.get(name)
+    if times is None:
+        times = _spanTimes[name] = deque(maxlen=constants.SPAN_SAMPLES)
+    times.append(duration)
+
+def drain() -> tuple[list[dict], dict[str, int], dict[str, list[float]]]:
+    """
+    Returns and clears the events, counters, and new span durations recorded in this process since the last drain, to
+    be sent to the main process and given to merge().
+    """
+    events = []
+    while len(_events) > 0:
+        events.append(_events.popleft())
+    drainedCounters = dict(_counters)
+    _counters.clear()
+    spanTimes = dict(_newSpanTimes)
+    _newSpanTimes.clear()
+    return events, drainedCounters, spanTimes
+
+def merge(drained : tuple[list[dict], dict[str, int], dict[str, list[float]]]) -> None:
+    """Adds what another process drained to this process's records."""
+    events, newCounters, spanTimes = drained
+    _events.extend(events)
+    _counters.update(newCounters)
+    for name, durations in spanTimes.items():
+        for duration in durations:
+            _add_span_time(name, duration)
+
+def counters() -> dict[str, int]:
+    return dict(_counters)
+
+def span_stats() -> dict[str, dict[str, float]]:
+    """Returns the number, median, 95th percentile, and maximum (in ms) of the recent durations of each span."""
+    stats = {}
+    for name, times in _spanTimes.items():
+        ordered = sorted(times)
+        if len(ordered) == 0:
+            continue
+        stats[name] = {"n": len(ordered), "p50_ms": ordered[len(ordered) // 2] * 1000,
+                       "p95_ms": ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000,
+                       "max_ms": ordered[-1] * 1000}
+    return stats
+
+def close() -> None:
+    """Writes the remaining events and a summary of the counters and spans, and stops the writer thread."""
+    global _writer
+    if _writer is not None:
+        _writer.close()
+        _writer = None
+
+# Writes the events to a file from a background thread, the same way the DataLogger writes the data
+class EventLogWriter:
+    """
+    Takes the events out of the ring buffer and appends them to a json lines file every flushInterval seconds. When
+    closed it writes what is left followed by a summary event with the counters and span statistics.
+    """
+    def __init__(self, fileName : str, flushInterval : float=constants.EVENT_FLUSH_INTERVAL):
+        """
+        fileName: the file to append the events to, its folder is created if it doesn't exist
+        flushInterval: how often in seconds the events are written
+        """
+        self.fileName = fileName
+        self.flushInterval = flushInterval
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def close(self) -> None:
+        if self.thread.is_alive():
+            self.stopEvent.set()
+            self.thread.join()
+
+    def _run(self) -> None:
+        folder = os.path.dirname(self.fileName)
+        if folder != "" and not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(self.fileName, "a") as file:
+            closing = False
+            while not closing:
+                closing = self.stopEvent.wait(self.flushInterval)
+                lines = []
+                while len(_events) > 0:
+                    lines.append(json.dumps(_events.popleft()))
+                if closing:
+                    lines.append(json.dumps({"event": "summary", "level": VERBOSITY.INFO.name, "t": clocks.now(),
+                                             "counters": counters(), "spans": span_stats()}))
+                if len(lines) > 0:
+                    file.write("\n".join(lines) + "\n")
+                    file.flush()
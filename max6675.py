@@ -1,5 +1,24 @@
-import RPi.GPIO as GPIO
-import time
+from hardware import GPIO
+from multiprocessing import RawArray
+
+import clocks
+
+try:
+    import spidev
+except ImportError:
+    spidev = None   # only needed for MAX6675SPI
+
+# Decoding the 16 bit frame a MAX6675 sends, shared by all the drivers below
+def tc_temperature(data_16):
+    '''Takes a 16 bit frame and returns its thermocouple temperature in celsius.'''
+    # Remove bits D0-3
+    tc_data = ((data_16 >> 3) & 0xFFF)
+    # 12-bit resolution
+    return (tc_data * 0.25)
+
+def no_connection(data_16):
+    '''Takes a 16 bit frame and returns whether its thermocouple is open (bit D2).'''
+    return (data_16 & 0x4) != 0
 
 # Class to get temperature from the MAX6675 thermocouple
 # not written in house, credit goes to apollo-ng on github (https://github.com/apollo-ng/picoReflow)
@@ -51,12 +70,12 @@ class MAX6675(object):
         # Read in 16 bits
         for i in range(16):
             GPIO.output(self.clock_pin, GPIO.LOW)
-            time.sleep(0.001)
+            clocks.sleep(0.001)
             bytesin = bytesin << 1
             if (GPIO.input(self.data_pin)):
                 bytesin = bytesin | 1
             GPIO.output(self.clock_pin, GPIO.HIGH)
-        time.sleep(0.001)
+        clocks.sleep(0.001)
         # Unselect the chip
         GPIO.output(self.cs_pin, GPIO.HIGH)
         # Save data
@@ -66,19 +85,14 @@ class MAX6675(object):
         '''Checks errors on bit D2'''
         if data_16 is None:
             data_16 = self.data
-        noConnection = (data_16 & 0x4) != 0       # tc input bit, D2
-
-        if noConnection:
+        if no_connection(data_16):
             raise MAX6675Error("No Connection") # open thermocouple
 
     def data_to_tc_temperature(self, data_16 = None):
         '''Takes an integer and returns a thermocouple temperature in celsius.'''
         if data_16 is None:
             data_16 = self.data
-        # Remove bits D0-3
-        tc_data = ((data_16 >> 3) & 0xFFF)
-        # 12-bit resolution
-        return (tc_data * 0.25)
+        return tc_temperature(data_16)
 
     def to_c(self, celsius):
         '''Celsius passthrough for generic to_* method.'''
@@ -97,8 +111,176 @@ class MAX6675(object):
         GPIO.setup(self.cs_pin, GPIO.IN)
         GPIO.setup(self.clock_pin, GPIO.IN)
 
+# Same as MAX6675 but reads the 16 bit frame in one transfer on the hardware SPI bus instead of bit banging it
+class MAX6675SPI(MAX6675):
+    '''Python driver for the MAX6675 using the hardware SPI bus through [spidev](https://github.com/doceme/py-spidev)
+     Requires:
+     - spidev and SPI enabled on the Pi (/dev/spidev*)
+
+     The chip can be selected by the bus's own chip select line (CE0 / CE1), or by any GPIO pin when cs_pin is
+     given, which lets more than two chips share one bus.
+    '''
+    def __init__(self, bus, device, cs_pin = None, units = "c", board = GPIO.BCM, max_speed_hz = 1000000,
+                 lock = None, spi = None):
+        '''Initialize Hardware SPI bus
+
+        Parameters:
+        - bus:          SPI bus number, the X in /dev/spidevX.Y
+        - device:       SPI device (chip select) number, the Y in /dev/spidevX.Y
+        - cs_pin:       (optional) GPIO pin to use as the chip select instead of the bus's own
+        - units:        (optional) unit of measurement to return. ("c" (default) | "k" | "f")
+        - board:        (optional) pin numbering method as per RPi.GPIO library (GPIO.BCM (default) | GPIO.BOARD)
+        - max_speed_hz: (optional) SPI clock speed, the MAX6675 supports up to 4.3 MHz
+        - lock:         (optional) lock held during a read, needed when chips on the same bus are read from
+                        different processes with GPIO chip selects
+        - spi:          (optional) an already opened spidev.SpiDev (or a stand in with the same interface)
+        '''
+        self.cs_pin = cs_pin
+        self.units = units
+        self.data = None
+        self.board = board
+        self.lock = lock
+
+        if spi is None:
+            if spidev is None:
+                raise MAX6675Error("spidev is not installed")
+            spi = spidev.SpiDev()
+            spi.open(bus, device)
+        self.spi = spi
+        self.spi.max_speed_hz = max_speed_hz
+        self.spi.mode = 0
+
+        if self.cs_pin is not None:
+            self.spi.no_cs = True
+            GPIO.setmode(self.board)
+            GPIO.setup(self.cs_pin, GPIO.OUT)
+            GPIO.output(self.cs_pin, GPIO.HIGH)
+
+    def read(self):
+        '''Reads 16 bits of the SPI bus in one transfer & stores as an integer in self.data. Raises MAX6675Error if
+        the transfer fails, so a bus error is treated like any other failed reading.'''
+        if self.lock is not None:
+            self.lock.acquire()
+        try:
+            if self.cs_pin is not None:
+                GPIO.output(self.cs_pin, GPIO.LOW)
+            try:
+                bytesin = self.spi.xfer2([0x00, 0x00])
+            except OSError as e:
+                raise MAX6675Error("SPI transfer failed ({})".format(e)) from e
+            self.data = (bytesin[0] << 8) | bytesin[1]
+        finally:
+            # unselect the chip even if the transfer failed, or it would hold the shared bus for every later one
+            if self.cs_pin is not None:
+                GPIO.output(self.cs_pin, GPIO.HIGH)
+            if self.lock is not None:
+                self.lock.release()
+
+    def cleanup(self):
+        '''Closes the SPI device and releases the chip select pin'''
+        self.spi.close()
+        if self.cs_pin is not None:
+            GPIO.setup(self.cs_pin, GPIO.IN)
+
+# Reads several MAX6675s at once by bit banging all of their clock lines together
+# each chip keeps its own chip select, clock, and data pins, but the 16 clock cycles are only done once
+class MAX6675Array(object):
+    '''Bit bangs several MAX6675s in lock step: every chip select is asserted together, every clock line is toggled
+    in the same loop, and every data pin is sampled on each edge, so reading all the chips costs about as much as
+    reading one. The frames are stored in shared memory so channels created in other processes see them too.
+    '''
+    def __init__(self, cs_pins, clock_pins, data_pins, units = "c", board = GPIO.BCM):
+        '''Initialize Soft (Bitbang) SPI buses
+
+        Parameters:
+        - cs_pins:    Chip Select (CS) pin of each chip, in channel order
+        - clock_pins: Clock (SCLK) pin of each chip, chips may share one
+        - data_pins:  Data input (SO) pin of each chip, in channel order
+        - units:      (optional) unit of measurement to return. ("c" (default) | "k" | "f")
+        - board:      (optional) pin numbering method as per RPi.GPIO library (GPIO.BCM (default) | GPIO.BOARD)
+        '''
+        self.cs_pins = list(cs_pins)
+        self.clock_pins = list(dict.fromkeys(clock_pins))   # toggling a shared clock line once is enough
+        self.data_pins = list(data_pins)
+        self.units = units
+        self.board = board
+        self.data = RawArray('l', len(self.data_pins))   # the last 16 bit frame of each chip
+
+        # Initialize needed GPIO
+        GPIO.setmode(self.board)
+        GPIO.setup(self.cs_pins, GPIO.OUT)
+        GPIO.setup(self.clock_pins, GPIO.OUT)
+        GPIO.setup(self.data_pins, GPIO.IN)
+
+        # Pull chip selects high to make the chips inactive
+        GPIO.output(self.cs_pins, GPIO.HIGH)
+
+    def get(self):
+        '''Reads every chip and returns a list of their temperatures and a list of which ones have an open
+        thermocouple (bit D2). The temperature of an open thermocouple is not meaningful.'''
+        self.read()
+        temperatures = []
+        noConnections = []
+        for data_16 in self.data:
+            noConnections.append(no_connection(data_16))
+            temperatures.append(getattr(self, "to_" + self.units)(tc_temperature(data_16)))
+        return temperatures, noConnections
+
+    def read(self):
+        '''Reads 16 bits from every chip at once & stores them as integers in self.data.'''
+        bytesin = [0] * len(self.data_pins)
+        # Select every chip
+        GPIO.output(self.cs_pins, GPIO.LOW)
+        # Read in 16 bits from each
+        for i in range(16):
+            GPIO.output(self.clock_pins, GPIO.LOW)
+            clocks.sleep(0.001)
+            for c, data_pin in enumerate(self.data_pins):
+                bytesin[c] = bytesin[c] << 1
+                if (GPIO.input(data_pin)):
+                    bytesin[c] = bytesin[c] | 1
+            GPIO.output(self.clock_pins, GPIO.HIGH)
+        clocks.sleep(0.001)
+        # Unselect the chips
+        GPIO.output(self.cs_pins, GPIO.HIGH)
+        # Save data
+        self.data[:] = bytesin
+
+    def channel(self, index):
+        '''Returns a MAX6675 like object for a single chip that uses the frames read by this array.'''
+        return MAX6675ArrayChannel(self, index)
+
+    to_c = MAX6675.to_c
+    to_k = MAX6675.to_k
+    to_f = MAX6675.to_f
+
+    def cleanup(self):
+        '''Selective GPIO cleanup'''
+        GPIO.setup(self.cs_pins, GPIO.IN)
+        GPIO.setup(self.clock_pins, GPIO.IN)
+
+# One chip of a MAX6675Array
+# reading it doesn't touch the pins, it just takes the chip's frame from the last time the array was read
+class MAX6675ArrayChannel(MAX6675):
+    '''A single chip of a MAX6675Array with the same interface as MAX6675. read() uses the frame from the array's
+    last read, so the array has to be read (once for all of its channels) before the channels are.'''
+    def __init__(self, array, index):
+        self.array = array
+        self.index = index
+        self.units = array.units
+        self.data = None
+
+    def read(self):
+        '''Stores the chip's frame from the array's last read in self.data.'''
+        self.data = self.array.data[self.index]
+
+    def cleanup(self):
+        '''The pins belong to the array, so there is nothing to clean up.'''
+        pass
+
 class MAX6675Error(Exception):
      def __init__(self, value):
+         super().__init__(value)
          self.value = value
      def __str__(self):
          return repr(self.value)
\ No newline at end of file
@@ -0,0 +1,105 @@
+import numpy as np
+
+import constants
+
+# Estimates how fast each channel's temperature is changing as the least squares slope of its recent samples
+# Keeps running sums so each new sample costs the same no matter how long the window is, instead of
+# re-slicing the window and only looking at its first and last points every time
+class SlopeEstimator:
+    """
+    A streaming least squares slope (rate of change per second) for one or more channels that are sampled together.
+    Either uses each channel's last windowSize samples, or, if decay is given, weights every past sample by decay
+    raised to how many samples old it is. Each update is O(1) and works on all channels at once. A NaN sample (a
+    failed reading) is skipped: it doesn't take a place in its channel's window or age its channel's samples, so a
+    channel estimated along with others gets exactly the slope it would get on its own from only its readings.
+    """
+    def __init__(self, numChannels : int=1, windowSize : int=constants.RATE_WINDOW_SIZE, decay : float=None):
+        """
+        numChannels: how many channels are estimated together
+        windowSize: how many of the most recent samples the slope is fit to (ignored if decay is given)
+        decay: the exponential weighting factor between 0 and 1 (e.g. 0.95), None for a sliding window
+        """
+        self.numChannels = numChannels
+        self.windowSize = windowSize
+        self.decay = decay
+        self.count = np.zeros(numChannels, dtype=np.int64)  # how many samples each channel has had
+        self.t0 = np.zeros(numChannels)   # the sums are of times relative to this to keep them small
+        self.times = np.full((windowSize, numChannels), np.nan)
+        self.values = np.full((windowSize, numChannels), np.nan)
+        self.reset_sums()
+
+    def reset_sums(self) -> None:
+        # weight, time, value, time squared, and time times value sums for each channel
+        self.sw = np.zeros(self.numChannels)
+        self.st = np.zeros(self.numChannels)
+        self.sy = np.zeros(self.numChannels)
+        self.stt = np.zeros(self.numChannels)
+        self.sty = np.zeros(self.numChannels)
+
+    def add_to_sums(self, t : np.ndarray, y : np.ndarray, sign : float) -> None:
+        valid = ~np.isnan(y)
+        t = np.where(valid, t - self.t0, 0.0)
+        y = np.where(valid, y, 0.0)
+        self.sw += sign * valid
+        self.st += sign * t
+        self.sy += sign * y
+        self.stt += sign * t * t
+        self.sty += sign * t * y
+
+    def update(self, t : float, y : float | np.ndarray) -> None:
+        """
+        Adds a sample taken at time t (seconds) with a value for each channel (a float if there is only one), NaN
+        for a channel without a reading.
+        """
+        y = np.broadcast_to(np.asarray(y, dtype=np.float64), (self.numChannels,))
+        valid = ~np.isnan(y)
+        if self.decay is not None:
+            # move the valid channels' sums so they are relative to the new time, then age them by one sample
+            dt = np.where(valid, t - self.t0, 0.0)
+            self.stt += -2 * dt * self.st + dt * dt * self.sw
+            self.sty += -dt * self.sy
+            self.st += -dt * self.sw
+            self.t0[valid] = t
+            for s in (self.sw, self.st, self.sy, self.stt, self.sty):
+                s[valid] *= self.decay
+            self.add_to_sums(t, y, 1)
+            self.count[valid] += 1
+            return
+
+        channels = np.flatnonzero(valid)
+        i = self.count[channels] % self.windowSize  # where each valid channel's new sample goes in its window
+        oldTimes = np.full(self.numChannels, np.nan)
+        oldValues = np.full(self.numChannels, np.nan)
+        full = self.count[channels] >= self.windowSize
+        oldTimes[channels[full]] = self.times[i[full], channels[full]]
+        oldValues[channels[full]] = self.values[i[full], channels[full]]
+        self.add_to_sums(oldTimes, oldValues, -1)
+        self.times[i, channels] = t
+        self.values[i, channels] = y[channels]
+        self.add_to_sums(t, y, 1)
+        self.count[channels] += 1
+        # every time a channel's window has been replaced, recompute its sums exactly so rounding errors can't build up
+        replaced = channels[self.count[channels] % self.windowSize == 0]
+        if len(replaced) > 0:
+            self.t0[replaced] = t
+            windowValues = self.values[:, replaced]
+            windowValid = ~np.isnan(windowValues)
+            times = np.where(windowValid, self.times[:, replaced] - self.t0[replaced], 0.0)
+            values = np.where(windowValid, windowValues, 0.0)
+            self.sw[replaced] = column_sums(windowValid.astype(np.float64))
+            self.st[replaced] = column_sums(times)
+            self.sy[replaced] = column_sums(values)
+            self.stt[replaced] = column_sums(times * times)
+            self.sty[replaced] = column_sums(times * values)
+
+    def slope(self) -> np.ndarray:
+        """Returns the estimated rate of change per second of each channel (0 where there aren't 2 samples)."""
+        denominator = self.sw * self.stt - self.st * self.st
+        valid = (self.sw >= 2) & (denominator > 1e-12)
+        return np.where(valid, (self.sw * self.sty - self.st * self.sy) / np.where(valid, denominator, 1), 0.0)
+
+# Sums each column from top to bottom
+# numpy's sum adds a single column pairwise but several columns one row at a time, which round differently, so this
+# keeps a channel's sums (and slope) exactly the same whether it is estimated on its own or along with others
+def column_sums(a : np.ndarray) -> np.ndarray:
+    return np.add.accumulate(a, axis=0)[-1]
@@ -0,0 +1,121 @@
+from hardware import GPIO
+from collections import deque
+import bisect
+import threading
+
+import clocks
+import constants
+import funcs
+from bake_system import System
+
+# Runs the SSRs of all the systems for their duty cycles from a single timer thread
+# Instead of every system sleeping through its own period, every relay is turned on at the start of the period
+# and the switch off times are kept in a sorted list (like the DelayObject insertion sort in TempControllerPIDCode.ino)
+# so the thread only ever has to wait for the earliest one
+class RelayScheduler:
+    """
+    Time proportions every system's SSR from one background thread. schedule() is given the systems at the start of a
+    period and returns right away; the thread turns the relays on and then off again at their sorted deadlines. Systems
+    that are inoperable are never turned on. How late each switch happens is recorded so jitter can be measured.
+    With a virtual clock there is no thread, the switches are queued as callbacks on the clock instead.
+    """
+    def __init__(self, period : float=constants.SET_PERIOD, numJitterSamples : int=1000, clock : clocks.Clock=None):
+        """
+        period: the length of a full period in seconds, each duty cycle is a proportion of this
+        numJitterSamples: how many of the most recent switching delays to keep for jitter_stats
+        clock: the clock the period is timed with, the one in use (clocks.get_clock) if None
+        """
+        self.period = period
+        self.clock = clocks.get_clock() if clock is None else clock
+        self.generation = 0     # changes whenever the events are replaced, so old clock callbacks are ignored
+        self.events : list[tuple[float, int, int]] = []    # sorted (deadline, relay pin, GPIO level)
+        self.relays : set[int] = set()
+        self.switchDelays : deque[float] = deque(maxlen=numJitterSamples)
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self.running = True
+        if not self.clock.isVirtual:
+            self.thread.start()
+
+    def stop(self) -> None:
+        """Stops the timer thread and turns every relay off."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.all_off()
+
+    def schedule(self, systems : list[System]) -> float:
+        """
+        Starts a new period for the given systems, replacing whatever is left of the previous one. Each operable system
+        has its SSR turned on now and off after its computed duty cycle proportion of the period. Inoperable systems are
+        turned off now.
+
+        systems: the systems whose SSRs should be run this period
+
+        returns: the time (on the scheduler's clock) that the period ends
+        """
+        start = self.clock.now()
+        events = []
+        for system in systems:
+            self.relays.add(system.relay)
+            onTime = self.period * funcs.clamp(system.computedDutyCycle, 1.0, 0.0)
+            if system.operation_status == constants.OPERATION_STATUSES.INOPERABLE or onTime <= 0:
+                bisect.insort(events, (start, system.relay, GPIO.LOW))
+            else:
+                bisect.insort(events, (start, system.relay, GPIO.HIGH))
+                bisect.insort(events, (start + onTime, system.relay, GPIO.LOW))
+        with self.condition:
+            self.events = events
+            self.generation += 1
+            self.condition.notify()
+        if self.clock.isVirtual:
+            for deadline, relay, level in events:
+                self.clock.call_at(deadline, lambda g=self.generation, r=relay, l=level: self._switch(g, r, l))
+        return start + self.period
+
+    def all_off(self) -> None:
+        """Cancels anything scheduled and turns every relay that has been scheduled off immediately."""
+        with self.condition:
+            self.events = []
+            self.generation += 1
+            for relay in self.relays:
+                GPIO.output(relay, GPIO.LOW)
+            self.condition.notify()
+
+    def jitter_stats(self) -> dict[str, float]:
+        """
+        Returns statistics in seconds about how late the relays were switched compared to when they were scheduled:
+        the number of samples, the mean, the 95th percentile, and the maximum.
+        """
+        delays = sorted(self.switchDelays)
+        if len(delays) == 0:
+            return {"samples": 0, "mean": 0.0, "p95": 0.0, "max": 0.0}
+        return {"samples": len(delays), "mean": sum(delays) / len(delays),
+                "p95": delays[min(len(delays) - 1, int(0.95 * len(delays)))], "max": delays[-1]}
+
+    # the timer thread, waits for the earliest deadline and switches that relay
+    def _run(self) -> None:
+        with self.condition:
+            while self.running:
+                if len(self.events) == 0:
+                    self.condition.wait()
+                    continue
+                deadline, relay, level = self.events[0]
+                now = self.clock.now()
+                if now < deadline:
+                    self.condition.wait(deadline - now)
+                    continue    # the events may have been replaced while waiting
+                self.events.pop(0)
+                GPIO.output(relay, level)
+                self.switchDelays.append(now - deadline)
+
+    # a switch queued on a virtual clock, skipped if the events were replaced since it was queued
+    def _switch(self, generation : int, relay : int, level : int) -> None:
+        if generation == self.generation:
+            GPIO.output(relay, level)
+            self.switchDelays.append(0.0)
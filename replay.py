@@ -0,0 +1,378 @@
+import importlib.util
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+import types
+import numpy as np
+
+import analysis
+import autotune
+import clocks
+import constants
+import run_log
+from channels import Channel, load_channels, save_channels
+
+# Replaying bakes through the control logic, to see what a change to System.run would have done on past bakes
+# A recorded run is fed through the real System code one iteration at a time on a VirtualClock, either
+#   - as a trace: the recorded temperatures are what the systems read, at the recorded times. The temperatures can't
+#     react to the replayed duty cycles, so this shows when the stepping and safety checks would have fired on the
+#     same temperatures (and is exact for the code that ran the bake), or
+#   - through a plant: a first order plus dead time model of each tape is fit to the run (autotune.fit_fopdt) and the
+#     replayed duty cycles heat it, so the temperatures follow what the replayed code does.
+# Each iteration does what bake_controller.iterate does with the systems' results (all systems are made inoperable
+# when one is, and the SSRs of inoperable systems aren't run), without the workers, relay scheduler, or logger, so a
+# day of bake replays in seconds. The duty cycles, step temperatures, and statuses are kept like a run log, and what
+# the stepping and safety checks did as events, so two versions of the controller (bake_system.py from another git
+# revision, or an edited copy of it) can be diffed on the same input.
+# Run with: python replay.py run.bakelog [--plant] [--against HEAD] [--temp 150] [--rate 1] [--ki 1.5] [--output dir]
+
+# A temperature detector that reads whatever it is set to, the replayed readings
+class ReplayDetector:
+    """Returns temp from get, and raises MAX6675Error like a disconnected thermocouple if it is NaN."""
+    def __init__(self, error : type):
+        """
+        error: the MAX6675Error class to raise, the one the replayed controller catches
+        """
+        self.error = error
+        self.temp = float("nan")
+
+    def get(self) -> float:
+        if math.isnan(self.temp):
+            raise self.error("Thermocouple not connected")
+        return self.temp
+
+# Loads a version of bake_system.py to replay
+def load_controller(version : str=None) -> types.ModuleType:
+    """
+    Returns the bake_system module to replay: the one in this tree if version is None, otherwise the file at version
+    if it exists (an edited copy of bake_system.py), or else bake_system.py as of the git revision version. The version
+    is loaded against the rest of this tree (constants, funcs, hardware, ...), so it has to be compatible with it.
+    Raises ValueError if it can't be found or loaded.
+    """
+    if version is None:
+        import bake_system
+        return bake_system
+    name = "bake_system_replayed_{}".format(abs(hash(version)))
+    try:
+        if os.path.isfile(version):
+            spec = importlib.util.spec_from_file_location(name, version)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            return module
+        shown = subprocess.run(["git", "show", "{}:bake_system.py".format(version)], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+        if shown.returncode != 0:
+            raise ValueError("{} is neither a file nor a git revision: {}".format(version, shown.stderr.strip()))
+        module = types.ModuleType(name)
+        exec(compile(shown.stdout, "{}:bake_system.py".format(version), "exec"), module.__dict__)
+        return module
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError("bake_system.py from {} can't be run against this tree: {!r}".format(version, e))
+
+# What a replay did, laid out like a run log
+class ReplayResult:
+    """
+    times: the time elapsed of each iteration, in seconds
+    temps, dutyCycles, stepTemps, statuses: (iterations, channels), what each system read and decided each iteration
+    events: what the stepping and safety checks did, as dicts with the time, the system, and the event: "step" (a new
+    stepToTemp), "restep" (the LARGE_TEMP_DIFFERENCE check starting the stepping over), "reached" (stepped to the set
+    temperature), "status" (a new operation status), or "error" (an exception from System.run, with its cause)
+    label: which controller was replayed
+    wallTime: how long the replay took, in seconds
+    """
+    def __init__(self, times : np.ndarray, temps : np.ndarray, dutyCycles : np.ndarray, stepTemps : np.ndarray,
+                 statuses : np.ndarray, events : list[dict], label : str, wallTime : float):
+        self.times = times
+        self.temps = temps
+        self.dutyCycles = dutyCycles
+        self.stepTemps = stepTemps
+        self.statuses = statuses
+        self.events = events
+        self.label = label
+        self.wallTime = wallTime
+
+    @property
+    def speedup(self) -> float:
+        """How many times faster than real time the replay ran."""
+        return (self.times[-1] - self.times[0] + constants.SET_PERIOD) / self.wallTime
+
+    def trips(self) -> np.ndarray:
+        """The number of times each system was put on hold or made inoperable by the safety checks."""
+        trips = np.zeros(self.temps.shape[1], dtype=np.int64)
+        for event in self.events:
+            if event["event"] == "status" and event["status"] != constants.OPERATION_STATUSES.OPERABLE.name:
+                trips[event["system"]] += 1
+        return trips
+
+    def save(self, baseName : str, channels : list[Channel]=None) -> None:
+        """
+        Writes the replay as a run log (baseName.bakelog, which analysis.load_run and autotune read) and its events as
+        json lines next to it, with a copy of the channel definitions if given.
+        """
+        folder = os.path.dirname(baseName)
+        if folder != "" and not os.path.exists(folder):
+            os.makedirs(folder)
+        numChannels = self.temps.shape[1]
+        records = np.zeros(len(self.times), dtype=run_log.record_dtype(numChannels))
+        records["time"] = self.times
+        records["temp"] = self.temps
+        records["duty"] = self.dutyCycles
+        records["step"] = self.stepTemps
+        records["status"] = self.statuses
+        with open(baseName + run_log.FILE_EXTENSION, "wb") as file:
+            file.write(run_log.make_header(numChannels, 0))
+            file.write(records.tobytes())
+        with open(baseName + constants.EVENT_LOG_EXTENSION, "w") as file:
+            for event in self.events:
+                file.write(json.dumps(event) + "\n")
+        if channels is not None:
+            save_channels(channels, baseName + constants.CHANNELS_COPY_EXTENSION)
+
+def replay(controller : types.ModuleType, setValues : list[dict], times : np.ndarray, read : callable,
+           heat : callable=None, label : str="current") -> ReplayResult:
+    """
+    Runs the controller's Systems for an iteration at each of the times (seconds elapsed), on a VirtualClock that is
+    at each time as its iteration runs.
+
+    controller: the bake_system module to run (see load_controller)
+    setValues: the keyword arguments of each channel's System (startSetTemp, startSetRate, startSetKi)
+    read: called with the iteration number, returns the reading of every channel (NaN for a failed reading)
+    heat: if given, called after each iteration with the duty cycle each channel's SSR is run at for the next period
+    label: what to call the controller in the result
+    """
+    inoperable = constants.OPERATION_STATUSES.INOPERABLE
+    numChannels = len(setValues)
+    numIterations = len(times)
+    periods = np.diff(times, prepend=0.0)   # like iterate, the first period is from the start of the bake
+    temps = np.full((numIterations, numChannels), np.nan)
+    dutyCycles = np.zeros((numIterations, numChannels))
+    stepTemps = np.zeros((numIterations, numChannels))
+    statuses = np.zeros((numIterations, numChannels), dtype=np.uint8)
+    events = []
+
+    previousClock = clocks.get_clock()
+    clock = clocks.VirtualClock()
+    clocks.set_clock(clock)
+    systems = [controller.System(i, i, **values) for i, values in enumerate(setValues)]
+    detectors = [ReplayDetector(controller.MAX6675Error) for _ in systems]
+    start = time.perf_counter()
+    try:
+        for iterationNum in range(numIterations):
+            timeElapsed = float(times[iterationNum])
+            clock.run_until(timeElapsed)
+            readings = read(iterationNum)
+            previousStatuses = [system.operation_status for system in systems]
+            anyInoperable = False
+            for system, detector, reading in zip(systems, detectors, readings):
+                detector.temp = float(reading)
+                stepToTemp, numStepsTaken, hasSteppedToDesired = (system.stepToTemp, system.numStepsTaken,
+                                                                  system.hasSteppedToDesired)
+                _, errList = system.run(iterationNum, timeElapsed, detector, float(periods[iterationNum]))
+                if numStepsTaken > 0 and system.numStepsTaken == 0:
+                    events.append({"time": timeElapsed, "system": system.id, "event": "restep"})
+                if system.stepToTemp != stepToTemp:
+                    events.append({"time": timeElapsed, "system": system.id, "event": "step",
+                                   "stepTo": float(system.stepToTemp)})
+                if system.hasSteppedToDesired and not hasSteppedToDesired:
+                    events.append({"time": timeElapsed, "system": system.id, "event": "reached"})
+                for e in errList:
+                    events.append({"time": timeElapsed, "system": system.id, "event": "error",
+                                   "error": type(e).__name__, "cause": str(e.cause)})
+                    anyInoperable = anyInoperable or type(e).__name__ == "SystemInoperableError"
+            # what iterate does with the results
+            if anyInoperable:
+                for system in systems:
+                    system.operation_status = inoperable
+            for i, system in enumerate(systems):
+                if system.operation_status != previousStatuses[i]:
+                    events.append({"time": timeElapsed, "system": i, "event": "status",
+                                   "status": constants.OPERATION_STATUSES(system.operation_status).name})
+                temps[iterationNum, i] = readings[i]
+                dutyCycles[iterationNum, i] = system.computedDutyCycle
+                stepTemps[iterationNum, i] = system.stepToTemp
+                statuses[iterationNum, i] = int(system.operation_status)
+            if heat is not None:
+                heat(np.where(statuses[iterationNum] == int(inoperable), 0, dutyCycles[iterationNum]))
+    finally:
+        clocks.set_clock(previousClock)
+        for system in systems:
+            if hasattr(system.storedTemps, "close"):
+                system.storedTemps.close()
+    return ReplayResult(np.asarray(times, dtype=np.float64), temps, dutyCycles, stepTemps, statuses, events, label,
+                        time.perf_counter() - start)
+
+def replay_trace(run : analysis.RunData, setValues : list[dict], controller : types.ModuleType,
+                 label : str="current") -> ReplayResult:
+    """
+    Replays the run's recorded temperatures at its recorded times. A missing temperature (not stored that iteration,
+    or masked out) is read as the channel's last one, since the real loop stops at a failed reading and so never
+    logged one to replay.
+    """
+    temps = run.temps.astype(np.float64)
+    for channel in range(temps.shape[1]):
+        valid = np.flatnonzero(~np.isnan(temps[:, channel]))
+        if len(valid) == 0:
+            raise ValueError("channel {} has no temperatures to replay".format(channel + 1))
+        last = np.maximum.accumulate(np.where(np.isnan(temps[:, channel]), 0, np.arange(len(temps))))
+        temps[:, channel] = temps[np.maximum(last, valid[0]), channel]
+    return replay(controller, setValues, run.times.astype(np.float64), lambda i: temps[i], label=label)
+
+def calibrate(run : analysis.RunData) -> autotune.FopdtFit:
+    """
+    Fits a first order plus dead time model to each channel of a run with duty cycles (see autotune). Raises
+    ValueError if the run has no duty cycles or a channel can't be fit.
+    """
+    if run.dutyCycles is None:
+        raise ValueError("{} has no duty cycles to fit the plant to".format(run.fileName))
+    temps, duties = autotune.resample(run, constants.AUTOTUNE_SAMPLE_INTERVAL)
+    fit = autotune.fit_fopdt(temps.T, duties.T)
+    if not np.all(fit.valid()):
+        raise ValueError("channels {} of {} can't be fit, the heater has to have been switched".format(
+            ", ".join(str(i + 1) for i in np.flatnonzero(~fit.valid())), run.fileName))
+    return fit
+
+def replay_plant(fit : autotune.FopdtFit, startTemps : np.ndarray, seconds : float, setValues : list[dict],
+                 controller : types.ModuleType, label : str="current") -> ReplayResult:
+    """
+    Replays a bake of the given length on the tapes of fit (see autotune.FopdtPlant), starting at startTemps, with an
+    iteration every SET_PERIOD from the end of the startup time like the control loop on a VirtualClock.
+    """
+    plant = autotune.FopdtPlant(fit, startTemps)
+    times = constants.TOTAL_STARTUP_TIME + np.arange(int(seconds / constants.SET_PERIOD)) * constants.SET_PERIOD
+    return replay(controller, setValues, times, lambda i: plant.readings(), plant.step, label)
+
+# Compares two replays of the same input
+def diff_replays(a : ReplayResult, b : ReplayResult, tolerance : float=1e-9) -> list[dict]:
+    """
+    Returns for each channel how much the duty cycles differ ("maxDutyDifference", "meanDutyDifference"), the first
+    time the duty cycle, step temperature, or status differ by more than tolerance ("firstDifference", None if never),
+    the events only one of them has ("onlyA", "onlyB"), and the number of safety trips in each ("tripsA", "tripsB").
+    """
+    if len(a.times) != len(b.times) or not np.array_equal(a.times, b.times):
+        raise ValueError("the replays are of different inputs")
+    differences = []
+    tripsA, tripsB = a.trips(), b.trips()
+    for channel in range(a.temps.shape[1]):
+        dutyDifference = np.abs(a.dutyCycles[:, channel] - b.dutyCycles[:, channel])
+        differs = ((dutyDifference > tolerance) | (a.stepTemps[:, channel] != b.stepTemps[:, channel])
+                   | (a.statuses[:, channel] != b.statuses[:, channel]))
+        eventsA = [event for event in a.events if event["system"] == channel]
+        eventsB = [event for event in b.events if event["system"] == channel]
+        differences.append({"maxDutyDifference": float(dutyDifference.max()),
+                            "meanDutyDifference": float(dutyDifference.mean()),
+                            "firstDifference": float(a.times[np.argmax(differs)]) if np.any(differs) else None,
+                            "onlyA": [event for event in eventsA if event not in eventsB],
+                            "onlyB": [event for event in eventsB if event not in eventsA],
+                            "tripsA": int(tripsA[channel]), "tripsB": int(tripsB[channel])})
+    return differences
+
+def set_values_for(channels : list[Channel], temps : list[float], rates : list[float],
+                   kis : list[float]) -> list[dict]:
+    """
+    The System keyword arguments of each channel: its initial set values from the channel definitions, replaced by
+    the given temps, rates, and kis (one value for every channel, or one per channel, empty to keep them).
+    """
+    setValues = []
+    for i, channel in enumerate(channels):
+        values = channel.system_arguments()
+        values.pop("name", None)
+        for key, given in (("startSetTemp", temps), ("startSetRate", rates), ("startSetKi", kis)):
+            if len(given) > 0:
+                values[key] = given[i] if len(given) == len(channels) else given[0]
+        setValues.append(values)
+    return setValues
+
+def print_summary(result : ReplayResult, names : list[str]) -> None:
+    print("{}: {} iterations ({:.1f} h) in {:.2f} s, {:.0f} times real time".format(
+        result.label, len(result.times), (result.times[-1] - result.times[0]) / 3600, result.wallTime,
+        result.speedup))
+    trips = result.trips()
+    for i, name in enumerate(names):
+        counts = {kind: sum(1 for event in result.events if event["system"] == i and event["event"] == kind)
+                  for kind in ("step", "restep", "reached")}
+        print("  {:>16}: mean duty cycle {:.3f}, {} steps, {} restarts of the stepping, {} safety trips{}".format(
+            name, result.dutyCycles[:, i].mean(), counts["step"], counts["restep"], trips[i],
+            ", stepped to the set temperature" if counts["reached"] > 0 else ""))
+
+def print_diff(differences : list[dict], names : list[str], labelA : str, labelB : str, maxEvents : int=5) -> None:
+    print("{} against {}:".format(labelB, labelA))
+    for name, difference in zip(names, differences):
+        if difference["firstDifference"] is None and len(difference["onlyA"]) + len(difference["onlyB"]) == 0:
+            print("  {:>16}: identical".format(name))
+            continue
+        print("  {:>16}: first differs at {:.0f} s, duty cycles differ by {:.3f} at most ({:.4f} on average), "
+              "safety trips {} -> {}".format(name, difference["firstDifference"], difference["maxDutyDifference"],
+                                             difference["meanDutyDifference"], difference["tripsA"],
+                                             difference["tripsB"]))
+        for side, label in (("onlyA", labelA), ("onlyB", labelB)):
+            events = difference[side]
+            if len(events) > 0:
+                print("    only {} ({} events): {}{}".format(label, len(events), ", ".join(
+                    "{} at {:.0f} s".format(event.get("stepTo", event.get("status", event["event"])), event["time"])
+                    for event in events[:maxEvents]), ", ..." if len(events) > maxEvents else ""))
+
+if __name__ == "__main__":
+    import argparse
+    # the replayed systems set up their relay pins, which only fake_gpio lets them do off the pi
+    constants.HARDWARE_BACKEND = "sim"
+    import instrumentation
+    parser = argparse.ArgumentParser()
+    parser.add_argument("run", help="the run to replay, a run log or a csv")
+    parser.add_argument("--plant", action="store_true",
+                        help="replay through a model of the tapes fit to the run instead of the recorded temperatures")
+    parser.add_argument("--seconds", type=float, help="how long a bake to replay with --plant, the run's if not given")
+    parser.add_argument("--controller", help="the bake_system.py to replay (a file or a git revision), this tree's "
+                                             "if not given")
+    parser.add_argument("--against", help="also replay this bake_system.py (a file or a git revision) and diff them")
+    parser.add_argument("--temp", type=float, nargs="+", default=[], help="the set temperatures, one or per channel")
+    parser.add_argument("--rate", type=float, nargs="+", default=[], help="the set rates, one or per channel")
+    parser.add_argument("--ki", type=float, nargs="+", default=[], help="the kis, one or per channel")
+    parser.add_argument("--duty-columns", type=int, nargs="+", help="the duty cycle columns of a csv run")
+    parser.add_argument("--output", help="save each replay as a run log with its events in this folder")
+    args = parser.parse_args()
+    instrumentation.configure(constants.VERBOSITY.OFF)
+
+    try:
+        run = analysis.load_run(args.run, args.duty_columns)
+        copyName = os.path.splitext(args.run)[0] + constants.CHANNELS_COPY_EXTENSION
+        channels = (load_channels(copyName) if os.path.exists(copyName)
+                    else [Channel(None, i, i, 0, 0) for i in range(run.numChannels)])
+        if len(channels) != run.numChannels:
+            raise ValueError("{} has {} channels but the run has {}".format(copyName, len(channels), run.numChannels))
+        setValues = set_values_for(channels, args.temp, args.rate, args.ki)
+        controllers = [(args.controller, load_controller(args.controller))]
+        if args.against is not None:
+            controllers.append((args.against, load_controller(args.against)))
+        if args.plant:
+            fit = calibrate(run)
+            firstValid = np.argmax(~np.isnan(run.temps), axis=0)
+            startTemps = run.temps[firstValid, np.arange(run.numChannels)]
+            seconds = args.seconds if args.seconds is not None else run.times[-1] - run.times[0]
+    except (ValueError, OSError) as e:
+        sys.exit(str(e))
+
+    names = autotune.channel_names(args.run, run.numChannels)
+    if args.plant:
+        for i, name in enumerate(names):
+            print("{}: tau {:.1f} min, gain {:.1f} C, ambient {:.1f} C, dead time {:.0f} s, r2 {:.3f}".format(
+                name, fit.tau[i] / 60, fit.gain[i], fit.ambient[i], fit.deadTime[i], fit.r2[i]))
+    results = []
+    for version, controller in controllers:
+        label = "this tree" if version is None else version
+        if args.plant:
+            result = replay_plant(fit, startTemps, seconds, setValues, controller, label)
+        else:
+            result = replay_trace(run, setValues, controller, label)
+        print_summary(result, names)
+        if args.output is not None:
+            result.save(os.path.join(args.output, "{}.{}".format(
+                os.path.splitext(os.path.basename(args.run))[0],
+                "".join(c if c.isalnum() else "_" for c in label))), channels)
+        results.append(result)
+    if len(results) == 2:
+        print_diff(diff_replays(*results), names, results[0].label, results[1].label)
@@ -0,0 +1,96 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+# A fixed size history of floats where appending overwrites the oldest value
+# Every value is written twice, once in each half of an array twice the size, so the last n values are always
+# next to each other somewhere in it and any window can be returned as a view without copying
+class RingBuffer:
+    """
+    A fixed size ring buffer of floats backed by a numpy array. Empty slots hold NaN. Values are added with append(),
+    and window(n) returns the last n values (oldest first) as a contiguous view in O(1) without allocating, even when
+    they wrap around the end of the buffer.
+    """
+    def __init__(self, size : int):
+        """
+        size: the number of values the buffer holds
+        """
+        self._use_storage(size, np.full(2 * size, np.nan), np.zeros(1, dtype=np.int64))
+
+    def _use_storage(self, size : int, mirrored : np.ndarray, count : np.ndarray) -> None:
+        self.size = size
+        self.mirrored = mirrored    # 2 * size values, index i and i + size always hold the same value
+        self.count = count          # count[0] is how many values have ever been appended
+
+    def append(self, value : float) -> None:
+        """Adds a value, overwriting the oldest one if the buffer is full. None is stored as NaN."""
+        value = np.nan if value is None else value
+        i = int(self.count[0] % self.size)
+        self.mirrored[i] = value
+        self.mirrored[i + self.size] = value
+        self.count[0] += 1  # only counted once the value is written, so readers never see a half added value
+
+    def latest(self) -> float:
+        """Returns the most recently appended value, NaN if nothing has been appended."""
+        if self.count[0] == 0:
+            return np.nan
+        return self.mirrored[(self.count[0] - 1) % self.size]
+
+    def window(self, n : int) -> np.ndarray:
+        """
+        Returns a read only view of the last n values, oldest first. If fewer than n values have been appended the
+        window is shorter.
+        """
+        count = int(self.count[0])
+        n = max(0, min(n, count, self.size))
+        end = (count - 1) % self.size + 1 + self.size    # the newest value's copy in the second half
+        view = self.mirrored[end - n : end]
+        view.flags.writeable = False
+        return view
+
+    def __len__(self) -> int:
+        return int(min(self.count[0], self.size))
+
+    def __iter__(self):
+        return iter(self.window(self.size))
+
+# A ring buffer that lives in shared memory
+# The worker processes append their temperatures straight into it and the UI and file writer in the main
+# process read from it, so the stored history never has to be pickled and sent between processes
+class SharedRingBuffer(RingBuffer):
+    """
+    A RingBuffer backed by multiprocessing.shared_memory, including its count, so values appended in one process are
+    seen by every other. When pickled only the name of the shared memory block is sent, and unpickling attaches to
+    the same block.
+    """
+    def __init__(self, size : int, name : str=None):
+        """
+        size: the number of values the buffer holds
+        name: the name of an existing shared memory block to attach to. If None a new block is created, and this
+        object becomes responsible for freeing it with close.
+        """
+        self.owner = name is None
+        itemsize = np.dtype(np.float64).itemsize
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=(2 * size + 1) * itemsize)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        count = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        mirrored = np.ndarray((2 * size,), dtype=np.float64, buffer=self.shm.buf, offset=itemsize)
+        if self.owner:
+            count[0] = 0
+            mirrored[:] = np.nan
+        self._use_storage(size, mirrored, count)
+
+    def __getstate__(self) -> dict:
+        return {"size": self.size, "name": self.shm.name}
+
+    def __setstate__(self, state : dict) -> None:
+        self.__init__(state["size"], state["name"])
+
+    def close(self) -> None:
+        """Detaches from the shared memory block and frees it if this object created it."""
+        self.mirrored = None
+        self.count = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
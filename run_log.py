@@ -0,0 +1,111 @@
+import json
+import numpy as np
+
+# A compact binary format for the data saved every iteration
+# The file is a fixed size header (describing the records) followed by fixed width records, one per iteration,
+# so it can be loaded with numpy.memmap instead of being parsed line by line like the csv files
+
+MAGIC = b"BAKELOG1"
+HEADER_SIZE = 512   # bytes, the header is padded to this size so the records always start at the same offset
+VERSION = 2         # version 1 headers didn't describe the shapes of the record fields
+FILE_EXTENSION = ".bakelog"
+
+def record_dtype(numChannels : int) -> np.dtype:
+    """
+    Returns the numpy dtype of a single record for the given number of channels: the time elapsed, then each channel's
+    temperature, duty cycle, step temperature, and operation status. Missing values are NaN.
+    """
+    return np.dtype([("time", "<f8"), ("temp", "<f4", (numChannels,)), ("duty", "<f4", (numChannels,)),
+                     ("step", "<f4", (numChannels,)), ("status", "u1", (numChannels,))])
+
+def make_header(numChannels : int, startTime : float) -> bytes:
+    """
+    Returns the header of a run log with the given number of channels. startTime is when the run started (seconds
+    since the epoch). The header holds the magic bytes followed by the schema as json, padded to HEADER_SIZE. The
+    schema's record is the record dtype's descr: each field's name, base dtype, and shape.
+    """
+    schema = {"version": VERSION, "channels": numChannels, "start_time": startTime,
+              "record": record_dtype(numChannels).descr}
+    return (MAGIC + json.dumps(schema).encode("utf-8")).ljust(HEADER_SIZE, b"\0")
+
+def schema_dtype(header : dict) -> np.dtype:
+    """
+    Returns the record dtype described by a run log's header. Raises ValueError if it isn't the layout record_dtype
+    gives for the header's number of channels, which is what the rest of the program reads.
+    """
+    expected = record_dtype(header["channels"])
+    if header.get("version", 1) < 2:
+        return expected  # older headers only have the fields' names
+    try:
+        dtype = np.dtype([tuple(field[:2]) + tuple(tuple(shape) for shape in field[2:]) for field in header["record"]])
+    except (TypeError, ValueError) as e:
+        raise ValueError("The run log's record schema can't be read: {}".format(e))
+    if dtype != expected:
+        raise ValueError("The run log's records are {}, expected {}".format(dtype, expected))
+    return dtype
+
+def read_header(fileName : str) -> dict:
+    """Returns the schema stored in a run log's header. Raises ValueError if the file is not a run log."""
+    with open(fileName, "rb") as file:
+        header = file.read(HEADER_SIZE)
+    if not header.startswith(MAGIC) or len(header) < HEADER_SIZE:
+        raise ValueError("{} is not a run log".format(fileName))
+    return json.loads(header[len(MAGIC):].rstrip(b"\0").decode("utf-8"))
+
+def load_run_log(fileName : str) -> tuple[dict, np.memmap]:
+    """
+    Maps a run log into memory without parsing it. Returns the header and a read only structured array with one
+    record per iteration (fields time, temp, duty, step, status). A partly written last record is left out. Raises
+    ValueError if the header's schema doesn't match the records this program writes.
+    """
+    header = read_header(fileName)
+    dtype = schema_dtype(header)
+    with open(fileName, "rb") as file:
+        file.seek(0, 2)
+        numRecords = (file.tell() - HEADER_SIZE) // dtype.itemsize
+    if numRecords == 0:
+        return header, np.zeros(0, dtype=dtype)
+    return header, np.memmap(fileName, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(numRecords,))
+
+def export_csv(fileName : str, csvFileName : str) -> None:
+    """
+    Converts a run log to the csv layout written by the program: one line per iteration with the time elapsed
+    followed by each channel's temperature (nan where there was no reading).
+    """
+    _, records = load_run_log(fileName)
+    columns = np.column_stack((records["time"], records["temp"].astype(np.float64)))
+    np.savetxt(csvFileName, columns, fmt="%.10g", delimiter=",")
+
+# The row formats used by the DataLogger
+# a row is (time elapsed, temperatures, duty cycles, step temperatures, operation statuses) with one value per channel
+class CsvRowFormat:
+    """Writes rows as lines of the time followed by each channel's temperature."""
+    mode = "a+"
+
+    def header(self) -> str:
+        return ""
+
+    def format(self, rows : list[tuple]) -> str:
+        return "".join(",".join("{}".format(value) for value in (row[0], *row[1])) + "\n" for row in rows)
+
+class BinaryRowFormat:
+    """Writes rows as run log records, with the run log header at the start of the file."""
+    mode = "ab"
+
+    def __init__(self, numChannels : int, startTime : float):
+        """
+        numChannels: how many channels each row has
+        startTime: when the run started, in seconds since the epoch
+        """
+        self.numChannels = numChannels
+        self.startTime = startTime
+        self.dtype = record_dtype(numChannels)
+
+    def header(self) -> bytes:
+        return make_header(self.numChannels, self.startTime)
+
+    def format(self, rows : list[tuple]) -> bytes:
+        records = np.empty(len(rows), dtype=self.dtype)
+        for i, (timeElapsed, temps, dutyCycles, stepTemps, statuses) in enumerate(rows):
+            records[i] = (timeElapsed, temps, dutyCycles, stepTemps, statuses)
+        return records.tobytes()
@@ -0,0 +1,220 @@
+import csv
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+import analysis
+import autotune
+import constants
+import instrumentation
+import replay
+
+# Searching the controller's parameters with simulated bakes, run in parallel on every core
+# Each configuration sets the ki and rate of every tape and the constants of the control logic (KP, KD,
+# KI_SCALING_FACTOR, LARGE_TEMP_DIFFERENCE), and is a bake from the ambient temperature up to the target run through the
+# real System code on a model of the tapes (replay.replay_plant), long enough for the ramp and AUTOTUNE_SETTLE_TIME
+# after it. The configurations are a grid of the given values, or drawn at random between the lowest and highest of
+# them. The constants are read by System.run every iteration, so each worker process sets them before each bake.
+# Every tape's metrics are appended to a csv as soon as its configuration finishes, and running the same sweep again
+# with the same results file skips the configurations already in it, so a sweep that was stopped carries on.
+# Run with: python sweep.py results.csv [--ki 1.5 3 6] [--rate 0.5 1] [--kp 0] [--kd 0] [--ki-scaling-factor 0.01]
+#                                       [--large-temp-difference 3] [--random 1000] [--run run.bakelog] [--target 150]
+
+# the parameters a configuration sets, as (name, flag, default): the ki and desiredRate of every System and constants
+PARAMETERS = (("ki", "--ki", 1.5), ("desiredRate", "--rate", 1.0), ("KP", "--kp", constants.KP),
+              ("KD", "--kd", constants.KD), ("KI_SCALING_FACTOR", "--ki-scaling-factor", constants.KI_SCALING_FACTOR),
+              ("LARGE_TEMP_DIFFERENCE", "--large-temp-difference", constants.LARGE_TEMP_DIFFERENCE))
+CONSTANT_PARAMETERS = ("KP", "KD", "KI_SCALING_FACTOR", "LARGE_TEMP_DIFFERENCE")
+METRICS = ("timeToSetpoint", "settling", "overshoot", "iae", "trips", "meanDuty")
+COLUMNS = tuple(name for name, _, _ in PARAMETERS) + ("tape",) + METRICS
+
+def grid(values : dict[str, list[float]]) -> list[dict]:
+    """Every combination of the values of each parameter."""
+    names = [name for name, _, _ in PARAMETERS]
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+def random_configurations(values : dict[str, list[float]], numConfigurations : int, seed : int=0) -> list[dict]:
+    """
+    numConfigurations drawn uniformly between the lowest and highest value of each parameter, or log uniformly if
+    they are both positive and a factor of 10 or more apart (like ki). The same seed gives the same configurations.
+    """
+    rng = np.random.default_rng(seed)
+    configurations = [{} for _ in range(numConfigurations)]
+    for name, _, _ in PARAMETERS:
+        lo, hi = min(values[name]), max(values[name])
+        if lo > 0 and hi >= 10 * lo:
+            drawn = np.exp(rng.uniform(np.log(lo), np.log(hi), numConfigurations))
+        else:
+            drawn = rng.uniform(lo, hi, numConfigurations)
+        for configuration, value in zip(configurations, drawn):
+            configuration[name] = float(value)
+    return configurations
+
+def key(configuration : dict) -> tuple[float, ...]:
+    """What identifies a configuration in the results file."""
+    return tuple(float(configuration[name]) for name, _, _ in PARAMETERS)
+
+def bake_metrics(result : replay.ReplayResult, startTemps : np.ndarray, targetTemp : float,
+                 rate : float, settleBand : float=constants.AUTOTUNE_SETTLE_BAND) -> dict[str, np.ndarray]:
+    """
+    The metrics of each tape of a simulated bake up to targetTemp (NaN for times it never got to):
+      timeToSetpoint: the seconds until it first got within settleBand of targetTemp
+      settling: the seconds until it stayed within settleBand of targetTemp
+      overshoot: the most it went over targetTemp
+      iae: the integral of the absolute difference from the ideal ramp (from its start temperature at rate up to
+      targetTemp), in degree minutes
+      trips: how many times the safety checks put it on hold or made it inoperable
+      meanDuty: its mean duty cycle
+    """
+    elapsed = result.times - result.times[0] + constants.SET_PERIOD
+    temps = result.temps
+    ramp = np.minimum(startTemps + rate * elapsed[:, None] / 60, targetTemp)
+    periods = np.diff(result.times, prepend=result.times[0] - constants.SET_PERIOD)
+    near = np.abs(temps - targetTemp) <= settleBand
+    reached = near.any(axis=0)
+    lastOutside = len(elapsed) - 1 - np.argmax(~near[::-1], axis=0)
+    settled = near[-1] & ~near.all(axis=0)
+    firstInside = np.minimum(lastOutside + 1, len(elapsed) - 1)  # the sample after the last one outside the band
+    return {"timeToSetpoint": np.where(reached, elapsed[np.argmax(near, axis=0)], np.nan),
+            "settling": np.where(near.all(axis=0), elapsed[0], np.where(settled, elapsed[firstInside], np.nan)),
+            "overshoot": np.max(temps - targetTemp, axis=0),
+            "iae": np.sum(np.abs(temps - ramp) * periods[:, None], axis=0) / 60,
+            "trips": result.trips(),
+            "meanDuty": result.dutyCycles.mean(axis=0)}
+
+def run_configuration(configuration : dict, fit : autotune.FopdtFit, startTemps : np.ndarray, targetTemp : float,
+                      settleTime : float=constants.AUTOTUNE_SETTLE_TIME) -> tuple[dict, dict[str, np.ndarray]]:
+    """
+    Simulates a bake of every tape of fit with the configuration (in a worker process). Returns the configuration and
+    the metrics of each tape (see bake_metrics).
+    """
+    for name in CONSTANT_PARAMETERS:
+        setattr(constants, name, configuration[name])
+    rate = configuration["desiredRate"]
+    setValues = [{"startSetTemp": targetTemp, "startSetRate": rate, "startSetKi": configuration["ki"]}
+                 for _ in startTemps]
+    seconds = max(0, np.max(targetTemp - startTemps)) / rate * 60 + settleTime
+    result = replay.replay_plant(fit, startTemps, seconds, setValues, replay.load_controller())
+    return configuration, bake_metrics(result, startTemps, targetTemp, rate)
+
+def start_worker() -> None:
+    """Sets up a worker process: the simulated hardware for the Systems' relay pins, and no instrumentation."""
+    constants.HARDWARE_BACKEND = "sim"
+    instrumentation.configure(constants.VERBOSITY.OFF)
+
+def read_results(fileName : str) -> list[dict]:
+    """
+    Returns the rows of a results file as dicts of floats (and the tape's name), leaving out a partly written last
+    row, which is also cut off the file so new rows can be appended after the complete ones.
+    """
+    if not os.path.exists(fileName):
+        return []
+    with open(fileName, "rb+") as file:
+        contents = file.read()
+        if not contents.endswith(b"\n"):
+            file.truncate(contents.rfind(b"\n") + 1)
+    rows = []
+    with open(fileName, newline="") as file:
+        for row in csv.DictReader(file):
+            try:
+                rows.append({column: row[column] if column == "tape" else float(row[column]) for column in COLUMNS})
+            except (KeyError, TypeError, ValueError):
+                continue
+    return rows
+
+def run_sweep(configurations : list[dict], fit : autotune.FopdtFit, startTemps : np.ndarray, names : list[str],
+              targetTemp : float, resultsFileName : str, numWorkers : int=None,
+              settleTime : float=constants.AUTOTUNE_SETTLE_TIME) -> list[dict]:
+    """
+    Runs every configuration not already in the results file on numWorkers processes (one per core if None), appending
+    a row per tape to the file as each finishes. Returns every row of the file.
+    """
+    done = {key(row) for row in read_results(resultsFileName)}
+    todo = [configuration for configuration in configurations if key(configuration) not in done]
+    print("{} configurations, {} already done, running {} on {} processes".format(
+        len(configurations), len(configurations) - len(todo), len(todo), numWorkers or os.cpu_count()))
+    writeHeader = not os.path.exists(resultsFileName) or os.path.getsize(resultsFileName) == 0
+    start = time.perf_counter()
+    with open(resultsFileName, "a", newline="") as file, \
+         ProcessPoolExecutor(max_workers=numWorkers, initializer=start_worker) as executor:
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        if writeHeader:
+            writer.writeheader()
+        futures = [executor.submit(run_configuration, configuration, fit, startTemps, targetTemp, settleTime)
+                   for configuration in todo]
+        for numDone, future in enumerate(as_completed(futures), 1):
+            configuration, metrics = future.result()
+            for tape, name in enumerate(names):
+                writer.writerow({**configuration, "tape": name,
+                                 **{metric: float(metrics[metric][tape]) for metric in METRICS}})
+            file.flush()    # every finished configuration is kept if the sweep is stopped
+            if numDone % max(1, len(todo) // 20) == 0 or numDone == len(todo):
+                elapsed = time.perf_counter() - start
+                print("{}/{} configurations in {:.0f} s ({:.1f} per minute)".format(numDone, len(todo), elapsed,
+                                                                                   numDone / elapsed * 60))
+    return read_results(resultsFileName)
+
+def best_configurations(rows : list[dict], numBest : int=10,
+                        maxOvershoot : float=constants.AUTOTUNE_MAX_OVERSHOOT) -> list[tuple[tuple, float, float]]:
+    """
+    The configurations whose tapes all settled without tripping a safety check or overshooting by maxOvershoot, as
+    (key, the latest settling of its tapes, its total iae), soonest settling first.
+    """
+    byConfiguration : dict[tuple, list[dict]] = {}
+    for row in rows:
+        byConfiguration.setdefault(key(row), []).append(row)
+    acceptable = [(configuration, max(row["settling"] for row in tapes), sum(row["iae"] for row in tapes))
+                  for configuration, tapes in byConfiguration.items()
+                  if all(row["trips"] == 0 and row["overshoot"] < maxOvershoot and not np.isnan(row["settling"])
+                         for row in tapes)]
+    return sorted(acceptable, key=lambda best: (best[1], best[2]))[:numBest]
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("results", help="the csv the results are appended to, and read from to resume")
+    for name, flag, default in PARAMETERS:
+        parser.add_argument(flag, dest=name, type=float, nargs="+", default=[default],
+                            help="the {} values to try (default {})".format(name, default))
+    parser.add_argument("--random", type=int, help="draw this many configurations between the lowest and highest "
+                                                   "values given instead of trying every combination")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the random configurations")
+    parser.add_argument("--target", type=float, default=150, help="the set temperature of the bakes")
+    parser.add_argument("--run", help="fit the tapes to this run (see replay.calibrate) instead of using the "
+                                      "simulated tape")
+    parser.add_argument("--duty-columns", type=int, nargs="+", help="the duty cycle columns of a csv run")
+    parser.add_argument("--dead-time", type=float, default=0, help="the dead time of the simulated tape, in seconds")
+    parser.add_argument("--settle-time", type=float, default=constants.AUTOTUNE_SETTLE_TIME,
+                        help="how long each bake runs after its ramp, in seconds")
+    parser.add_argument("--workers", type=int, help="how many processes to run, one per core if not given")
+    args = parser.parse_args()
+    constants.HARDWARE_BACKEND = "sim"
+
+    values = {name: getattr(args, name) for name, _, _ in PARAMETERS}
+    configurations = grid(values) if args.random is None else random_configurations(values, args.random, args.seed)
+    if args.run is not None:
+        try:
+            run = analysis.load_run(args.run, args.duty_columns)
+            fit = replay.calibrate(run)
+        except (ValueError, OSError) as e:
+            sys.exit(str(e))
+        names = autotune.channel_names(args.run, run.numChannels)
+    else:
+        fit = autotune.FopdtFit(np.array([float(constants.SIM_TIME_CONSTANT)]),
+                                np.array([float(constants.SIM_HEATER_GAIN)]),
+                                np.array([float(constants.SIM_AMBIENT_TEMP)]), np.array([args.dead_time]),
+                                np.array([1.0]), np.array([0]))
+        names = ["Simulated tape"]
+    # a bake starts from cold
+    startTemps = fit.ambient.copy()
+
+    rows = run_sweep(configurations, fit, startTemps, names, args.target, args.results, args.workers,
+                     args.settle_time)
+    print("{:>6} {:>8} {:>6} {:>6} {:>10} {:>6} {:>11} {:>9}".format(
+        "ki", "rate C/m", "KP", "KD", "KI scaling", "large", "settle min", "iae C min"))
+    for configuration, settling, iae in best_configurations(rows):
+        print("{:>6.2f} {:>8.2f} {:>6.2f} {:>6.2f} {:>10.4f} {:>6.2f} {:>11.1f} {:>9.0f}".format(
+            *configuration, settling / 60, iae))
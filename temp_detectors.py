@@ -0,0 +1,139 @@
+from multiprocessing import Lock, RawArray
+import math
+
+import clocks
+import constants
+from hardware import GPIO, MAX6675, MAX6675Array, MAX6675SPI, MAX6675Error
+from thermal_plant import ThermalPlant, SimulatedMAX6675
+
+# every detector on the hardware SPI bus shares it, and they are read from different worker processes
+# so only one of them can be selected at a time
+spiLock = Lock()
+
+# A cache in front of a temperature detector
+# the MAX6675 only finishes a new conversion about every 220 ms and reading it sooner restarts the conversion,
+# so reads are sent to the chip on a schedule (one sample interval after the last read finished, never sooner than a
+# conversion) and everyone else gets the cached sample
+class SampledTempDetector:
+    """
+    Wraps a temperature detector so that it is only read once per sample interval (at least one conversion of the
+    MAX6675), and caches the last frame with the time it was read (from clocks). The cache is in shared memory, so
+    consumers in any process (the PID and safety checks in a worker, the UI and logger in the main process) all see
+    the same sample and can check how old it is. The frame and its time are only written and read together under a
+    lock, so no consumer sees one without the other.
+    """
+    def __init__(self, tempDetector : MAX6675, conversionTime : float=constants.MAX6675_CONVERSION_TIME,
+                 sampleInterval : float=None):
+        """
+        tempDetector: the detector to read from
+        conversionTime: how long the chip takes to make a new reading, in seconds
+        sampleInterval: how often to read the detector, in seconds. Defaults to (and is at least) conversionTime
+        """
+        self.tempDetector = tempDetector
+        self.conversionTime = conversionTime
+        self.sampleInterval = max(conversionTime, sampleInterval or conversionTime)
+        self.lock = Lock()
+        # the last frame, the time it was read, and when the next read is due
+        self.sample = RawArray('d', [math.nan, -math.inf, -math.inf])
+
+    def read(self) -> bool:
+        """
+        Reads the detector if the next read is due, otherwise does nothing. Returns whether it was read.
+        """
+        with self.lock:
+            if clocks.now() < self.sample[2]:
+                return False
+            # claimed, so a consumer in another process doesn't read it too while this one is (if the read fails,
+            # it is tried again at the next due time)
+            self.sample[2] = clocks.now() + self.sampleInterval
+        self.tempDetector.read()
+        with self.lock:
+            self.sample[0] = self.tempDetector.data
+            self.sample[1] = clocks.now()
+            self.sample[2] = self.sample[1] + self.sampleInterval   # the chip starts converting once it is read
+        return True
+
+    def snapshot(self) -> tuple[float, float]:
+        """Returns the cached frame (NaN if there is none yet) and the time it was read, taken together."""
+        with self.lock:
+            return self.sample[0], self.sample[1]
+
+    def get(self) -> float:
+        """
+        Returns the current temperature, reading the detector first only if the next read is due. This is what the
+        control loop reads, so it raises MAX6675Error if the thermocouple is not connected or the sample is stale
+        (another consumer's read of it hasn't finished in time), and the system is marked unreliable like for any
+        failed reading.
+        """
+        self.read()
+        temperature = self.last()
+        if self.is_stale():
+            raise MAX6675Error("The last reading is {:.1f} s old".format(self.age()))
+        return temperature
+
+    def last(self) -> float:
+        """
+        Returns the cached temperature without reading the detector. Raises MAX6675Error if there is no sample yet or
+        the thermocouple was not connected when it was taken.
+        """
+        frame, _ = self.snapshot()
+        if math.isnan(frame):
+            raise MAX6675Error("No reading yet")
+        data_16 = int(frame)
+        self.tempDetector.checkErrors(data_16)
+        return getattr(self.tempDetector, "to_" + self.tempDetector.units)(
+            self.tempDetector.data_to_tc_temperature(data_16))
+
+    def age(self) -> float:
+        """Returns how many seconds ago the cached sample was read (infinity if it never was)."""
+        return clocks.now() - self.snapshot()[1]
+
+    def is_stale(self, maxAge : float=constants.MAX_SAMPLE_AGE) -> bool:
+        """Returns whether the cached sample is too old to be trusted."""
+        return self.age() > maxAge
+
+    def cleanup(self) -> None:
+        self.tempDetector.cleanup()
+
+# Creates the temperature detector for one system using the backend chosen in constants
+def create_temp_detector(cs_pin : int, clock_pin : int, data_pin : int) -> MAX6675:
+    """
+    Creates a temperature detector for the given pins (BOARD numbering) using constants.TEMP_DETECTOR_BACKEND. If the
+    hardware SPI bus is chosen but can't be used, the bit banged driver is used instead.
+
+    cs_pin: the chip select pin of the MAX6675
+    clock_pin: the clock pin, only used when bit banging
+    data_pin: the data pin, only used when bit banging
+    """
+    if constants.TEMP_DETECTOR_BACKEND == "spidev":
+        try:
+            return MAX6675SPI(constants.SPI_BUS, constants.SPI_DEVICE, cs_pin=cs_pin, units="c", board=GPIO.BOARD,
+                              max_speed_hz=constants.SPI_MAX_SPEED_HZ, lock=spiLock)
+        except (MAX6675Error, OSError) as e:
+            print("Could not read chip select {} over the hardware SPI bus ({}), bit banging it instead.".format(
+                cs_pin, e))
+    return MAX6675(cs_pin, clock_pin, data_pin, units="c", board=GPIO.BOARD)
+
+# Creates the temperature detectors for all the systems
+# for the "array" backend they are channels of a single MAX6675Array which has to be read every iteration
+# on the simulated hardware they are all on tapes of one ThermalPlant, heated by the systems' relays
+def create_temp_detectors(csPins : list[int], clockPins : list[int], dataPins : list[int],
+                          relayPins : list[int]=None) -> tuple[list[SampledTempDetector], MAX6675Array | None]:
+    """
+    Creates the temperature detectors for all the systems using constants.TEMP_DETECTOR_BACKEND. The pins are given in
+    system order (BOARD numbering). Each detector is wrapped in a SampledTempDetector.
+
+    relayPins: the relay pin of each system, only used with the simulated hardware (constants.HARDWARE_BACKEND)
+    to know which relay heats which tape
+
+    returns: the temperature detector of each system, and the MAX6675Array they belong to if the "array" backend is
+    used (None otherwise). The array must be read once per iteration before any of its detectors are.
+    """
+    if constants.HARDWARE_BACKEND == "sim":
+        plant = ThermalPlant(relayPins, noise=constants.SIM_NOISE, seed=constants.SIM_SEED)
+        return [SampledTempDetector(SimulatedMAX6675(plant, i)) for i in range(len(relayPins))], None
+    if constants.TEMP_DETECTOR_BACKEND == "array":
+        sensorArray = MAX6675Array(csPins, clockPins, dataPins, units="c", board=GPIO.BOARD)
+        return [SampledTempDetector(sensorArray.channel(i)) for i in range(len(csPins))], sensorArray
+    return [SampledTempDetector(create_temp_detector(cs, clk, data)) 
+            for cs, clk, data in zip(csPins, clockPins, dataPins)], None
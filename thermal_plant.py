@@ -0,0 +1,91 @@
+from multiprocessing import Lock, RawArray
+import math
+import random
+
+import clocks
+import constants
+import fake_gpio
+from hardware import MAX6675
+
+# A model of the heater tapes for running the program without any hardware
+# Each tape is a first order system: it heats towards the ambient temperature plus heaterGain times the fraction of
+# the time its relay was on, and gets there with the time constant found by fitting the cooling curves in the
+# notebook. The relay times come from fake_gpio, so whatever the relay scheduler does is what heats the tape.
+class ThermalPlant:
+    """
+    The simulated temperatures of one or more heater tapes, each heated by the relay on the matching pin. The state is
+    in shared memory so tapes can be read from any process. Each tape is only moved forward in time when it is read,
+    using the exact solution for a constant heater power over the time since it was last read.
+    """
+    def __init__(self, relayPins : list[int], ambient : float | list[float]=constants.SIM_AMBIENT_TEMP,
+                 timeConstant : float | list[float]=constants.SIM_TIME_CONSTANT,
+                 heaterGain : float | list[float]=constants.SIM_HEATER_GAIN, noise : float=constants.SIM_NOISE,
+                 seed : int=None):
+        """
+        relayPins: the relay pin that heats each tape
+        ambient: the temperature each tape cools to with its heater off (degrees Celsius)
+        timeConstant: how quickly each tape heats up and cools down, in seconds
+        heaterGain: how many degrees above ambient each tape would settle at with its heater always on
+        noise: the standard deviation of the noise added to each reading (degrees Celsius)
+        seed: the seed of the noise, for repeatable runs (each tape gets its own stream from it)
+        """
+        n = len(relayPins)
+        def per_tape(value : float | list[float]) -> list[float]:
+            return list(value) if isinstance(value, (list, tuple)) else [value] * n
+        self.relayPins = list(relayPins)
+        self.ambient = per_tape(ambient)
+        self.timeConstant = per_tape(timeConstant)
+        self.heaterGain = per_tape(heaterGain)
+        self.noise = noise
+        # a separate noise stream for each tape, so a tape's readings don't depend on which process reads it
+        self.randoms = [random.Random(None if seed is None else "{}-{}".format(seed, i)) for i in range(n)]
+        self.lock = Lock()
+        # for each tape: its temperature, when it was last moved forward, and its relay's time on at that point
+        self.state = RawArray('d', 3 * n)
+        now = clocks.now()
+        for i in range(n):
+            self.state[3 * i] = self.ambient[i]
+            self.state[3 * i + 1] = now
+            self.state[3 * i + 2] = fake_gpio.time_high(self.relayPins[i], now)
+
+    def temperature(self, tape : int) -> float:
+        """Moves the tape forward to the current time and returns its true temperature."""
+        now = clocks.now()
+        with self.lock:
+            temp, lastTime, lastTimeHigh = self.state[3 * tape : 3 * tape + 3]
+            timeHigh = fake_gpio.time_high(self.relayPins[tape], now)
+            dt = now - lastTime
+            if dt > 0:
+                dutyCycle = (timeHigh - lastTimeHigh) / dt
+                settleTemp = self.ambient[tape] + self.heaterGain[tape] * dutyCycle
+                temp = settleTemp + (temp - settleTemp) * math.exp(-dt / self.timeConstant[tape])
+                self.state[3 * tape : 3 * tape + 3] = [temp, now, timeHigh]
+        return temp
+
+    def reading(self, tape : int) -> float:
+        """Returns what a thermocouple on the tape reads: its temperature with noise added."""
+        return self.temperature(tape) + self.randoms[tape].gauss(0, self.noise)
+
+# A MAX6675 that reads a tape of a ThermalPlant instead of the SPI bus
+# it makes the same 16 bit frames as the chip, so readings have its 0.25 degree resolution and go through the same
+# error checks and conversions as the real ones
+class SimulatedMAX6675(MAX6675):
+    """A MAX6675 whose thermocouple is on a simulated tape. Has the same interface as the real driver."""
+    def __init__(self, plant : ThermalPlant, tape : int, units : str="c"):
+        """
+        plant: the simulated heater tapes
+        tape: which of the plant's tapes the thermocouple is on
+        units: unit of measurement to return. ("c" (default) | "k" | "f")
+        """
+        self.plant = plant
+        self.tape = tape
+        self.units = units
+        self.data = None
+
+    def read(self) -> None:
+        '''Reads the simulated tape & stores the frame the chip would send as an integer in self.data.'''
+        counts = min(max(int(self.plant.reading(self.tape) / 0.25), 0), 0xFFF)
+        self.data = counts << 3
+
+    def cleanup(self) -> None:
+        pass